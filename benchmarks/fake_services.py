@@ -0,0 +1,330 @@
+"""
+Servidores HTTP locais que imitam as partes da API REST do Jira e da API da
+OpenAI usadas pelo agente, com latência, taxa de erro e tamanho de payload
+configuráveis. Usados pelos benchmarks para medir o agente sem rede externa.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class ServiceProfile:
+    """
+    Comportamento de um serviço falso.
+    Args:
+        latency (float): Latência base de cada resposta, em segundos.
+        jitter (float): Variação aleatória somada à latência, em segundos.
+        error_rate (float): Fração das requisições respondidas com 429 ou 503.
+        retry_after (float): Valor do cabeçalho Retry-After enviado nos erros.
+        payload_size (int): Tamanho aproximado, em caracteres, das descrições
+            (Jira) ou do texto gerado (OpenAI).
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=0.0, payload_size=500):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.payload_size = payload_size
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class EventStream:
+    """
+    Resposta em server-sent events: os eventos são enviados ao longo da latência
+    configurada, simulando a geração token a token.
+    """
+
+    # Fração da latência até o primeiro evento
+    FIRST_EVENT_FRACTION = 0.1
+
+    def __init__(self, events):
+        self.events = events
+
+
+class _FakeServer:
+    """Base comum: servidor com threads, contadores de requisições e injeção de falhas."""
+
+    def __init__(self, profile=None, seed=0):
+        self.profile = profile or ServiceProfile()
+        self.requests = {}
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake._dispatch(self, "GET")
+
+            def do_POST(self):
+                fake._dispatch(self, "POST")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, route):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def _should_fail(self):
+        with self._lock:
+            failed = self._random.random() < self.profile.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def _dispatch(self, handler, method):
+        parsed = urlparse(handler.path)
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = json.loads(handler.rfile.read(length)) if length else None
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+        delay = self.profile.latency + self._random.uniform(0, self.profile.jitter)
+        streaming = bool(body and body.get("stream"))
+        first_delay = delay * EventStream.FIRST_EVENT_FRACTION if streaming else delay
+        if first_delay:
+            time.sleep(first_delay)
+
+        headers = {}
+        # A falha é decidida antes da rota para não alterar o estado do serviço
+        if parsed.path.rsplit("/", 1)[-1] not in self.exempt_routes and self._should_fail():
+            route, status = "error", self._random.choice((429, 503))
+            payload = {"error": {"message": "Falha simulada", "code": status}}
+            headers["Retry-After"] = str(self.profile.retry_after)
+        else:
+            route, status, payload = self.route(method, parsed.path, params, body)
+            self._count(route)
+
+        if isinstance(payload, EventStream):
+            self._send_event_stream(handler, payload, delay - first_delay)
+            return
+
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _send_event_stream(self, handler, stream, duration):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        pause = duration / max(1, len(stream.events))
+        for event in stream.events:
+            if pause:
+                time.sleep(pause)
+            handler.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            handler.wfile.flush()
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+
+    # Rotas que nunca falham (ex: handshake inicial do cliente)
+    exempt_routes = ()
+
+    def route(self, method, path, params, body):
+        raise NotImplementedError
+
+
+def _text(size, prefix="Lorem ipsum"):
+    words = f"{prefix} dolor sit amet consectetur adipiscing elit sed do eiusmod tempor ".split()
+    text, i = [], 0
+    while sum(len(word) + 1 for word in text) < size:
+        text.append(words[i % len(words)])
+        i += 1
+    return " ".join(text)
+
+
+class FakeJiraServer(_FakeServer):
+    """
+    Jira Server (API REST v2) com `total_stories` histórias no projeto `project_key`.
+    Atende serverInfo, field, search (startAt), search/jql (nextPageToken),
+    issue/{chave}, project/{chave} e issue/bulk. Os filtros da JQL são ignorados:
+    toda busca devolve todas as histórias.
+    """
+
+    exempt_routes = ("serverInfo", "field")
+
+    def __init__(self, total_stories=100, project_key="KCA", profile=None, seed=0):
+        super().__init__(profile, seed)
+        self.total_stories = total_stories
+        self.project_key = project_key
+        self.created_subtasks = 0
+        self._description = _text(self.profile.payload_size, "Como usuário quero")
+
+    def _issue(self, n):
+        return {
+            "id": str(10000 + n),
+            "key": f"{self.project_key}-{n}",
+            "fields": {
+                "summary": f"História de usuário {n}",
+                "description": f"{n}: {self._description}",
+                "status": {"name": "To Do"},
+                "updated": "2024-01-01T00:00:00.000+0000",
+            },
+        }
+
+    def _page(self, start, size):
+        end = min(start + size, self.total_stories)
+        return end, [self._issue(n) for n in range(start + 1, end + 1)]
+
+    def route(self, method, path, params, body):
+        prefix = "/rest/api/2/"
+        if not path.startswith(prefix):
+            return "unknown", 404, {}
+        resource = path[len(prefix):]
+
+        if resource == "serverInfo":
+            return resource, 200, {
+                "baseUrl": "http://127.0.0.1", "version": "9.12.0",
+                "versionNumbers": [9, 12, 0], "deploymentType": "Server",
+            }
+        if resource == "field":
+            return resource, 200, [
+                {"id": name, "name": name.title(), "custom": False}
+                for name in ("summary", "description", "status", "updated", "project")
+            ]
+        if resource == "search":
+            start = int(params.get("startAt", 0))
+            size = int(params.get("maxResults", 50))
+            _, issues = self._page(start, size)
+            return resource, 200, {
+                "startAt": start, "maxResults": size, "total": self.total_stories, "issues": issues,
+            }
+        if resource == "search/jql":
+            start = int(params.get("nextPageToken") or 0)
+            end, issues = self._page(start, int(params.get("maxResults", 50)))
+            page = {"issues": issues, "isLast": end >= self.total_stories}
+            if end < self.total_stories:
+                page["nextPageToken"] = str(end)
+            return resource, 200, page
+        if resource == "issue/bulk" and method == "POST":
+            updates = body.get("issueUpdates", [])
+            with self._lock:
+                first = self.created_subtasks
+                self.created_subtasks += len(updates)
+            return resource, 201, {"errors": [], "issues": [
+                {"id": str(900000 + first + i), "key": f"{self.project_key}-{900000 + first + i}",
+                 "self": f"{self.url}{prefix}issue/{900000 + first + i}"}
+                for i in range(len(updates))
+            ]}
+        if resource.startswith("issue/"):
+            return "issue", 200, {
+                "id": "1", "key": resource.split("/", 1)[1],
+                "fields": {"project": {"id": "10000", "key": self.project_key}},
+            }
+        if resource.startswith("project/"):
+            return "project", 200, {
+                "id": "10000", "key": self.project_key, "name": "Projeto de benchmark",
+                "issueTypes": [
+                    {"id": "10001", "name": "Story", "subtask": False},
+                    {"id": "10003", "name": "Sub-task", "subtask": True},
+                ],
+            }
+        return "unknown", 404, {}
+
+
+class FakeOpenAIServer(_FakeServer):
+    """
+    API compatível com a OpenAI que responde /v1/chat/completions com cenários fixos
+    no esquema JSON pedido pelo agente, inclusive em streaming (stream=true), com o
+    JSON dividido em trechos de `STREAM_CHUNK_SIZE` caracteres. Prompts em lote
+    (esquema "test_cases_batch") recebem os mesmos cenários para cada história
+    identificada por uma linha "### <chave>".
+    """
+
+    STREAM_CHUNK_SIZE = 32
+    USAGE = {"prompt_tokens": 200, "completion_tokens": 300, "total_tokens": 500}
+
+    def __init__(self, scenarios=3, profile=None, seed=0):
+        super().__init__(profile, seed)
+        self.scenarios = scenarios
+        step = _text(max(20, self.profile.payload_size // max(1, scenarios * 3)), "o usuário")
+        self._scenarios = [
+            {"title": f"Cenário {i}", "preconditions": [step], "steps": [step], "expected_result": step}
+            for i in range(1, scenarios + 1)
+        ]
+        self._content = json.dumps({"scenarios": self._scenarios}, ensure_ascii=False)
+
+    def route(self, method, path, params, body):
+        if path.rstrip("/") != "/v1/chat/completions" or method != "POST":
+            return "unknown", 404, {}
+        if body.get("stream"):
+            return "chat.completions", 200, EventStream(self._chunks(body))
+        content = self._content
+        schema = ((body.get("response_format") or {}).get("json_schema") or {}).get("name")
+        if schema == "test_cases_batch":
+            prompt = body["messages"][-1]["content"]
+            content = json.dumps({"stories": [
+                {"jira_key": key, "scenarios": self._scenarios}
+                for key in re.findall(r"^### (\S+)$", prompt, re.MULTILINE)
+            ]}, ensure_ascii=False)
+        return "chat.completions", 200, {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": self.USAGE,
+        }
+
+    def _chunks(self, body):
+        base = {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+        }
+        size = self.STREAM_CHUNK_SIZE
+        chunks = [
+            {**base, "choices": [{"index": 0, "delta": {"content": self._content[i:i + size]}, "finish_reason": None}]}
+            for i in range(0, len(self._content), size)
+        ]
+        chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunks.append({**base, "choices": [], "usage": self.USAGE})
+        return chunks
@@ -0,0 +1,469 @@
+"""
+Benchmarks do QA Agent.
+
+Mede, contra servidores locais que imitam o Jira e a OpenAI (fake_services.py):
+  - QAAgent.run_once nos modos com threads e assíncrono;
+  - operações do DBManager com 1k, 10k e 100k histórias;
+  - as rotas index e view_story da aplicação Flask;
+  - a inicialização: importação de web_app e main (python -X importtime) e a
+    criação do QAAgent em um processo novo.
+
+Os resultados são gravados em benchmarks/results/<commit>.json para comparação
+entre commits.
+
+Uso:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --only agent --stories 500 --openai-latency 0.2
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/abc123.json benchmarks/results/def456.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from fake_services import FakeJiraServer, FakeOpenAIServer, ServiceProfile
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+# Limites generosos para que o benchmark meça o agente, não o RateLimiter;
+# podem ser sobrescritos pelo ambiente
+BENCHMARK_ENV_DEFAULTS = {
+    "JIRA_RATE_LIMIT_PER_SECOND": "10000",
+    "OPENAI_RATE_LIMIT_PER_SECOND": "10000",
+    "RETRY_BASE_DELAY": "0.01",
+    "RETRY_MAX_DELAY": "0.1",
+}
+
+# Modos do agente medidos: nome e argumentos do QAAgent
+AGENT_MODES = (
+    ("sync", {"use_async": False}),
+    ("async", {"use_async": True}),
+    ("sync.stream", {"use_async": False, "streaming": True}),
+    ("async.stream", {"use_async": True, "streaming": True}),
+    ("sync.batch", {"use_async": False, "batch_prompts": True}),
+    ("async.batch", {"use_async": True, "batch_prompts": True}),
+    ("queue", {"use_async": False, "workers": 4}),
+)
+
+
+@contextlib.contextmanager
+def environ(values):
+    """Define variáveis de ambiente durante o bloco, restaurando as anteriores."""
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@contextlib.contextmanager
+def quiet():
+    """Descarta prints e logs INFO do agente, que distorceriam as medições."""
+    logging.disable(logging.INFO)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def measure(fn, repeat=3, number=1):
+    """
+    Executa `fn` `number` vezes por rodada, em `repeat` rodadas.
+    Returns:
+        dict: Mediana, mínimo e máximo, em segundos por execução.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "seconds": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def reset_rate_limiters():
+    """Descarta os limitadores compartilhados para que uma execução não herde o estado da anterior."""
+    import rate_limiter
+    with rate_limiter._limiters_lock:
+        rate_limiter._limiters.clear()
+
+
+def bench_agent(args, use_async, streaming=False, batch_prompts=False, workers=0):
+    """Tempo de QAAgent.run_once processando `args.stories` histórias novas."""
+    from main import QAAgent
+
+    samples, last = [], {}
+    for _ in range(args.repeat):
+        jira_profile = ServiceProfile(args.jira_latency, args.jitter, args.error_rate,
+                                      args.retry_after, args.payload_size)
+        openai_profile = ServiceProfile(args.openai_latency, args.jitter, args.error_rate,
+                                        args.retry_after, args.payload_size)
+        with FakeJiraServer(args.stories, profile=jira_profile) as jira, \
+                FakeOpenAIServer(profile=openai_profile) as openai, \
+                tempfile.TemporaryDirectory() as tmp_dir:
+            env = {
+                "JIRA_SERVER": jira.url,
+                "JIRA_USERNAME": "benchmark",
+                "JIRA_API_TOKEN": "benchmark",
+                "JIRA_PROJECT_KEY": jira.project_key,
+                "JIRA_DEPLOYMENT": "server",
+                "OPENAI_API_KEY": "benchmark",
+                "OPENAI_BASE_URL": f"{openai.url}/v1",
+                "QA_AGENT_DB_PATH": os.path.join(tmp_dir, "qa_agent.db"),
+            }
+            with environ(env), quiet():
+                reset_rate_limiters()
+                agent = QAAgent(use_async=use_async, streaming=streaming, batch_prompts=batch_prompts,
+                                workers=workers)
+                start = time.perf_counter()
+                agent.run_once()
+                samples.append(time.perf_counter() - start)
+                agent.db_manager.close()
+            last = {
+                "stages": agent.last_cycle_stats.summary() if agent.last_cycle_stats else {},
+                "jira_requests": dict(jira.requests),
+                "openai_requests": dict(openai.requests),
+                "injected_errors": jira.errors + openai.errors,
+                "subtasks_created": jira.created_subtasks,
+            }
+
+    median = statistics.median(samples)
+    return {
+        "seconds": median,
+        "min": min(samples),
+        "max": max(samples),
+        "repeat": args.repeat,
+        "stories": args.stories,
+        "stories_per_second": args.stories / median if median else None,
+        **last,
+    }
+
+
+def make_story(n, payload_size):
+    return {
+        "jira_key": f"KCA-{n}",
+        "title": f"História de usuário {n}",
+        "description": f"{n}: " + "Como usuário quero " * max(1, payload_size // 19),
+        "status": "To Do",
+    }
+
+
+def make_test_case(n, payload_size):
+    step = "o usuário executa a ação " * max(1, payload_size // 75)
+    return f"Cenário: Caso {n}\nDado que {step}\nQuando {step}\nEntão {step}"
+
+
+def seed_database(db_manager, size, payload_size, results, prefix):
+    stories = [make_story(n, payload_size) for n in range(1, size + 1)]
+    start = time.perf_counter()
+    story_ids = db_manager.bulk_upsert_user_stories(stories)
+    results[f"{prefix}.bulk_upsert_user_stories.insert"] = {
+        "seconds": time.perf_counter() - start, "repeat": 1, "number": 1,
+    }
+    start = time.perf_counter()
+    db_manager.bulk_save_test_cases(
+        (story_ids[story["jira_key"]], make_test_case(n, payload_size))
+        for n, story in enumerate(stories, start=1)
+    )
+    results[f"{prefix}.bulk_save_test_cases.insert"] = {
+        "seconds": time.perf_counter() - start, "repeat": 1, "number": 1,
+    }
+    return stories, sorted(story_ids.values())
+
+
+def bench_database(args, size, db_path):
+    """Operações do DBManager sobre um banco com `size` histórias e um caso de teste por história."""
+    from db_manager import DBManager
+
+    prefix = f"db.{size}"
+    results = {}
+    rng = random.Random(size)
+    with quiet():
+        db_manager = DBManager(db_path=db_path)
+    try:
+        with quiet():
+            stories, ids = seed_database(db_manager, size, args.payload_size, results, prefix)
+            batch = stories[:min(size, 500)]
+            results[f"{prefix}.bulk_upsert_user_stories.update_500"] = measure(
+                lambda: db_manager.bulk_upsert_user_stories(batch), args.repeat)
+            results[f"{prefix}.save_user_story"] = measure(
+                lambda: db_manager.save_user_story(**rng.choice(stories)), args.repeat, number=100)
+            results[f"{prefix}.get_story_ids_with_test_cases_100"] = measure(
+                lambda: db_manager.get_story_ids_with_test_cases(rng.sample(ids, min(100, size))),
+                args.repeat, number=10)
+            results[f"{prefix}.get_all_user_stories"] = measure(
+                db_manager.get_all_user_stories, args.repeat)
+            results[f"{prefix}.list_user_stories"] = measure(
+                lambda: db_manager.list_user_stories(limit=30), args.repeat, number=100)
+            results[f"{prefix}.search_user_stories"] = measure(
+                lambda: db_manager.search_user_stories(f"usuário {rng.randint(1, size)}", limit=30),
+                args.repeat, number=20)
+            results[f"{prefix}.get_user_story"] = measure(
+                lambda: db_manager.get_user_story(rng.choice(ids)), args.repeat, number=1000)
+            results[f"{prefix}.get_test_cases_for_story"] = measure(
+                lambda: db_manager.get_test_cases_for_story(rng.choice(ids)), args.repeat, number=1000)
+            results[f"{prefix}.get_last_watermark"] = measure(
+                lambda: db_manager.get_last_watermark("KCA"), args.repeat, number=1000)
+
+            # Histórias quase idênticas: assinaturas de todas as histórias e busca na matriz
+            from similarity import SimilarityIndex
+            index = SimilarityIndex(db_manager, refresh_seconds=float("inf"))
+            start = time.perf_counter()
+            index.refresh()
+            results[f"{prefix}.similarity.build_signatures"] = {
+                "seconds": time.perf_counter() - start, "repeat": 1, "number": 1,
+            }
+            results[f"{prefix}.similarity.refresh"] = measure(index.refresh, args.repeat)
+
+            def find_similar():
+                story = rng.choice(stories)
+                return index.find(story["title"], story["description"])
+
+            results[f"{prefix}.similarity.find"] = measure(find_similar, args.repeat, number=100)
+        results[f"{prefix}.file_size_bytes"] = os.path.getsize(db_path)
+    finally:
+        db_manager.close()
+    return results, ids
+
+
+def bench_web(args, size, db_path, ids):
+    """Rotas index e view_story da aplicação Flask sobre o banco gerado por bench_database."""
+    from db_manager import DBManager
+    with environ({"QA_AGENT_DB_PATH": db_path}), quiet():
+        import web_app
+        # O módulo é importado uma vez; cada tamanho de banco troca o gerenciador global
+        web_app.db_manager = DBManager(db_path=db_path)
+
+    prefix = f"web.{size}"
+    results = {}
+    rng = random.Random(size)
+    client = web_app.app.test_client()
+    try:
+        with quiet():
+            def get(url):
+                response = client.get(url)
+                assert response.status_code == 200, (url, response.status_code)
+                return response
+
+            index_bytes = len(get("/").data)
+            results[f"{prefix}.index"] = measure(lambda: get("/"), args.web_repeat)
+            results[f"{prefix}.index"]["response_bytes"] = index_bytes
+            results[f"{prefix}.search"] = measure(
+                lambda: get(f"/?q=usuário {rng.randint(1, size)}"), args.web_repeat, number=20)
+            results[f"{prefix}.view_story"] = measure(
+                lambda: get(f"/story/{rng.choice(ids)}"), args.web_repeat, number=20)
+            etags = {story_id: get(f"/story/{story_id}").headers["ETag"] for story_id in ids[:20]}
+
+            def revalidate():
+                story_id = rng.choice(ids[:20])
+                response = client.get(f"/story/{story_id}", headers={"If-None-Match": etags[story_id]})
+                assert response.status_code == 304, response.status_code
+
+            results[f"{prefix}.view_story_not_modified"] = measure(revalidate, args.web_repeat, number=20)
+    finally:
+        web_app.db_manager.close()
+    return results
+
+
+# Módulos de entrada cuja importação é medida em um processo novo
+STARTUP_MODULES = ("web_app", "main")
+
+
+def _run_python(code, env, *options):
+    return subprocess.run(
+        [sys.executable, *options, "-c", code], cwd=os.path.join(ROOT_DIR, "src"), env=env,
+        capture_output=True, text=True, check=True,
+    )
+
+
+def import_time(module, env):
+    """
+    Returns:
+        tuple: (segundos acumulados na importação de `module`, módulos importados),
+            segundo `python -X importtime`.
+    """
+    stderr = _run_python(f"import {module}", env, "-X", "importtime").stderr
+    lines = [line for line in stderr.splitlines() if line.startswith("import time:") and "|" in line]
+    cumulative = next(int(line.split("|")[1]) for line in reversed(lines) if line.split("|")[2].strip() == module)
+    return cumulative / 1_000_000, len(lines) - 1
+
+
+def bench_startup(args):
+    """Custo de inicialização em processos novos, como no cron com --once ou na aplicação web."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Banco já migrado, como em produção; Jira inacessível: nada deve conectar
+        env = dict(os.environ, QA_AGENT_DB_PATH=os.path.join(tmp_dir, "qa_agent.db"),
+                   JIRA_SERVER="http://127.0.0.1:9", LOG_LEVEL="WARNING")
+        _run_python("import db_manager; db_manager.DBManager()", env)
+        for module in STARTUP_MODULES:
+            samples = [import_time(module, env) for _ in range(args.repeat)]
+            seconds = [sample[0] for sample in samples]
+            results[f"startup.import.{module}"] = {
+                "seconds": statistics.median(seconds), "min": min(seconds), "max": max(seconds),
+                "repeat": args.repeat, "modules": samples[0][1],
+            }
+        code = ("import time; start = time.perf_counter(); import main; main.QAAgent(workers=0); "
+                "print(time.perf_counter() - start)")
+        seconds = [float(_run_python(code, env).stdout.split()[-1]) for _ in range(args.repeat)]
+        results["startup.qa_agent"] = {
+            "seconds": statistics.median(seconds), "min": min(seconds), "max": max(seconds), "repeat": args.repeat,
+        }
+    return results
+
+
+def git_revision():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD", "--", "src"], cwd=ROOT_DIR).returncode
+        return f"{sha}-dirty" if dirty else sha
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    for name, value in BENCHMARK_ENV_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+
+    report = {
+        "revision": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "results": {},
+    }
+    results = report["results"]
+
+    if "startup" in args.only:
+        print("Inicialização...")
+        results.update(bench_startup(args))
+
+    if "agent" in args.only:
+        for mode, options in AGENT_MODES:
+            print(f"Agente ({mode}): {args.stories} histórias...")
+            results[f"agent.run_once.{mode}"] = bench_agent(args, **options)
+
+    if "db" in args.only or "web" in args.only:
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db_path = os.path.join(tmp_dir, "qa_agent.db")
+                print(f"Banco de dados: {size} histórias...")
+                db_results, ids = bench_database(args, size, db_path)
+                if "db" in args.only:
+                    results.update(db_results)
+                if "web" in args.only:
+                    print(f"Aplicação web: {size} histórias...")
+                    results.update(bench_web(args, size, db_path, ids))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print_report(report)
+    print(f"Resultados gravados em {output}")
+    return report
+
+
+def print_report(report):
+    print(f"\nRevisão {report['revision']} ({report['created_at']})")
+    for name, values in report["results"].items():
+        if isinstance(values, dict):
+            extra = ""
+            if values.get("stories_per_second"):
+                per_story = values.get("stages", {}).get("stories", {}).get("avg_seconds", 0.0)
+                extra = f"  ({values['stories_per_second']:.1f} histórias/s, {per_story * 1000:.0f} ms/história)"
+            print(f"  {name:<55} {values['seconds'] * 1000:>12.3f} ms{extra}")
+
+
+def compare(base_path, current_path, threshold):
+    """
+    Compara dois arquivos de resultados, métrica a métrica.
+    Returns:
+        list: Nomes das métricas que ficaram mais de `threshold` (fração) mais lentas.
+    """
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(current_path, encoding="utf-8") as f:
+        current = json.load(f)
+
+    print(f"Base: {base['revision']}  Atual: {current['revision']}")
+    print(f"  {'métrica':<55} {'base (ms)':>12} {'atual (ms)':>12} {'variação':>10}")
+    regressions = []
+    for name, values in current["results"].items():
+        before = base["results"].get(name)
+        if not isinstance(values, dict) or not isinstance(before, dict):
+            continue
+        old, new = before["seconds"], values["seconds"]
+        change = (new - old) / old if old else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  <- regressão"
+            regressions.append(name)
+        print(f"  {name:<55} {old * 1000:>12.3f} {new * 1000:>12.3f} {change:>+9.1%}{flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do QA Agent")
+    parser.add_argument("--only", nargs="+", choices=["startup", "agent", "db", "web"],
+                        default=["startup", "agent", "db", "web"],
+                        help="Grupos de benchmarks a executar")
+    parser.add_argument("--stories", type=int, default=200, help="Histórias servidas pelo Jira falso")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=[1000, 10000, 100000], help="Tamanhos do banco, separados por vírgula")
+    parser.add_argument("--repeat", type=int, default=3, help="Rodadas de cada medição")
+    parser.add_argument("--web-repeat", type=int, default=3, help="Rodadas das medições das rotas Flask")
+    parser.add_argument("--jira-latency", type=float, default=0.02, help="Latência do Jira falso (s)")
+    parser.add_argument("--openai-latency", type=float, default=0.1, help="Latência da OpenAI falsa (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variação aleatória da latência (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 429/503")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After das respostas de erro (s)")
+    parser.add_argument("--payload-size", type=int, default=1500,
+                        help="Tamanho aproximado de descrições e casos de teste (caracteres)")
+    parser.add_argument("--output", help="Arquivo de resultados (padrão: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "ATUAL"),
+                        help="Compara dois arquivos de resultados em vez de executar os benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Piora relativa considerada regressão no --compare (padrão: 0.10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        regressions = compare(*args.compare, threshold=args.threshold)
+        return 1 if regressions else 0
+    run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,218 +1,1450 @@
 import os
+import hashlib
+import json
+import logging
+import re
 import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
 from datetime import datetime
 import time
 
+from metrics import DB_QUERY_SECONDS, timed
+from pipeline import chunked
+from rendering import render_test_case_html
+from scenarios import Scenario
+
+logger = logging.getLogger(__name__)
+
+# Ajustes de desempenho aplicados a cada conexão (podem ser sobrescritos via .env)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "30000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "65536"))
+
+
+def _search_terms(query, max_terms=10):
+    """Palavras da busca, sem a sintaxe de consulta do FTS5 (aspas, operadores, etc.)."""
+    return re.findall(r"\w+", query or "")[:max_terms]
+
+
+def _escape_glob(value):
+    return re.sub(r"([*?\[])", r"[\1]", value)
+
+
+def content_hash(content):
+    """Hash SHA-256 (hex) usado para deduplicar conteúdos longos."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def story_hash(title, description):
+    """Hash do conteúdo de uma história que é enviado ao modelo (título e descrição)."""
+    return content_hash(f"{title}\n{description}")
+
+
+def subtask_hash(summary, description):
+    """Hash do conteúdo de uma subtarefa; com a chave da história, identifica a publicação."""
+    return content_hash(f"{summary}\n{description}")
+
+
+class _PooledConnection:
+    """Conexão SQLite pertencente a uma única thread."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.transaction_depth = 0
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+
 class DBManager:
+    """
+    Acesso ao banco SQLite do agente.
+
+    Mantém uma conexão de longa duração por thread (o Flask e a thread do agente
+    usam conexões distintas) em modo WAL, o que permite leituras concorrentes com
+    uma escrita em andamento. Escritas de vários comandos devem usar
+    `transaction()`; comandos isolados são confirmados automaticamente.
+    """
+
     def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.getenv("QA_AGENT_DB_PATH")
         if db_path is None:
             self.db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/qa_agent.db'))
         else:
             self.db_path = os.path.abspath(db_path)
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
 
-        self.conn = None
-        self.cursor = None
+        self._local = threading.local()
+        # Referências fracas: a conexão de uma thread encerrada é liberada junto com ela
+        self._pool = weakref.WeakSet()
+        self._pool_lock = threading.Lock()
 
         self._init_db()
+        # FTS5 pode não estar compilado no SQLite; nesse caso a busca usa LIKE
+        self.full_text_search = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_stories_fts'"
+        ).fetchone() is not None
+
+    def _open_connection(self):
+        try:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                isolation_level=None,  # autocommit; transações explícitas via transaction()
+                check_same_thread=False,  # permite que close() feche conexões de outras threads
+            )
+        except sqlite3.Error as e:
+            logger.error("Erro ao conectar ao banco de dados: %s", e)
+            raise
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _pooled(self):
+        pooled = getattr(self._local, "pooled", None)
+        if pooled is None:
+            pooled = _PooledConnection(self._open_connection())
+            self._local.pooled = pooled
+            with self._pool_lock:
+                self._pool.add(pooled)
+        return pooled
+
+    @property
+    def conn(self):
+        """Conexão da thread atual (aberta sob demanda)."""
+        return self._pooled().conn
+
+    @property
+    def cursor(self):
+        """Cursor reutilizável da conexão da thread atual."""
+        return self._pooled().cursor
 
     def connect(self):
-        if self.conn is None:
-            try:
-                self.conn = sqlite3.connect(self.db_path)
-                self.conn.row_factory = sqlite3.Row
-                self.cursor = self.conn.cursor()
-                print(f"Conexão com o banco de dados estabelecida: {self.db_path}")
-            except sqlite3.Error as e:
-                print(f"Erro ao conectar ao banco de dados: {e}")
-                raise
+        """Garante que a thread atual possui uma conexão aberta."""
+        self._pooled()
 
     def _disconnect(self):
-        if self.conn:
-            self.conn.close()
-            self.conn = None
-            self.cursor = None
-            print("Conexão com o banco de dados fechada.")
+        """Fecha a conexão da thread atual; a próxima operação abre outra."""
+        pooled = getattr(self._local, "pooled", None)
+        if pooled is not None:
+            self._local.pooled = None
+            with self._pool_lock:
+                self._pool.discard(pooled)
+            pooled.close()
+
+    def close(self):
+        """Fecha as conexões de todas as threads."""
+        with self._pool_lock:
+            pooled_connections = list(self._pool)
+            self._pool.clear()
+        for pooled in pooled_connections:
+            pooled.close()
+        self._local = threading.local()
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """
+        Executa um bloco dentro de uma transação, com commit ao final ou rollback
+        em caso de exceção. Blocos aninhados participam da transação externa.
+        Args:
+            immediate (bool): Usa BEGIN IMMEDIATE, reservando o lock de escrita já
+                no início e evitando "database is locked" ao promover uma leitura.
+        Yields:
+            sqlite3.Cursor: Cursor da conexão da thread atual.
+        """
+        pooled = self._pooled()
+        if pooled.transaction_depth == 0:
+            pooled.conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        pooled.transaction_depth += 1
+        try:
+            yield pooled.cursor
+        except BaseException:
+            pooled.transaction_depth -= 1
+            if pooled.transaction_depth == 0:
+                pooled.conn.rollback()
+            raise
+        else:
+            pooled.transaction_depth -= 1
+            if pooled.transaction_depth == 0:
+                pooled.conn.commit()
+
+    # Migrações aplicadas em ordem; o número da última aplicada fica em PRAGMA user_version.
+    # Cada migração deve ser idempotente, pois bancos anteriores a este controle podem
+    # já conter parte das alterações.
+    MIGRATIONS = (
+        "_migrate_sync_watermark",
+        "_migrate_generation_cache",
+        "_migrate_test_case_hashes",
+        "_migrate_full_text_search",
+        "_migrate_test_case_html",
+        "_migrate_generation_progress",
+        "_migrate_scenarios",
+        "_migrate_jobs",
+        "_migrate_story_change_tracking",
+        "_migrate_webhook_deliveries",
+        "_migrate_process_heartbeats",
+        "_migrate_published_subtasks",
+        "_migrate_story_signatures",
+        "_migrate_test_case_tokens",
+    )
 
     def _init_db(self):
-        print(f"Inicializando o banco de dados em {self.db_path}...")
+        # Banco já na versão atual: uma leitura de PRAGMA, sem transação de escrita
+        # nem CREATE TABLE a cada inicialização (web, cron com --once, processos da fila)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] == len(self.MIGRATIONS):
+            return
+        logger.info("Inicializando o banco de dados em %s...", self.db_path)
         try:
-            self.connect()
-            self.cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_stories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    jira_key TEXT NOT NULL,
-                    title TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(jira_key)
+            with self.transaction() as cursor:
+                cursor.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS user_stories (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        jira_key TEXT NOT NULL,
+                        title TEXT NOT NULL,
+                        description TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE(jira_key)
+                    )
+                    """
                 )
-                """
-            )
-            print("Tabela user_stories verificada/criada.")
 
-            self.cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS test_cases (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_story_id INTEGER NOT NULL,
-                    content TEXT NOT NULL,
-                    generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(user_story_id) REFERENCES user_stories(id)
+                cursor.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS test_cases (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_story_id INTEGER NOT NULL,
+                        content TEXT NOT NULL,
+                        generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY(user_story_id) REFERENCES user_stories(id)
+                    )
+                    """
                 )
-                """
+
+                cursor.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS sync_logs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        sync_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                    """
+                )
+
+                self._migrate(cursor)
+            logger.info("Banco de dados inicializado com sucesso.")
+        except Exception as e:
+            logger.error("Erro ao inicializar o banco de dados: %s", e)
+            raise
+
+    def _migrate(self, cursor):
+        """Aplica, na mesma transação, as migrações ainda não registradas no banco."""
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for number, name in enumerate(self.MIGRATIONS[version:], start=version + 1):
+            logger.info("Aplicando migração %s: %s", number, name)
+            getattr(self, name)(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+
+    def _ensure_column(self, cursor, table, column, declaration):
+        """Adiciona a coluna à tabela caso ela ainda não exista (bancos antigos)."""
+        columns = {row["name"] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+    def _migrate_sync_watermark(self, cursor):
+        # Marca d'água da busca incremental por projeto
+        self._ensure_column(cursor, "sync_logs", "project_key", "TEXT")
+        self._ensure_column(cursor, "sync_logs", "watermark", "TIMESTAMP")
+
+    def _migrate_generation_cache(self, cursor):
+        # Cache das gerações da OpenAI, indexado pelo hash do prompt
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS generation_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                hit_count INTEGER NOT NULL DEFAULT 0
             )
-            print("Tabela test_cases verificada/criada.")
+            """
+        )
 
-            self.cursor.execute(
+    def _migrate_test_case_hashes(self, cursor):
+        # Deduplicação por hash do conteúdo em vez de comparar o texto completo
+        self._ensure_column(cursor, "test_cases", "content_hash", "TEXT")
+        self.conn.create_function("qa_content_hash", 1, content_hash, deterministic=True)
+        cursor.execute("UPDATE test_cases SET content_hash = qa_content_hash(content) WHERE content_hash IS NULL")
+        # Remove duplicatas já existentes, mantendo o registro mais antigo
+        cursor.execute(
+            """
+            DELETE FROM test_cases WHERE id NOT IN (
+                SELECT MIN(id) FROM test_cases GROUP BY user_story_id, content_hash
+            )
+            """
+        )
+        cursor.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_test_cases_story_hash
+            ON test_cases(user_story_id, content_hash)
+            """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_test_cases_story_generated
+            ON test_cases(user_story_id, generated_at DESC)
+            """
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_stories_created ON user_stories(created_at)")
+
+    def _migrate_full_text_search(self, cursor):
+        # Filtro por status na listagem paginada (created_at DESC, id DESC)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_user_stories_status_created ON user_stories(status, created_at)"
+        )
+        # Índices FTS5 de conteúdo externo sobre histórias e casos de teste,
+        # mantidos por triggers; remove_diacritics permite buscar "cenario" por "Cenário"
+        try:
+            cursor.execute(
                 """
-                CREATE TABLE IF NOT EXISTS sync_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sync_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                CREATE VIRTUAL TABLE IF NOT EXISTS user_stories_fts USING fts5(
+                    title, description,
+                    content='user_stories', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
                 )
                 """
             )
-            print("Tabela sync_logs verificada/criada.")
+        except sqlite3.OperationalError as e:
+            logger.info("FTS5 indisponível (%s); a busca usará LIKE.", e)
+            return
+        cursor.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS test_cases_fts USING fts5(
+                content,
+                content='test_cases', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """
+        )
+        for statement in (
+            """
+            CREATE TRIGGER IF NOT EXISTS user_stories_fts_insert AFTER INSERT ON user_stories BEGIN
+                INSERT INTO user_stories_fts(rowid, title, description)
+                VALUES (new.id, new.title, new.description);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS user_stories_fts_delete AFTER DELETE ON user_stories BEGIN
+                INSERT INTO user_stories_fts(user_stories_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+            END
+            """,
+            # O upsert das histórias dispara UPDATE mesmo sem mudanças; só reindexa se o texto mudou
+            """
+            CREATE TRIGGER IF NOT EXISTS user_stories_fts_update AFTER UPDATE OF title, description ON user_stories
+            WHEN old.title IS NOT new.title OR old.description IS NOT new.description BEGIN
+                INSERT INTO user_stories_fts(user_stories_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+                INSERT INTO user_stories_fts(rowid, title, description)
+                VALUES (new.id, new.title, new.description);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS test_cases_fts_insert AFTER INSERT ON test_cases BEGIN
+                INSERT INTO test_cases_fts(rowid, content) VALUES (new.id, new.content);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS test_cases_fts_delete AFTER DELETE ON test_cases BEGIN
+                INSERT INTO test_cases_fts(test_cases_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS test_cases_fts_update AFTER UPDATE OF content ON test_cases
+            WHEN old.content IS NOT new.content BEGIN
+                INSERT INTO test_cases_fts(test_cases_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO test_cases_fts(rowid, content) VALUES (new.id, new.content);
+            END
+            """,
+        ):
+            cursor.execute(statement)
+        # Indexa o conteúdo já existente
+        cursor.execute("INSERT INTO user_stories_fts(user_stories_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO test_cases_fts(test_cases_fts) VALUES ('rebuild')")
 
-            self.conn.commit()
-            print("Banco de dados inicializado com sucesso.")
-        except Exception as e:
-            print(f"Erro ao inicializar o banco de dados: {e}")
-            raise
-        finally:
-            self._disconnect()
+    def _migrate_test_case_html(self, cursor):
+        # HTML sanitizado gravado junto com o conteúdo. Registros antigos ficam NULL
+        # e são renderizados sob demanda (com cache em memória) ao serem exibidos
+        self._ensure_column(cursor, "test_cases", "content_html", "TEXT")
 
-    def save_user_story(self, jira_key, title, description, status):
-        self.connect()
-        try:
-            self.cursor.execute(
-                "SELECT id FROM user_stories WHERE jira_key = ?",
-                (jira_key,)
+    def _migrate_generation_progress(self, cursor):
+        # Texto parcial das gerações em streaming, lido pela aplicação web (SSE)
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS generation_progress (
+                user_story_id INTEGER PRIMARY KEY,
+                content TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+
+    def _migrate_scenarios(self, cursor):
+        # Cenários estruturados de cada caso de teste (listas gravadas como JSON).
+        # Casos de teste antigos, em texto livre, não têm linhas aqui
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scenarios (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                test_case_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                preconditions TEXT NOT NULL,
+                steps TEXT NOT NULL,
+                expected_result TEXT NOT NULL,
+                FOREIGN KEY(test_case_id) REFERENCES test_cases(id),
+                UNIQUE(test_case_id, position)
+            )
+            """
+        )
+
+    def _migrate_jobs(self, cursor):
+        # Fila de trabalhos consumida pelos processos do agente (--workers). Horários em
+        # segundos desde a época (time.time()), comparados entre processos
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                dedupe_key TEXT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+            """
+        )
+        # No máximo um trabalho ativo por chave (ex: uma geração por história)
+        cursor.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_key
+            ON jobs(dedupe_key) WHERE status IN ('pending', 'running')
+            """
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, available_at)")
+
+    def _migrate_story_change_tracking(self, cursor):
+        # jira_updated: campo "updated" do Jira na última gravação; content_hash: hash
+        # do título e da descrição atuais; generated_hash: hash do conteúdo usado na
+        # última geração de casos de teste (diferente de content_hash = gerar novamente)
+        self._ensure_column(cursor, "user_stories", "jira_updated", "TEXT")
+        self._ensure_column(cursor, "user_stories", "content_hash", "TEXT")
+        self._ensure_column(cursor, "user_stories", "generated_hash", "TEXT")
+        self.conn.create_function("qa_story_hash", 2, story_hash, deterministic=True)
+        cursor.execute("UPDATE user_stories SET content_hash = qa_story_hash(title, description)")
+        # Casos de teste existentes são considerados atuais
+        cursor.execute(
+            """
+            UPDATE user_stories SET generated_hash = content_hash
+            WHERE EXISTS (SELECT 1 FROM test_cases WHERE test_cases.user_story_id = user_stories.id)
+            """
+        )
+        # Índice de cobertura: a verificação de histórias inalteradas não lê as descrições
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_user_stories_sync_state
+            ON user_stories(jira_key, jira_updated, content_hash, generated_hash)
+            """
+        )
+
+    def _migrate_webhook_deliveries(self, cursor):
+        # Identificadores das entregas de webhook já recebidas (o Jira reenvia em caso de falha)
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_deliveries (
+                delivery_id TEXT PRIMARY KEY,
+                received_at REAL NOT NULL
+            )
+            """
+        )
+
+    def _migrate_process_heartbeats(self, cursor):
+        # Último sinal de vida de cada processo do agente (supervisor, agente, fila),
+        # exibido na aplicação web
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS process_heartbeats (
+                process_id TEXT PRIMARY KEY,
+                role TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                started_at REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                progress_at REAL NOT NULL,
+                status TEXT NOT NULL,
+                detail TEXT
+            )
+            """
+        )
+
+    def _migrate_published_subtasks(self, cursor):
+        # Subtarefas publicadas no Jira, por história e hash do cenário (chave de
+        # idempotência): uma nova tentativa publica apenas as que faltam.
+        # status: pending (reservada por um processo), published ou failed
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS published_subtasks (
+                jira_key TEXT NOT NULL,
+                scenario_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                issue_key TEXT,
+                claimed_at REAL NOT NULL,
+                published_at REAL,
+                PRIMARY KEY (jira_key, scenario_hash)
+            )
+            """
+        )
+
+    def _migrate_story_signatures(self, cursor):
+        # Assinaturas MinHash das histórias (ver similarity.py), fora de user_stories
+        # para que a carga não leia as descrições; content_hash identifica a versão
+        # da história usada no cálculo
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS story_signatures (
+                story_id INTEGER PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                signature BLOB NOT NULL
             )
-            result = self.cursor.fetchone()
+            """
+        )
+
+    def _migrate_test_case_tokens(self, cursor):
+        # Tokens gastos na geração de cada caso de teste (todas as partes de uma
+        # história longa). NULL quando desconhecido: registros antigos, gerações em
+        # lote e casos de teste reutilizados de outra história
+        self._ensure_column(cursor, "test_cases", "prompt_tokens", "INTEGER")
+        self._ensure_column(cursor, "test_cases", "completion_tokens", "INTEGER")
+        self._ensure_column(cursor, "test_cases", "generation_calls", "INTEGER")
 
-            if result:
-                self.cursor.execute(
+    def save_user_story(self, jira_key, title, description, status, jira_updated=None):
+        story_ids = self.bulk_upsert_user_stories([{
+            "jira_key": jira_key,
+            "title": title,
+            "description": description,
+            "status": status,
+            "jira_updated": jira_updated,
+        }])
+        return story_ids[jira_key]
+
+    @timed(DB_QUERY_SECONDS)
+    def bulk_upsert_user_stories(self, stories, chunk_size=500):
+        """
+        Insere ou atualiza várias histórias em uma única transação.
+        Args:
+            stories (iterable): dicts com jira_key, title, description e status e,
+                opcionalmente, jira_updated e content_hash (ver `story_hash`).
+            chunk_size (int): Histórias por comando executemany.
+        Returns:
+            dict: Mapeamento jira_key -> id de cada história gravada.
+        """
+        story_ids = {}
+        with self.transaction() as cursor:
+            for chunk in chunked(stories, chunk_size):
+                rows = [
+                    (
+                        story["jira_key"], story["title"], story["description"], story["status"],
+                        story.get("jira_updated"),
+                        story.get("content_hash") or story_hash(story["title"], story["description"]),
+                    )
+                    for story in chunk
+                ]
+                cursor.executemany(
                     """
-                    UPDATE user_stories 
-                    SET title = ?, description = ?, status = ? 
-                    WHERE jira_key = ?
+                    INSERT INTO user_stories (jira_key, title, description, status, jira_updated, content_hash)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(jira_key) DO UPDATE SET
+                        title = excluded.title,
+                        description = excluded.description,
+                        status = excluded.status,
+                        jira_updated = excluded.jira_updated,
+                        content_hash = excluded.content_hash
                     """,
-                    (title, description, status, jira_key)
+                    rows
+                )
+                keys = list({row[0] for row in rows})
+                placeholders = ", ".join("?" * len(keys))
+                cursor.execute(
+                    f"SELECT id, jira_key FROM user_stories WHERE jira_key IN ({placeholders})",
+                    keys
                 )
-                story_id = result['id']
-            else:
-                self.cursor.execute(
+                story_ids.update((row["jira_key"], row["id"]) for row in cursor.fetchall())
+        return story_ids
+
+    @timed(DB_QUERY_SECONDS)
+    def save_test_cases(self, user_story_id, content, scenarios=None, story_content_hash=None, usage=None):
+        """
+        Grava um caso de teste, ignorando conteúdo duplicado para a mesma história.
+        Args:
+            content (str): Texto em Markdown exibido e indexado na busca.
+            scenarios (list, opcional): Objetos Scenario de onde o texto foi gerado.
+            story_content_hash (str, opcional): Hash da história usada na geração
+                (padrão: o conteúdo atualmente gravado).
+            usage (TokenUsage, opcional): Tokens gastos na geração (zero quando
+                veio do cache de gerações).
+        Returns:
+            int: id do caso de teste (novo ou já existente).
+        """
+        digest = content_hash(content)
+        # Renderiza antes de abrir a transação para não segurar o lock de escrita
+        content_html = render_test_case_html(content)
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE user_stories SET generated_hash = COALESCE(?, content_hash) WHERE id = ?",
+                (story_content_hash, user_story_id)
+            )
+            # O índice único (user_story_id, content_hash) descarta conteúdo duplicado
+            tokens = (usage.prompt_tokens, usage.completion_tokens, usage.calls) if usage is not None else (None,) * 3
+            cursor.execute(
+                """
+                INSERT INTO test_cases
+                    (user_story_id, content, content_hash, content_html,
+                     prompt_tokens, completion_tokens, generation_calls)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_story_id, content_hash) DO NOTHING
+                """,
+                (user_story_id, content, digest, content_html, *tokens)
+            )
+            if cursor.rowcount:
+                test_case_id = cursor.lastrowid
+                self._insert_scenarios(cursor, [(test_case_id, scenarios or ())])
+                return test_case_id
+
+            existing_test_case = cursor.execute(
+                "SELECT id FROM test_cases WHERE user_story_id = ? AND content_hash = ?",
+                (user_story_id, digest)
+            ).fetchone()
+            logger.info("Caso de teste duplicado detectado. ID existente: %s", existing_test_case["id"])
+            return existing_test_case["id"]
+    
+    @timed(DB_QUERY_SECONDS)
+    def bulk_save_test_cases(self, test_cases, chunk_size=500):
+        """
+        Grava vários casos de teste em uma única transação, ignorando duplicatas.
+        Args:
+            test_cases (iterable): Tuplas (user_story_id, content) ou
+                (user_story_id, content, cenários).
+            chunk_size (int): Registros por comando executemany.
+        Returns:
+            list: id de cada caso de teste (novo ou já existente), na ordem recebida.
+        """
+        ids = []
+        with self.transaction() as cursor:
+            for chunk in chunked(test_cases, chunk_size):
+                rows = [
+                    (item[0], item[1], content_hash(item[1]), render_test_case_html(item[1]))
+                    for item in chunk
+                ]
+                cursor.executemany(
                     """
-                    INSERT INTO user_stories (jira_key, title, description, status) 
+                    INSERT INTO test_cases (user_story_id, content, content_hash, content_html)
                     VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_story_id, content_hash) DO NOTHING
                     """,
-                    (jira_key, title, description, status)
+                    rows
                 )
-                story_id = self.cursor.lastrowid
+                cursor.executemany(
+                    "UPDATE user_stories SET generated_hash = content_hash WHERE id = ?",
+                    [(story_id,) for story_id in {row[0] for row in rows}]
+                )
+                pairs = list({(story_id, digest) for story_id, _, digest, _ in rows})
+                values = ", ".join("(?, ?)" for _ in pairs)
+                cursor.execute(
+                    f"""
+                    SELECT id, user_story_id, content_hash FROM test_cases
+                    WHERE (user_story_id, content_hash) IN (VALUES {values})
+                    """,
+                    [item for pair in pairs for item in pair]
+                )
+                found = {(row["user_story_id"], row["content_hash"]): row["id"] for row in cursor.fetchall()}
+                chunk_ids = [found[(story_id, digest)] for story_id, _, digest, _ in rows]
+                # Cenários de casos de teste já gravados são ignorados pelo índice único
+                self._insert_scenarios(cursor, [
+                    (test_case_id, item[2]) for test_case_id, item in zip(chunk_ids, chunk) if len(item) > 2
+                ])
+                ids.extend(chunk_ids)
+        return ids
 
-            self.conn.commit()
-            return story_id
-        finally:
-            self._disconnect()
+    def _insert_scenarios(self, cursor, test_cases):
+        """Grava os cenários de cada par (test_case_id, cenários) na transação em andamento."""
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO scenarios
+                (test_case_id, position, title, preconditions, steps, expected_result)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    test_case_id, position, scenario.title,
+                    json.dumps(scenario.preconditions, ensure_ascii=False),
+                    json.dumps(scenario.steps, ensure_ascii=False),
+                    scenario.expected_result,
+                )
+                for test_case_id, scenarios in test_cases
+                for position, scenario in enumerate(scenarios, 1)
+            ]
+        )
+
+    def get_scenarios_for_story(self, user_story_id):
+        """
+        Returns:
+            dict: Objetos Scenario de cada caso de teste da história, por test_case_id,
+            na ordem gerada. Casos de teste em texto livre não aparecem.
+        """
+        rows = self.conn.execute(
+            """
+            SELECT s.test_case_id, s.title, s.preconditions, s.steps, s.expected_result
+            FROM scenarios AS s JOIN test_cases AS t ON t.id = s.test_case_id
+            WHERE t.user_story_id = ?
+            ORDER BY s.test_case_id, s.position
+            """,
+            (user_story_id,)
+        ).fetchall()
+        scenarios = {}
+        for row in rows:
+            scenarios.setdefault(row["test_case_id"], []).append(Scenario(
+                row["title"], json.loads(row["preconditions"]), json.loads(row["steps"]),
+                row["expected_result"],
+            ))
+        return scenarios
+
+    @timed(DB_QUERY_SECONDS)
+    def get_story_ids_with_test_cases(self, story_ids):
+        """
+        Returns:
+            set: IDs, dentre `story_ids`, que já possuem casos de teste gerados a
+            partir do título e da descrição atuais.
+        """
+        found = set()
+        for chunk in chunked(story_ids, 500):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT id FROM user_stories WHERE id IN ({placeholders}) AND generated_hash = content_hash",
+                chunk
+            ).fetchall()
+            found.update(row["id"] for row in rows)
+        return found
+
+    @timed(DB_QUERY_SECONDS)
+    def get_story_sync_states(self, jira_keys):
+        """
+        Estado de sincronização das histórias já gravadas, em uma consulta atendida
+        apenas pelo índice idx_user_stories_sync_state.
+        Returns:
+            dict: jira_key -> dict com id, jira_updated, content_hash e generated_hash.
+        """
+        states = {}
+        for chunk in chunked(list(jira_keys), 500):
+            placeholders = ", ".join("?" * len(chunk))
+            # Sem INDEXED BY o SQLite prefere o índice único de jira_key e lê as
+            # linhas, cujas colunas novas ficam após a descrição (páginas de overflow)
+            rows = self.conn.execute(
+                f"""
+                SELECT id, jira_key, jira_updated, content_hash, generated_hash
+                FROM user_stories INDEXED BY idx_user_stories_sync_state
+                WHERE jira_key IN ({placeholders})
+                """,
+                chunk
+            ).fetchall()
+            states.update((row["jira_key"], dict(row)) for row in rows)
+        return states
+
+    @timed(DB_QUERY_SECONDS)
+    def get_stories_without_test_cases(self, limit=None):
+        """
+        Returns:
+            list: Histórias sem casos de teste ou alteradas desde a última geração,
+            da mais antiga para a mais recente.
+        """
+        sql = """
+            SELECT id, jira_key, title, description, status FROM user_stories
+            WHERE generated_hash IS NOT content_hash
+            ORDER BY id
+        """
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (limit,)
+        return [dict(row) for row in self.conn.execute(sql, params).fetchall()]
+
+    @timed(DB_QUERY_SECONDS)
+    def get_user_stories_by_keys(self, jira_keys):
+        """
+        Returns:
+            dict: Histórias encontradas, pela chave do Jira.
+        """
+        found = {}
+        for chunk in chunked(list(jira_keys), 500):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT * FROM user_stories WHERE jira_key IN ({placeholders})", chunk
+            ).fetchall()
+            found.update((row["jira_key"], dict(row)) for row in rows)
+        return found
 
-    def save_test_cases(self, user_story_id, content):
-        self.connect()
-        try:
-            # Verificar se já existe um caso de teste com o mesmo conteúdo para o user_story_id
-            self.cursor.execute(
-                "SELECT id FROM test_cases WHERE user_story_id = ? AND content = ?",
-                (user_story_id, content)
-            )
-            existing_test_case = self.cursor.fetchone()
-
-            if existing_test_case:
-                print("Caso de teste duplicado detectado. ID existente:", existing_test_case["id"])
-                return existing_test_case["id"]
-
-            # Inserir novo caso de teste se não for duplicado
-            self.cursor.execute(
-                "INSERT INTO test_cases (user_story_id, content) VALUES (?, ?)",
-                (user_story_id, content)
-            )
-            test_case_id = self.cursor.lastrowid
-            self.conn.commit()
-            return test_case_id
-        finally:
-            self._disconnect()
-    
     def get_all_user_stories(self):
-        self.connect()
-        try:
-            self.cursor.execute("SELECT * FROM user_stories ORDER BY created_at DESC")
-            stories = [dict(row) for row in self.cursor.fetchall()]
-            print("Histórias recuperadas do banco de dados:", stories)
-            return stories
-        finally:
-            self._disconnect()
+        rows = self.conn.execute("SELECT * FROM user_stories ORDER BY created_at DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    # Colunas exibidas nos cards da listagem; a descrição completa fica de fora
+    STORY_LIST_COLUMNS = "id, jira_key, title, status, created_at"
+
+    @timed(DB_QUERY_SECONDS)
+    def list_user_stories(self, limit=50, after=None, status=None, jira_key=None):
+        """
+        Lista histórias da mais recente para a mais antiga, paginando por chave
+        (keyset): o custo de cada página não depende de quantas páginas vieram antes.
+        Args:
+            limit (int): Histórias por página.
+            after (tuple, opcional): (created_at, id) da última história da página anterior.
+            status (str, opcional): Status exato das histórias.
+            jira_key (str, opcional): Prefixo da chave do Jira (ex: "KCA-12").
+        Returns:
+            tuple: (histórias da página, cursor da próxima página ou None).
+        """
+        where, params = self._story_filters(status, jira_key)
+        if after is not None:
+            where.append("(created_at, id) < (?, ?)")
+            params.extend(after)
+        sql = f"SELECT {self.STORY_LIST_COLUMNS} FROM user_stories"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        # Uma linha a mais indica se existe próxima página, sem COUNT(*)
+        rows = self.conn.execute(sql, params + [limit + 1]).fetchall()
+        stories = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = (stories[-1]["created_at"], stories[-1]["id"])
+        return stories, next_cursor
+
+    @timed(DB_QUERY_SECONDS)
+    def search_user_stories(self, query, limit=50, offset=0, status=None, jira_key=None):
+        """
+        Busca textual em títulos, descrições e conteúdo dos casos de teste, ordenada
+        por relevância (BM25). Sem FTS5 no SQLite, recorre a LIKE ordenado por data.
+        Args:
+            query (str): Termos digitados pelo usuário; todos devem aparecer (como prefixo).
+            limit (int): Histórias por página.
+            offset (int): Posição inicial no resultado.
+            status (str, opcional): Status exato das histórias.
+            jira_key (str, opcional): Prefixo da chave do Jira.
+        Returns:
+            tuple: (histórias da página, offset da próxima página ou None).
+        """
+        terms = _search_terms(query)
+        if not terms:
+            return [], None
+        where, params = self._story_filters(status, jira_key, alias="s.")
+        columns = ", ".join(f"s.{column.strip()}" for column in self.STORY_LIST_COLUMNS.split(","))
+
+        if self.full_text_search:
+            match = " ".join(f'"{term}"*' for term in terms)
+            filters = f"WHERE {' AND '.join(where)}" if where else ""
+            sql = f"""
+                WITH matches(story_id, score) AS (
+                    SELECT rowid, bm25(user_stories_fts, 5.0, 1.0)
+                    FROM user_stories_fts WHERE user_stories_fts MATCH ?
+                    UNION ALL
+                    SELECT t.user_story_id, bm25(test_cases_fts)
+                    FROM test_cases_fts JOIN test_cases t ON t.id = test_cases_fts.rowid
+                    WHERE test_cases_fts MATCH ?
+                )
+                SELECT {columns}, MIN(m.score) AS score
+                FROM matches m JOIN user_stories s ON s.id = m.story_id
+                {filters}
+                GROUP BY s.id
+                ORDER BY score, s.id DESC
+                LIMIT ? OFFSET ?
+            """
+            params = [match, match] + params
+        else:
+            for term in terms:
+                pattern = f"%{term}%"
+                where.append(
+                    "(s.title LIKE ? OR s.description LIKE ? OR EXISTS ("
+                    "SELECT 1 FROM test_cases t WHERE t.user_story_id = s.id AND t.content LIKE ?))"
+                )
+                params.extend([pattern, pattern, pattern])
+            sql = f"""
+                SELECT {columns} FROM user_stories s
+                WHERE {' AND '.join(where)}
+                ORDER BY s.created_at DESC, s.id DESC
+                LIMIT ? OFFSET ?
+            """
+
+        rows = self.conn.execute(sql, params + [limit + 1, offset]).fetchall()
+        stories = []
+        for row in rows[:limit]:
+            story = dict(row)
+            story.pop("score", None)
+            stories.append(story)
+        next_offset = offset + limit if len(rows) > limit else None
+        return stories, next_offset
+
+    def get_story_statuses(self):
+        """Status distintos das histórias, para o filtro da listagem."""
+        rows = self.conn.execute("SELECT DISTINCT status FROM user_stories ORDER BY status").fetchall()
+        return [row["status"] for row in rows]
+
+    def _story_filters(self, status=None, jira_key=None, alias=""):
+        where, params = [], []
+        if status:
+            where.append(f"{alias}status = ?")
+            params.append(status)
+        if jira_key:
+            # GLOB diferencia maiúsculas e, ao contrário de LIKE, usa o índice único de jira_key
+            where.append(f"{alias}jira_key GLOB ?")
+            params.append(_escape_glob(jira_key.strip().upper()) + "*")
+        return where, params
 
+    @timed(DB_QUERY_SECONDS)
     def get_user_story(self, story_id):
-        self.connect()
-        try:
-            self.cursor.execute("SELECT * FROM user_stories WHERE id = ?", (story_id,))
-            row = self.cursor.fetchone()
-            return dict(row) if row else None
-        finally:
-            self._disconnect() 
+        row = self.conn.execute("SELECT * FROM user_stories WHERE id = ?", (story_id,)).fetchone()
+        return dict(row) if row else None
 
+    @timed(DB_QUERY_SECONDS)
     def get_test_cases_for_story(self, user_story_id):
-        self.connect()
-        start_time = time.time()
-        try:
-            self.cursor.execute(
-                "SELECT * FROM test_cases WHERE user_story_id = ? ORDER BY generated_at DESC",
-                (user_story_id,)
-            )
-            results = [dict(row) for row in self.cursor.fetchall()]
-            end_time = time.time()
-            print(f"Consulta SQL executada em {end_time - start_time:.2f} segundos.")
-            return results
-        finally:
-            self._disconnect()
+        rows = self.conn.execute(
+            "SELECT * FROM test_cases WHERE user_story_id = ? ORDER BY generated_at DESC",
+            (user_story_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_test_cases_version(self, user_story_id):
+        """
+        Resumo barato dos casos de teste da história, usado como validador HTTP
+        (ETag/Last-Modified) sem ler o conteúdo.
+        Returns:
+            tuple: (quantidade, maior id, data do mais recente).
+        """
+        row = self.conn.execute(
+            "SELECT COUNT(*), MAX(id), MAX(generated_at) FROM test_cases WHERE user_story_id = ?",
+            (user_story_id,)
+        ).fetchone()
+        return tuple(row)
 
     def get_latest_test_case_for_story(self, user_story_id):
-        
-        self.connect()
-        try:
-            self.cursor.execute(
-                """
-                SELECT * FROM test_cases 
-                WHERE user_story_id = ? 
-                ORDER BY generated_at DESC 
-                LIMIT 1
-                """,
-                (user_story_id,)
-            )
-            row = self.cursor.fetchone()
-            return dict(row) if row else None
-        finally:
-            self._disconnect()
+        row = self.conn.execute(
+            """
+            SELECT * FROM test_cases 
+            WHERE user_story_id = ? 
+            ORDER BY generated_at DESC 
+            LIMIT 1
+            """,
+            (user_story_id,)
+        ).fetchone()
+        return dict(row) if row else None
 
     def delete_user_story(self, story_id):
         """
         Exclui uma história de usuário do banco de dados com base no ID.
         """
-        self.connect()
-        try:
-            self.cursor.execute("DELETE FROM user_stories WHERE id = ?", (story_id,))
-            self.conn.commit()
-        finally:
-            self._disconnect()
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM user_stories WHERE id = ?", (story_id,))
 
-    def log_sync_time(self):
+    def update_generation_progress(self, user_story_id, content, status="streaming"):
+        """
+        Registra o texto gerado até o momento para a história.
+        Args:
+            status (str): "streaming" durante a geração ou "failed" se ela foi interrompida.
+        """
+        self.conn.execute(
+            """
+            INSERT INTO generation_progress (user_story_id, content, status, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_story_id) DO UPDATE SET
+                content = excluded.content,
+                status = excluded.status,
+                updated_at = excluded.updated_at
+            """,
+            (user_story_id, content, status)
+        )
+
+    def get_generation_progress(self, user_story_id):
+        row = self.conn.execute(
+            "SELECT content, status, updated_at FROM generation_progress WHERE user_story_id = ?",
+            (user_story_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def clear_generation_progress(self, user_story_id):
+        """Remove o progresso ao concluir: o texto final já está em test_cases."""
+        self.conn.execute("DELETE FROM generation_progress WHERE user_story_id = ?", (user_story_id,))
+
+    def log_sync_time(self, project_key=None, watermark=None):
         """
         Registra o horário da última sincronização com o Jira.
+        Args:
+            project_key (str, opcional): Projeto sincronizado.
+            watermark (datetime, opcional): Momento a partir do qual a próxima
+                sincronização deve buscar histórias atualizadas. Omitido quando o
+                ciclo não terminou com sucesso, mantendo a marca anterior.
         """
-        self.connect()
-        try:
-            self.cursor.execute("INSERT INTO sync_logs (sync_time) VALUES (CURRENT_TIMESTAMP)")
-            self.conn.commit()
-        finally:
-            self._disconnect()
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO sync_logs (sync_time, project_key, watermark) VALUES (CURRENT_TIMESTAMP, ?, ?)",
+                (project_key, watermark.isoformat(sep=" ") if watermark else None)
+            )
+
+    def get_last_watermark(self, project_key):
+        """
+        Retorna a marca d'água da última sincronização bem-sucedida do projeto.
+        Returns:
+            datetime: Marca d'água registrada ou None se o projeto nunca foi sincronizado.
+        """
+        row = self.conn.execute(
+            """
+            SELECT watermark FROM sync_logs
+            WHERE project_key = ? AND watermark IS NOT NULL
+            ORDER BY id DESC
+            LIMIT 1
+            """,
+            (project_key,)
+        ).fetchone()
+        return datetime.fromisoformat(row["watermark"]) if row else None
+
+    @timed(DB_QUERY_SECONDS)
+    def get_cached_generation(self, cache_key, max_age_seconds=None):
+        """
+        Busca uma geração da OpenAI no cache e registra o acerto.
+        Args:
+            cache_key (str): Hash calculado pelo OpenAIClient.
+            max_age_seconds (float, opcional): Idade máxima aceita para a entrada.
+        Returns:
+            str: Conteúdo gerado ou None se ausente/expirado.
+        """
+        query = "SELECT content FROM generation_cache WHERE cache_key = ?"
+        params = [cache_key]
+        if max_age_seconds:
+            query += " AND created_at >= datetime('now', ?)"
+            params.append(f"-{int(max_age_seconds)} seconds")
+        row = self.conn.execute(query, params).fetchone()
+        if row is None:
+            return None
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                UPDATE generation_cache
+                SET hit_count = hit_count + 1, last_used_at = CURRENT_TIMESTAMP
+                WHERE cache_key = ?
+                """,
+                (cache_key,)
+            )
+        return row["content"]
+
+    @timed(DB_QUERY_SECONDS)
+    def save_cached_generation(self, cache_key, model, content):
+        """
+        Grava (ou substitui) uma geração no cache.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO generation_cache (cache_key, model, content)
+                VALUES (?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    model = excluded.model,
+                    content = excluded.content,
+                    created_at = CURRENT_TIMESTAMP,
+                    last_used_at = CURRENT_TIMESTAMP
+                """,
+                (cache_key, model, content)
+            )
+
+    def evict_generation_cache(self, max_entries=None, max_age_seconds=None):
+        """
+        Remove entradas expiradas e, acima de `max_entries`, as menos usadas recentemente.
+        Returns:
+            int: Quantidade de entradas removidas.
+        """
+        removed = 0
+        with self.transaction() as cursor:
+            if max_age_seconds:
+                cursor.execute(
+                    "DELETE FROM generation_cache WHERE created_at < datetime('now', ?)",
+                    (f"-{int(max_age_seconds)} seconds",)
+                )
+                removed += cursor.rowcount
+            if max_entries is not None:
+                cursor.execute(
+                    """
+                    DELETE FROM generation_cache WHERE cache_key IN (
+                        SELECT cache_key FROM generation_cache
+                        ORDER BY last_used_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (max_entries,)
+                )
+                removed += cursor.rowcount
+        return removed
+
+    @timed(DB_QUERY_SECONDS)
+    def enqueue_jobs(self, jobs):
+        """
+        Enfileira trabalhos em uma única transação. Um trabalho cuja `dedupe_key`
+        já tem outro pendente ou em execução é descartado.
+        Args:
+            jobs (iterable): Tuplas (tipo, payload serializável em JSON, dedupe_key ou None).
+        Returns:
+            int: Quantidade de trabalhos enfileirados.
+        """
+        now = time.time()
+        enqueued = 0
+        with self.transaction() as cursor:
+            for chunk in chunked(jobs, 500):
+                for kind, payload, dedupe_key in chunk:
+                    cursor.execute(
+                        """
+                        INSERT OR IGNORE INTO jobs (kind, payload, dedupe_key, available_at)
+                        VALUES (?, ?, ?, ?)
+                        """,
+                        (kind, json.dumps(payload, ensure_ascii=False), dedupe_key, now)
+                    )
+                    enqueued += cursor.rowcount
+        return enqueued
+
+    def enqueue_job(self, kind, payload, dedupe_key=None):
+        """
+        Returns:
+            bool: Se o trabalho foi enfileirado (False se já havia um ativo com a mesma chave).
+        """
+        return self.enqueue_jobs([(kind, payload, dedupe_key)]) == 1
+
+    @timed(DB_QUERY_SECONDS)
+    def claim_job(self, worker_id, lease_seconds, kinds=None, max_attempts=None):
+        """
+        Reserva o próximo trabalho disponível por `lease_seconds`. A seleção e a
+        reserva ocorrem sob o lock de escrita (BEGIN IMMEDIATE), então dois
+        processos nunca recebem o mesmo trabalho. Trabalhos em execução com a
+        reserva expirada (processo que caiu) voltam a ser entregues, exceto os que
+        já esgotaram as `max_attempts` tentativas: esses ficam como "failed".
+        Args:
+            worker_id (str): Identificador do processo que executará o trabalho.
+            kinds (list, opcional): Tipos de trabalho aceitos.
+            max_attempts (int, opcional): Limite de tentativas; sem ele, não há limite.
+        Returns:
+            dict: Trabalho reservado (payload já decodificado), ou None se não houver.
+        """
+        now = time.time()
+        sql = """
+            SELECT id FROM jobs
+            WHERE ((status = 'pending' AND available_at <= ?)
+                   OR (status = 'running' AND lease_expires_at < ?))
+        """
+        params = [now, now]
+        if kinds:
+            sql += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+        sql += " ORDER BY available_at, id LIMIT 1"
+        with self.transaction() as cursor:
+            if max_attempts is not None:
+                # Um trabalho que derruba o processo não deve ser reentregue indefinidamente
+                cursor.execute(
+                    """
+                    UPDATE jobs SET status = 'failed', finished_at = CURRENT_TIMESTAMP,
+                        last_error = 'Reserva expirada após a última tentativa',
+                        lease_owner = NULL, lease_expires_at = NULL
+                    WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?
+                    """,
+                    (now, max_attempts)
+                )
+            row = cursor.execute(sql, params).fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                """
+                UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires_at = ?,
+                    attempts = attempts + 1
+                WHERE id = ?
+                """,
+                (worker_id, now + lease_seconds, row["id"])
+            )
+            job = dict(cursor.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def extend_job_lease(self, job_id, worker_id, lease_seconds):
+        """
+        Renova a reserva de um trabalho longo.
+        Returns:
+            bool: False se a reserva foi perdida (expirou e outro processo assumiu).
+        """
+        cursor = self.conn.execute(
+            """
+            UPDATE jobs SET lease_expires_at = ?
+            WHERE id = ? AND status = 'running' AND lease_owner = ?
+            """,
+            (time.time() + lease_seconds, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    @timed(DB_QUERY_SECONDS)
+    def complete_job(self, job_id, worker_id):
+        """
+        Marca o trabalho como concluído, se a reserva ainda pertence a `worker_id`.
+        Returns:
+            bool: False se a reserva foi perdida.
+        """
+        cursor = self.conn.execute(
+            """
+            UPDATE jobs SET status = 'done', lease_owner = NULL, lease_expires_at = NULL,
+                finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running' AND lease_owner = ?
+            """,
+            (job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    @timed(DB_QUERY_SECONDS)
+    def fail_job(self, job_id, worker_id, error, retry_delay, max_attempts):
+        """
+        Registra a falha de um trabalho: ele volta à fila após `retry_delay`
+        segundos ou, esgotadas as `max_attempts` tentativas, fica como "failed".
+        Returns:
+            bool: False se a reserva foi perdida.
+        """
+        cursor = self.conn.execute(
+            """
+            UPDATE jobs SET
+                status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                finished_at = CASE WHEN attempts >= ? THEN CURRENT_TIMESTAMP END,
+                available_at = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ? AND status = 'running' AND lease_owner = ?
+            """,
+            (max_attempts, max_attempts, time.time() + retry_delay, str(error)[:2000], job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    @timed(DB_QUERY_SECONDS)
+    def get_job_counts(self):
+        """
+        Returns:
+            dict: Quantidade de trabalhos por status.
+        """
+        rows = self.conn.execute("SELECT status, COUNT(*) AS total FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["total"] for row in rows}
+
+    def purge_finished_jobs(self, max_age_seconds):
+        """Remove os trabalhos concluídos há mais de `max_age_seconds` segundos."""
+        cursor = self.conn.execute(
+            """
+            DELETE FROM jobs
+            WHERE status = 'done' AND finished_at < datetime('now', ?)
+            """,
+            (f"-{int(max_age_seconds)} seconds",)
+        )
+        return cursor.rowcount
+
+    def record_webhook_delivery(self, delivery_id):
+        """
+        Registra uma entrega de webhook.
+        Returns:
+            bool: False se a entrega já tinha sido recebida (reenvio).
+        """
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO webhook_deliveries (delivery_id, received_at) VALUES (?, ?)",
+            (delivery_id, time.time())
+        )
+        return cursor.rowcount > 0
+
+    def purge_webhook_deliveries(self, max_age_seconds):
+        """Remove os registros de entregas mais antigas que `max_age_seconds`."""
+        cursor = self.conn.execute(
+            "DELETE FROM webhook_deliveries WHERE received_at < ?", (time.time() - max_age_seconds,)
+        )
+        return cursor.rowcount
+
+    def record_heartbeat(self, process_id, role, pid, started_at, progress_at, status, detail=None):
+        """Grava o sinal de vida de um processo (ver health.Heartbeat)."""
+        self.conn.execute(
+            """
+            INSERT INTO process_heartbeats
+                (process_id, role, pid, started_at, last_seen, progress_at, status, detail)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(process_id) DO UPDATE SET
+                last_seen = excluded.last_seen,
+                progress_at = excluded.progress_at,
+                status = excluded.status,
+                detail = excluded.detail
+            """,
+            (process_id, role, pid, started_at, time.time(), progress_at, status, detail)
+        )
+
+    @timed(DB_QUERY_SECONDS)
+    def get_story_signatures(self):
+        """
+        Returns:
+            list: Pares (story_id, assinatura) das histórias com casos de teste atuais
+            e assinatura calculada a partir do conteúdo atual (exceto as vazias, de
+            histórias curtas demais para comparar).
+        """
+        return self.conn.execute(
+            """
+            SELECT s.story_id, s.signature
+            FROM user_stories AS u INDEXED BY idx_user_stories_sync_state
+            JOIN story_signatures AS s ON s.story_id = u.id
+            WHERE u.generated_hash = u.content_hash AND s.content_hash = u.content_hash
+                AND length(s.signature) > 0
+            ORDER BY s.story_id
+            """
+        ).fetchall()
+
+    @timed(DB_QUERY_SECONDS)
+    def get_stories_missing_signatures(self, limit):
+        """
+        Returns:
+            list: Histórias (id, title, description, content_hash) com casos de teste
+            atuais sem assinatura ou com assinatura de um conteúdo anterior.
+        """
+        rows = self.conn.execute(
+            """
+            SELECT id, title, description, content_hash FROM user_stories
+            WHERE id IN (
+                SELECT u.id
+                FROM user_stories AS u INDEXED BY idx_user_stories_sync_state
+                LEFT JOIN story_signatures AS s ON s.story_id = u.id
+                WHERE u.generated_hash = u.content_hash AND s.content_hash IS NOT u.content_hash
+                LIMIT ?
+            )
+            """,
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def save_story_signatures(self, rows):
+        """Grava assinaturas: pares (story_id, content_hash, assinatura em bytes)."""
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO story_signatures (story_id, content_hash, signature) VALUES (?, ?, ?)",
+                rows
+            )
+
+    @timed(DB_QUERY_SECONDS)
+    def claim_subtasks(self, jira_key, scenario_hashes, lease_seconds):
+        """
+        Reserva a publicação das subtarefas de uma história. Uma subtarefa é reservada
+        se nunca foi publicada, se a última tentativa falhou ou se a reserva de outro
+        processo expirou (`lease_seconds`).
+        Returns:
+            dict: scenario_hash -> None para as reservadas agora (a publicar) ou a chave
+            da issue para as já publicadas. As reservadas por outro processo ficam de fora.
+        """
+        now = time.time()
+        claimed = {}
+        with self.transaction() as cursor:
+            for scenario_hash in dict.fromkeys(scenario_hashes):
+                cursor.execute(
+                    """
+                    INSERT INTO published_subtasks (jira_key, scenario_hash, status, claimed_at)
+                    VALUES (?, ?, 'pending', ?)
+                    ON CONFLICT(jira_key, scenario_hash) DO UPDATE SET
+                        status = 'pending',
+                        claimed_at = excluded.claimed_at
+                    WHERE status = 'failed' OR (status = 'pending' AND claimed_at < ?)
+                    """,
+                    (jira_key, scenario_hash, now, now - lease_seconds)
+                )
+                if cursor.rowcount:
+                    claimed[scenario_hash] = None
+            rows = cursor.execute(
+                "SELECT scenario_hash, issue_key FROM published_subtasks WHERE jira_key = ? AND status = 'published'",
+                (jira_key,)
+            ).fetchall()
+        claimed.update((row["scenario_hash"], row["issue_key"]) for row in rows)
+        return claimed
+
+    @timed(DB_QUERY_SECONDS)
+    def finish_subtasks(self, jira_key, results):
+        """
+        Grava o resultado das subtarefas reservadas por `claim_subtasks`.
+        Args:
+            results (dict): scenario_hash -> chave da issue criada, ou None se falhou.
+        """
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.executemany(
+                """
+                UPDATE published_subtasks
+                SET status = ?, issue_key = ?, published_at = ?
+                WHERE jira_key = ? AND scenario_hash = ?
+                """,
+                [
+                    ("published" if issue_key else "failed", issue_key, now if issue_key else None,
+                     jira_key, scenario_hash)
+                    for scenario_hash, issue_key in results.items()
+                ]
+            )
+
+    @timed(DB_QUERY_SECONDS)
+    def get_keys_with_unpublished_subtasks(self, jira_keys):
+        """
+        Returns:
+            set: Chaves, dentre `jira_keys`, com subtarefas que falharam ou ainda
+            estão reservadas sem publicação.
+        """
+        found = set()
+        for chunk in chunked(list(jira_keys), 500):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"""
+                SELECT DISTINCT jira_key FROM published_subtasks
+                WHERE jira_key IN ({placeholders}) AND status != 'published'
+                """,
+                chunk
+            ).fetchall()
+            found.update(row["jira_key"] for row in rows)
+        return found
+
+    def discard_unpublished_subtasks(self, jira_key, keep_hashes):
+        """Remove as subtarefas não publicadas da história que não estão em `keep_hashes`."""
+        keep_hashes = list(keep_hashes)
+        placeholders = ", ".join("?" * len(keep_hashes))
+        cursor = self.conn.execute(
+            f"""
+            DELETE FROM published_subtasks
+            WHERE jira_key = ? AND status != 'published' AND scenario_hash NOT IN ({placeholders})
+            """,
+            [jira_key, *keep_hashes]
+        )
+        return cursor.rowcount
+
+    def get_heartbeats(self):
+        rows = self.conn.execute("SELECT * FROM process_heartbeats ORDER BY role, started_at").fetchall()
+        return [dict(row) for row in rows]
+
+    def purge_heartbeats(self, max_age_seconds):
+        """Remove processos sem sinal de vida há mais de `max_age_seconds`."""
+        cursor = self.conn.execute(
+            "DELETE FROM process_heartbeats WHERE last_seen < ?", (time.time() - max_age_seconds,)
+        )
+        return cursor.rowcount
@@ -0,0 +1,16 @@
+"""
+Configuração do gunicorn usada pelo supervisor (`--config`). O `__main__` do
+web_app não roda no gunicorn, então o logging de cada processo da aplicação web
+é configurado aqui, depois do fork: a thread de escrita do log_config não
+sobreviveria ao fork do processo mestre.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def post_fork(server, worker):
+    from log_config import configure_logging
+
+    configure_logging()
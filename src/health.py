@@ -0,0 +1,137 @@
+"""
+Sinais de vida dos processos do agente (supervisor, agente e processos da fila),
+gravados na tabela process_heartbeats e exibidos pela aplicação web. Uma thread
+grava o último sinal a cada HEARTBEAT_INTERVAL_SECONDS; o laço principal do
+processo registra progresso a cada ciclo, história ou trabalho. Assim um processo
+que caiu (sem sinal) e um processo travado (com sinal, mas sem progresso) ficam
+visíveis.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL_SECONDS", "15"))
+# Sem sinal de vida por este tempo, o processo é considerado parado
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT_SECONDS", "60"))
+# Ocupado e sem progresso por este tempo, o processo é considerado travado
+HEARTBEAT_STALL_SECONDS = float(os.getenv("HEARTBEAT_STALL_SECONDS", "1800"))
+# Registros de processos encerrados são removidos após este tempo
+HEARTBEAT_RETENTION_SECONDS = float(os.getenv("HEARTBEAT_RETENTION_HOURS", "24")) * 3600
+
+STATUS_IDLE = "ocioso"
+STATUS_STOPPED = "encerrado"
+
+
+class Heartbeat:
+    """
+    Sinal de vida de um processo com um papel ("supervisor", "agent" ou "worker").
+    Use `progress(status)` no laço principal; a gravação no banco fica na thread,
+    então registrar progresso não custa uma escrita.
+    """
+
+    def __init__(self, db_manager, role, interval=None):
+        self.db_manager = db_manager
+        self.role = role
+        self.interval = interval if interval is not None else HEARTBEAT_INTERVAL
+        self.process_id = f"{role}@{socket.gethostname()}:{os.getpid()}"
+        self.started_at = time.time()
+        self.progress_at = self.started_at
+        self.status = "iniciando"
+        self.detail = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def progress(self, status=None, detail=None):
+        self.progress_at = time.time()
+        if status is not None:
+            self.status = status
+        if detail is not None:
+            self.detail = detail
+
+    def beat(self):
+        try:
+            self.db_manager.record_heartbeat(
+                self.process_id, self.role, os.getpid(), self.started_at,
+                self.progress_at, self.status, self.detail,
+            )
+        except Exception as e:
+            logger.error("Erro ao gravar o sinal de vida de %s: %s", self.process_id, e)
+
+    def start(self):
+        try:
+            self.db_manager.purge_heartbeats(HEARTBEAT_RETENTION_SECONDS)
+        except Exception as e:
+            logger.error("Erro ao remover sinais de vida antigos: %s", e)
+        self.beat()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"heartbeat-{self.role}")
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.beat()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.progress(STATUS_STOPPED)
+        self.beat()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def process_state(heartbeat, now=None):
+    """
+    Args:
+        heartbeat (dict): Linha de process_heartbeats.
+    Returns:
+        str: "ok", "travado", "parado" (sem sinal de vida) ou "encerrado".
+    """
+    now = now if now is not None else time.time()
+    if heartbeat["status"] == STATUS_STOPPED:
+        return STATUS_STOPPED
+    if now - heartbeat["last_seen"] > HEARTBEAT_TIMEOUT:
+        return "parado"
+    if heartbeat["status"] != STATUS_IDLE and now - heartbeat["progress_at"] > HEARTBEAT_STALL_SECONDS:
+        return "travado"
+    return "ok"
+
+
+def health_summary(db_manager, now=None):
+    """
+    Estado dos processos registrados. Um papel está saudável se ao menos um processo
+    dele está "ok" (processos reiniciados deixam registros antigos como "parado").
+    Returns:
+        dict: {"status": "ok" | "degradado" | "parado" | "desconhecido", "processes": [...]}.
+    """
+    now = now if now is not None else time.time()
+    processes = []
+    roles = {}
+    for heartbeat in db_manager.get_heartbeats():
+        state = process_state(heartbeat, now)
+        processes.append(dict(
+            heartbeat, state=state,
+            seconds_since_seen=round(now - heartbeat["last_seen"], 1),
+            seconds_since_progress=round(now - heartbeat["progress_at"], 1),
+        ))
+        if state != STATUS_STOPPED:
+            roles.setdefault(heartbeat["role"], set()).add(state)
+
+    if not roles:
+        status = "desconhecido"
+    elif all("ok" in states for states in roles.values()):
+        status = "ok"
+    elif any(states == {"parado"} for states in roles.values()):
+        status = "parado"
+    else:
+        status = "degradado"
+    return {"status": status, "processes": processes}
@@ -0,0 +1,103 @@
+import asyncio
+import os
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuração do pool de conexões compartilhado pelos clientes assíncronos
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "50"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Corpo da resposta que devolve a vaga do host quando é fechado."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class PerHostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte que limita as requisições simultâneas por host, para que um
+    serviço lento (ex: OpenAI) não ocupe todas as conexões do pool compartilhado.
+    A vaga fica ocupada até o corpo da resposta ser consumido ou fechado.
+    """
+
+    def __init__(self, transport, per_host_limit):
+        self._transport = transport
+        self._per_host_limit = per_host_limit
+        self._semaphores = {}
+
+    def _semaphore_for(self, url):
+        key = (url.scheme, url.host, url.port)
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(self._per_host_limit)
+        return semaphore
+
+    async def handle_async_request(self, request):
+        semaphore = self._semaphore_for(request.url)
+        await semaphore.acquire()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                semaphore.release()
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def create_async_http_client(max_connections=None, max_keepalive_connections=None,
+                             per_host_limit=None, timeout=None):
+    """
+    Cria o cliente HTTP assíncrono (keep-alive) compartilhado entre o AsyncJiraClient
+    e o AsyncOpenAIClient. Deve ser criado e fechado dentro do mesmo event loop.
+    Args:
+        max_connections (int, opcional): Conexões simultâneas no pool.
+        max_keepalive_connections (int, opcional): Conexões ociosas mantidas abertas.
+        per_host_limit (int, opcional): Requisições simultâneas por host.
+        timeout (float, opcional): Timeout de leitura/escrita em segundos.
+    Returns:
+        httpx.AsyncClient: Cliente configurado.
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections or HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=max_keepalive_connections or HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    transport = PerHostLimitedTransport(
+        httpx.AsyncHTTPTransport(limits=limits),
+        per_host_limit or HTTP_MAX_CONNECTIONS_PER_HOST,
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(timeout or HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
@@ -1,34 +1,219 @@
 import os
-from jira import JIRA
+from rate_limiter import get_limiter
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import unicodedata
 import logging
+import threading
+import time
 
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-)
 logger = logging.getLogger(__name__)
 
+# Campos de issue realmente utilizados pelo agente; evita trafegar '*all'
+STORY_FIELDS = "summary,description,status,updated"
+
+# Limite de issues por requisição do endpoint /issue/bulk
+BULK_CREATE_LIMIT = 50
+
+
+class _TTLCache:
+    """Dicionário simples com expiração por entrada, seguro entre threads."""
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _story_from_json(issue):
+    """Converte uma issue no formato JSON da API REST no dicionário de história do agente."""
+    fields = issue.get("fields") or {}
+    return {
+        'key': issue["key"],
+        'title': fields.get("summary") or '',
+        'description': fields.get("description") or '',
+        'status': (fields.get("status") or {}).get("name", ''),
+        'updated': fields.get("updated"),
+    }
+
+
+# Eventos de webhook do Jira que indicam uma issue nova ou alterada
+WEBHOOK_EVENTS = ("jira:issue_created", "jira:issue_updated")
+
+
+def story_from_webhook(payload, project_key, status, issue_type="Story"):
+    """
+    Extrai a história de um evento de webhook do Jira, aplicando os mesmos filtros
+    da busca JQL (projeto, tipo de issue e status).
+    Returns:
+        dict: História no formato de iter_user_stories, ou None se o evento não se
+        refere a uma história monitorada.
+    """
+    issue = payload.get("issue") if isinstance(payload, dict) else None
+    if payload.get("webhookEvent") not in WEBHOOK_EVENTS or not isinstance(issue, dict) or not issue.get("key"):
+        return None
+    fields = issue.get("fields") or {}
+    if (fields.get("project") or {}).get("key") != project_key:
+        return None
+    if (fields.get("issuetype") or {}).get("name") != issue_type:
+        return None
+    story = _story_from_json(issue)
+    return story if story["status"] == status else None
+
+
+def _story_jql_parts(project_key, status):
+    return [
+        f'project = {project_key}',
+        'issuetype = Story',
+        f'status = "{status}"'
+    ]
+
+
+def _incremental_story_jql(project_key, status, updated_since=None):
+    """JQL da busca incremental, compartilhada pelos clientes síncrono e assíncrono."""
+    jql_parts = _story_jql_parts(project_key, status)
+    if updated_since is not None:
+        jql_parts.append(f'updated >= "{updated_since.strftime("%Y-%m-%d %H:%M")}"')
+    # Ordenação estável para que a paginação não pule nem repita issues
+    return " AND ".join(jql_parts) + " ORDER BY updated ASC, key ASC"
+
+
+def _is_last_page(count, start_at, total):
+    """
+    Fim da paginação por offset. O Jira pode limitar maxResults abaixo do valor
+    solicitado, então uma página menor que `page_size` não indica o fim: apenas uma
+    página vazia ou o total informado atingido.
+    """
+    return count == 0 or (isinstance(total, int) and start_at >= total)
+
+
+def _next_page_token(page):
+    """Token da página seguinte na paginação do Jira Cloud, ou None na última."""
+    next_page_token = page.get("nextPageToken")
+    if not next_page_token or page.get("isLast"):
+        return None
+    return next_page_token
+
+
+def _subtask_fields(project_key, parent_issue_key, issue_type_id, summary, description):
+    return {
+        'project': {'key': project_key},
+        'parent': {'key': parent_issue_key},
+        'summary': summary,
+        'description': description or '',
+        'issuetype': {'id': issue_type_id}
+    }
+
+
+def _subtask_type_id(issue_types):
+    """ID do tipo 'Sub-task' entre os pares (nome, id) dos tipos de issue do projeto."""
+    for name, issue_type_id in issue_types:
+        if name.lower() in ["sub-task", "subtarefa", "subtask"]:
+            return issue_type_id
+    return None
+
+
+def _bulk_chunks(project_key, parent_issue_key, issue_type_id, scenarios):
+    """
+    Divide as subtarefas em lotes do endpoint /issue/bulk.
+    Yields:
+        tuple: (quantidade de subtarefas, campos de cada uma) por requisição.
+    """
+    for start in range(0, len(scenarios), BULK_CREATE_LIMIT):
+        chunk = scenarios[start:start + BULK_CREATE_LIMIT]
+        yield len(chunk), [
+            _subtask_fields(project_key, parent_issue_key, issue_type_id, summary, description)
+            for summary, description in chunk
+        ]
+
+
+def _log_bulk_result(parent_issue_key, created):
+    succeeded = sum(1 for issue in created if issue is not None)
+    logger.info("%s/%s subtarefas criadas em lote para %s", succeeded, len(created), parent_issue_key)
+    return created
+
+
+def _is_cloud_server(server):
+    """
+    Indica se o Jira é Cloud, onde a busca paginada por startAt foi substituída pelo
+    endpoint search/jql com nextPageToken. JIRA_DEPLOYMENT ("cloud" ou "server")
+    sobrepõe a detecção pelo domínio.
+    """
+    deployment = os.getenv("JIRA_DEPLOYMENT", "").strip().lower()
+    if deployment:
+        return deployment == "cloud"
+    return ".atlassian.net" in (server or "")
+
+
 class JiraClient:
     def __init__(self):
         self.jira_server = os.getenv("JIRA_SERVER")
         self.jira_username = os.getenv("JIRA_USERNAME")
         self.jira_api_token = os.getenv("JIRA_API_TOKEN")
+        self.page_size = int(os.getenv("JIRA_PAGE_SIZE", "100"))
+        self.limiter = get_limiter("jira")
+
+        # Metadados que não mudam durante a execução: projeto de cada issue pai
+        # e tipo de issue 'Sub-task' de cada projeto
+        metadata_ttl = float(os.getenv("JIRA_METADATA_TTL_SECONDS", "3600"))
+        self._parent_projects = _TTLCache(metadata_ttl)
+        self._subtask_types = _TTLCache(metadata_ttl)
+
+        # A conexão (que autentica no Jira) só é aberta no primeiro uso
+        self._jira = None
+        self._jira_lock = threading.Lock()
+
+    @property
+    def jira(self):
+        if self._jira is None:
+            with self._jira_lock:
+                if self._jira is None:
+                    self._jira = self._connect()
+        return self._jira
+
+    def _connect(self):
+        # Importada aqui: a aplicação web usa este módulo (webhook) sem falar com o Jira
+        from jira import JIRA
 
         try:
-            self.jira = JIRA(
+            jira = JIRA(
                 server=self.jira_server,
                 basic_auth=(self.jira_username, self.jira_api_token),
+                # Novas tentativas ficam a cargo do RateLimiter compartilhado
+                max_retries=0,
             )
-            logger.info(f"Conexão com jira estabelecida com sucesso em {self.jira_server}") 
+            jira._session.hooks["response"].append(self._observe_response)
+            logger.info("Conexão com jira estabelecida com sucesso em %s", self.jira_server)
+            return jira
         except Exception as e:
-            logger.error(f"Erro ao conectar ao Jira: {e}")
+            logger.error("Erro ao conectar ao Jira: %s", e)
             raise
 
+    def _observe_response(self, response, *args, **kwargs):
+        # Hook do requests: os cabeçalhos de cota de cada resposta chegam ao RateLimiter
+        self.limiter.observe(response)
+
     def get_user_stories(self, project_key, status="To Do", days_ago=None, no_date_limit=False):
         """
         Busca histórias de usuário em um projeto Jira com base no status e na data de criação.
@@ -41,37 +226,87 @@ class JiraClient:
             list: Lista de histórias de usuário encontradas.
         """
         try:
-            jql_parts = [
-                f'project = {project_key}',
-                'issuetype = Story',
-                f'status = "{status}"'
-            ]
+            jql_parts = _story_jql_parts(project_key, status)
 
             if days_ago is not None and not no_date_limit:
                 date_limit = (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d")
                 jql_parts.append(f'created >= "{date_limit}"')
 
             jql_query = " AND ".join(jql_parts)
-            logger.info(f"Buscando histórias com a query JQL: {jql_query}")
+            logger.info("Buscando histórias com a query JQL: %s", jql_query)
 
-            issues = self.jira.search_issues(jql_query, maxResults=50)
-            logger.info(f"Encontradas {len(issues)} histórias de usuário no projeto.")
+            user_stories = list(self._search_stories(jql_query))
+            logger.info("Encontradas %s histórias de usuário no projeto.", len(user_stories))
+            return user_stories
 
-            # Formatando os resultados
-            user_stories = []
-            for issue in issues:
-                user_stories.append({
+        except Exception as e:
+            logger.error("Erro ao buscar histórias no Jira: %s", e)
+            return []
+
+    def iter_user_stories(self, project_key, status="To Do", updated_since=None, page_size=None):
+        """
+        Percorre, página a página, as histórias de usuário atualizadas desde `updated_since`.
+        Apenas uma página fica em memória por vez, então é possível consumir milhares
+        de issues com memória constante. Diferente de `get_user_stories`, erros de
+        comunicação são propagados para que o chamador não avance sua marca d'água.
+        Args:
+            project_key (str): Chave do projeto Jira.
+            status (str): Status das histórias de usuário a serem buscadas.
+            updated_since (datetime, optional): Buscar apenas histórias atualizadas a partir deste momento.
+            page_size (int, optional): Quantidade de issues por requisição.
+        Yields:
+            dict: História de usuário com as chaves key, title, description, status e updated.
+        """
+        jql_query = _incremental_story_jql(project_key, status, updated_since)
+        logger.info("Buscando histórias com a query JQL: %s", jql_query)
+        yield from self._search_stories(jql_query, page_size)
+
+    def _search_stories(self, jql_query, page_size=None):
+        page_size = page_size or self.page_size
+        if getattr(self.jira, '_is_cloud', False) is True:
+            yield from self._search_stories_by_token(jql_query, page_size)
+            return
+        start_at = 0
+        while True:
+            page = self.limiter.call(
+                "search",
+                self.jira.search_issues,
+                jql_query,
+                startAt=start_at,
+                maxResults=page_size,
+                fields=STORY_FIELDS,
+                validate_query=False,
+            )
+            for issue in page:
+                yield {
                     'key': issue.key,
                     'title': issue.fields.summary,
                     'description': issue.fields.description or '',
-                    'status': issue.fields.status.name
-                })
-
-            return user_stories
+                    'status': issue.fields.status.name,
+                    'updated': getattr(issue.fields, 'updated', None),
+                }
+            start_at += len(page)
+            if _is_last_page(len(page), start_at, getattr(page, 'total', None)):
+                break
 
-        except Exception as e:
-            logger.error(f"Erro ao buscar histórias no Jira: {e}")
-            return []
+    def _search_stories_by_token(self, jql_query, page_size):
+        """Paginação do Jira Cloud: cada página informa o token da seguinte."""
+        next_page_token = None
+        while True:
+            page = self.limiter.call(
+                "search",
+                self.jira.enhanced_search_issues,
+                jql_query,
+                nextPageToken=next_page_token,
+                maxResults=page_size,
+                fields=STORY_FIELDS,
+                json_result=True,
+            )
+            for issue in page.get("issues", []):
+                yield _story_from_json(issue)
+            next_page_token = _next_page_token(page)
+            if next_page_token is None:
+                break
 
     def add_comment_to_issue(self, issue_key, comment_body):
         """
@@ -90,31 +325,251 @@ class JiraClient:
             issue: Objeto da issue criada ou None em caso de erro.
         """
         try:
-            parent_issue = self.jira.issue(parent_issue_key)
-            project_key = parent_issue.fields.project.key
-            subtask_issue_type = None
-            # Busca o tipo de issue 'Sub-task' para o projeto
-            for issue_type in self.jira.project(project_key).issueTypes:
-                if issue_type.name.lower() in ["sub-task", "subtarefa", "subtask"]:
-                    subtask_issue_type = issue_type
-                    break
-            if not subtask_issue_type:
-                logger.error(f"Tipo de issue 'Sub-task' não encontrado no projeto {project_key}.")
+            project_key = self._get_parent_project_key(parent_issue_key)
+            subtask_issue_type_id = self._get_subtask_issue_type_id(project_key)
+            if not subtask_issue_type_id:
+                logger.error("Tipo de issue 'Sub-task' não encontrado no projeto %s.", project_key)
                 return None
-            issue_dict = {
-                'project': {'key': project_key},
-                'parent': {'key': parent_issue_key},
-                'summary': summary,
-                'description': description or '',
-                'issuetype': {'id': subtask_issue_type.id}
-            }
-            new_issue = self.jira.create_issue(fields=issue_dict)
-            logger.info(f"Subtarefa criada: {new_issue.key} para {parent_issue_key}")
+            issue_dict = _subtask_fields(project_key, parent_issue_key, subtask_issue_type_id, summary, description)
+            new_issue = self.limiter.call("issue", self.jira.create_issue, fields=issue_dict)
+            logger.info("Subtarefa criada: %s para %s", new_issue.key, parent_issue_key)
             return new_issue
         except Exception as e:
-            logger.error(f"Erro ao criar subtarefa para {parent_issue_key}: {e}")
+            logger.error("Erro ao criar subtarefa para %s: %s", parent_issue_key, e)
             return None
 
+    def create_subtasks(self, parent_issue_key, scenarios):
+        """
+        Cria várias subtarefas de uma vez usando o endpoint de criação em lote do Jira
+        (até 50 issues por requisição).
+        Args:
+            parent_issue_key (str): Chave da User Story (ex: KCA-123).
+            scenarios (list): Pares (summary, description) de cada subtarefa.
+        Returns:
+            list: Issue criada para cada cenário, na mesma ordem, ou None nas que falharam.
+        """
+        scenarios = list(scenarios)
+        if not scenarios:
+            return []
+        try:
+            project_key = self._get_parent_project_key(parent_issue_key)
+            subtask_issue_type_id = self._get_subtask_issue_type_id(project_key)
+        except Exception as e:
+            logger.error("Erro ao consultar metadados de %s: %s", parent_issue_key, e)
+            return [None] * len(scenarios)
+        if not subtask_issue_type_id:
+            logger.error("Tipo de issue 'Sub-task' não encontrado no projeto %s.", project_key)
+            return [None] * len(scenarios)
+
+        created = []
+        for size, field_list in _bulk_chunks(project_key, parent_issue_key, subtask_issue_type_id, scenarios):
+            try:
+                results = self.limiter.call(
+                    "issue/bulk", self.jira.create_issues, field_list=field_list, prefetch=False
+                )
+            except Exception as e:
+                logger.error("Erro ao criar subtarefas em lote para %s: %s", parent_issue_key, e)
+                created.extend([None] * size)
+                continue
+            for result in results:
+                if result.get("status") == "Success":
+                    created.append(result["issue"])
+                else:
+                    logger.error("Erro ao criar subtarefa para %s: %s",
+                                 parent_issue_key, result.get('error'))
+                    created.append(None)
+        return _log_bulk_result(parent_issue_key, created)
+
+    def _get_parent_project_key(self, parent_issue_key):
+        """Projeto da issue pai, consultado no Jira apenas na primeira vez."""
+        project_key = self._parent_projects.get(parent_issue_key)
+        if project_key is None:
+            parent_issue = self.limiter.call("issue", self.jira.issue, parent_issue_key, fields="project")
+            project_key = parent_issue.fields.project.key
+            self._parent_projects.set(parent_issue_key, project_key)
+        return project_key
+
+    def _get_subtask_issue_type_id(self, project_key):
+        """ID do tipo 'Sub-task' do projeto, mantido em cache até expirar."""
+        issue_type_id = self._subtask_types.get(project_key)
+        if issue_type_id is None:
+            # Busca o tipo de issue 'Sub-task' para o projeto
+            project = self.limiter.call("project", self.jira.project, project_key)
+            issue_type_id = _subtask_type_id((issue_type.name, issue_type.id) for issue_type in project.issueTypes)
+            if issue_type_id is not None:
+                self._subtask_types.set(project_key, issue_type_id)
+        return issue_type_id
+
+
+class AsyncJiraClient:
+    """
+    Variante assíncrona do JiraClient, falando diretamente com a API REST v2.
+    Usa um httpx.AsyncClient com keep-alive (compartilhado com o AsyncOpenAIClient
+    quando informado), permitindo centenas de requisições em andamento a partir de
+    um único event loop.
+    """
+
+    def __init__(self, http_client=None):
+        self.jira_server = (os.getenv("JIRA_SERVER") or "").rstrip("/")
+        self.jira_username = os.getenv("JIRA_USERNAME")
+        self.jira_api_token = os.getenv("JIRA_API_TOKEN")
+        self.page_size = int(os.getenv("JIRA_PAGE_SIZE", "100"))
+        self.is_cloud = _is_cloud_server(self.jira_server)
+
+        metadata_ttl = float(os.getenv("JIRA_METADATA_TTL_SECONDS", "3600"))
+        self._parent_projects = _TTLCache(metadata_ttl)
+        self._subtask_types = _TTLCache(metadata_ttl)
+
+        self.limiter = get_limiter("jira")
+        self._owns_http_client = http_client is None
+        if http_client is None:
+            from http_pool import create_async_http_client
+            http_client = create_async_http_client()
+        self.http = http_client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_http_client:
+            await self.http.aclose()
+
+    async def _request(self, method, path, endpoint=None, **kwargs):
+        """
+        Executa uma requisição à API REST pelo RateLimiter do Jira.
+        Args:
+            endpoint (str, opcional): Nome do endpoint para o circuit breaker (padrão: `path`).
+        """
+        async def send():
+            response = await self.http.request(
+                method,
+                f"{self.jira_server}/rest/api/2/{path}",
+                auth=(self.jira_username or "", self.jira_api_token or ""),
+                headers={"Accept": "application/json"},
+                **kwargs,
+            )
+            # O endpoint de criação em lote responde 400 com o detalhe por issue
+            if response.status_code == 400 and path == "issue/bulk":
+                return response
+            response.raise_for_status()
+            return response
+
+        response = await self.limiter.acall(endpoint or path, send)
+        self.limiter.observe(response)
+        return response.json() if response.content else None
+
+    async def iter_user_stories(self, project_key, status="To Do", updated_since=None, page_size=None):
+        """
+        Equivalente assíncrono de JiraClient.iter_user_stories.
+        Yields:
+            dict: História de usuário com as chaves key, title, description, status e updated.
+        """
+        jql_query = _incremental_story_jql(project_key, status, updated_since)
+        logger.info("Buscando histórias com a query JQL: %s", jql_query)
+
+        page_size = page_size or self.page_size
+        if self.is_cloud:
+            async for story in self._search_stories_by_token(jql_query, page_size):
+                yield story
+            return
+        start_at = 0
+        while True:
+            page = await self._request("GET", "search", params={
+                "jql": jql_query,
+                "startAt": start_at,
+                "maxResults": page_size,
+                "fields": STORY_FIELDS,
+                "validateQuery": "false",
+            })
+            issues = page.get("issues", [])
+            for issue in issues:
+                yield _story_from_json(issue)
+            start_at += len(issues)
+            if _is_last_page(len(issues), start_at, page.get("total")):
+                break
+
+    async def _search_stories_by_token(self, jql_query, page_size):
+        next_page_token = None
+        while True:
+            params = {"jql": jql_query, "maxResults": page_size, "fields": STORY_FIELDS}
+            if next_page_token:
+                params["nextPageToken"] = next_page_token
+            page = await self._request("GET", "search/jql", endpoint="search", params=params)
+            for issue in page.get("issues", []):
+                yield _story_from_json(issue)
+            next_page_token = _next_page_token(page)
+            if next_page_token is None:
+                break
+
+    async def create_subtask(self, parent_issue_key, summary, description=None):
+        """
+        Cria uma única subtarefa. Returns: dict da issue criada ou None em caso de erro.
+        """
+        created = await self.create_subtasks(parent_issue_key, [(summary, description)])
+        return created[0]
+
+    async def create_subtasks(self, parent_issue_key, scenarios):
+        """
+        Equivalente assíncrono de JiraClient.create_subtasks.
+        Returns:
+            list: dict ({'id', 'key', 'self'}) de cada subtarefa criada, ou None nas que falharam.
+        """
+        scenarios = list(scenarios)
+        if not scenarios:
+            return []
+        try:
+            project_key = await self._get_parent_project_key(parent_issue_key)
+            subtask_issue_type_id = await self._get_subtask_issue_type_id(project_key)
+        except Exception as e:
+            logger.error("Erro ao consultar metadados de %s: %s", parent_issue_key, e)
+            return [None] * len(scenarios)
+        if not subtask_issue_type_id:
+            logger.error("Tipo de issue 'Sub-task' não encontrado no projeto %s.", project_key)
+            return [None] * len(scenarios)
+
+        created = []
+        for size, field_list in _bulk_chunks(project_key, parent_issue_key, subtask_issue_type_id, scenarios):
+            payload = {"issueUpdates": [{"fields": fields} for fields in field_list]}
+            try:
+                result = await self._request("POST", "issue/bulk", json=payload)
+            except Exception as e:
+                logger.error("Erro ao criar subtarefas em lote para %s: %s", parent_issue_key, e)
+                created.extend([None] * size)
+                continue
+            failed = {error["failedElementNumber"]: error for error in result.get("errors", [])}
+            issues = iter(result.get("issues", []))
+            for index in range(size):
+                if index in failed:
+                    logger.error("Erro ao criar subtarefa para %s: %s", parent_issue_key, failed[index])
+                    created.append(None)
+                else:
+                    created.append(next(issues, None))
+        return _log_bulk_result(parent_issue_key, created)
+
+    async def _get_parent_project_key(self, parent_issue_key):
+        project_key = self._parent_projects.get(parent_issue_key)
+        if project_key is None:
+            issue = await self._request(
+                "GET", f"issue/{parent_issue_key}", endpoint="issue", params={"fields": "project"}
+            )
+            project_key = issue["fields"]["project"]["key"]
+            self._parent_projects.set(parent_issue_key, project_key)
+        return project_key
+
+    async def _get_subtask_issue_type_id(self, project_key):
+        issue_type_id = self._subtask_types.get(project_key)
+        if issue_type_id is None:
+            project = await self._request("GET", f"project/{project_key}", endpoint="project")
+            issue_type_id = _subtask_type_id(
+                (issue_type["name"], issue_type["id"]) for issue_type in project.get("issueTypes", [])
+            )
+            if issue_type_id is not None:
+                self._subtask_types.set(project_key, issue_type_id)
+        return issue_type_id
+
 
 ##teste isolado
 if __name__ == "__main__":
@@ -135,6 +590,6 @@ if __name__ == "__main__":
         title_normalized = unicodedata.normalize('NFKD', story['title']).encode('ascii', 'ignore').decode('ascii')
         description_normalized = unicodedata.normalize('NFKD', story['description'][:100]).encode('ascii', 'ignore').decode('ascii')
 
-        logger.info(f"\n{story['key']} - {title_normalized}")
-        logger.info(f"Status: {story['status']}")
-        logger.info(f"Descrição: {description_normalized}...")
\ No newline at end of file
+        logger.info("\n%s - %s", story['key'], title_normalized)
+        logger.info("Status: %s", story['status'])
+        logger.info("Descrição: %s...", description_normalized)
@@ -0,0 +1,175 @@
+"""
+Fila de trabalhos do agente, persistida no SQLite (tabela jobs), e os processos
+que a consomem. Cada história passa por três etapas, cada uma um trabalho:
+busca no Jira (fetch) -> geração dos casos de teste (generate) -> criação das
+subtarefas (publish). Histórias recebidas por webhook entram como um trabalho
+"story", que substitui a busca. A reserva de um trabalho é atômica e expira: se o processo
+cair, outro o assume após QUEUE_LEASE_SECONDS.
+"""
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from health import STATUS_IDLE, Heartbeat
+from log_config import configure_logging
+from metrics import JOB_SECONDS, METRICS_PORT, PROFILER, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+JOB_FETCH = "fetch"
+JOB_GENERATE = "generate"
+JOB_PUBLISH = "publish"
+JOB_STORY = "story"
+
+# Duração da reserva (renovada enquanto o trabalho executa), intervalo entre
+# consultas com a fila vazia e novas tentativas com espera exponencial
+QUEUE_LEASE_SECONDS = float(os.getenv("QUEUE_LEASE_SECONDS", "300"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "1.0"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+QUEUE_RETRY_DELAY = float(os.getenv("QUEUE_RETRY_DELAY", "30"))
+
+
+class JobWorker:
+    """
+    Consome a fila de trabalhos, executando cada um com o handler correspondente
+    do QAAgent. Um trabalho que lança exceção volta à fila com espera exponencial
+    até QUEUE_MAX_ATTEMPTS tentativas.
+    """
+
+    def __init__(self, agent, worker_id=None, lease_seconds=None, poll_interval=None,
+                 max_attempts=None, retry_delay=None, heartbeat=None):
+        self.agent = agent
+        self.heartbeat = heartbeat
+        self.db_manager = agent.db_manager
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.lease_seconds = lease_seconds if lease_seconds is not None else QUEUE_LEASE_SECONDS
+        self.poll_interval = poll_interval if poll_interval is not None else QUEUE_POLL_INTERVAL
+        self.max_attempts = max_attempts if max_attempts is not None else QUEUE_MAX_ATTEMPTS
+        self.retry_delay = retry_delay if retry_delay is not None else QUEUE_RETRY_DELAY
+        self.handlers = {
+            JOB_FETCH: agent.handle_fetch_job,
+            JOB_GENERATE: agent.handle_generate_job,
+            JOB_PUBLISH: agent.handle_publish_job,
+            JOB_STORY: agent.handle_story_job,
+        }
+
+    def run_one(self):
+        """
+        Executa o próximo trabalho disponível.
+        Returns:
+            bool: False se a fila não tinha trabalho disponível.
+        """
+        job = self.db_manager.claim_job(self.worker_id, self.lease_seconds, kinds=list(self.handlers),
+                                        max_attempts=self.max_attempts)
+        if job is None:
+            return False
+        self._progress(f"trabalho {job['kind']}", f"trabalho {job['id']}")
+        start = time.perf_counter()
+        try:
+            with self._lease(job), PROFILER.sample():
+                self.handlers[job["kind"]](job["payload"])
+        except Exception as e:
+            JOB_SECONDS.observe(time.perf_counter() - start, kind=job["kind"], outcome="error")
+            logger.exception("Trabalho %s (%s) falhou na tentativa %s: %s",
+                             job['id'], job['kind'], job['attempts'], e)
+            delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+            if not self.db_manager.fail_job(job["id"], self.worker_id, e, delay, self.max_attempts):
+                logger.error("Reserva do trabalho %s perdida antes do registro da falha.", job['id'])
+            self._progress(STATUS_IDLE)
+            return True
+        JOB_SECONDS.observe(time.perf_counter() - start, kind=job["kind"], outcome="done")
+        if self.db_manager.complete_job(job["id"], self.worker_id):
+            logger.info("Trabalho %s (%s) concluído em %.2fs", job['id'], job['kind'], time.perf_counter() - start)
+        else:
+            logger.error("Reserva do trabalho %s perdida; ele será executado novamente.", job['id'])
+        self._progress(STATUS_IDLE)
+        return True
+
+    def _progress(self, status, detail=None):
+        if self.heartbeat is not None:
+            self.heartbeat.progress(status, detail)
+
+    def run(self, stop_event=None, drain=False):
+        """
+        Consome a fila até `stop_event` ser sinalizado.
+        Args:
+            stop_event (Event, opcional): Encerra o laço após o trabalho em andamento.
+            drain (bool): Encerra quando não houver mais trabalhos pendentes ou em execução.
+        """
+        while stop_event is None or not stop_event.is_set():
+            if self.run_one():
+                continue
+            if drain:
+                counts = self.db_manager.get_job_counts()
+                if not counts.get("pending") and not counts.get("running"):
+                    return
+            if stop_event is not None:
+                stop_event.wait(self.poll_interval)
+            else:
+                time.sleep(self.poll_interval)
+
+    @contextmanager
+    def _lease(self, job):
+        # Renova a reserva periodicamente enquanto o trabalho executa
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    if not self.db_manager.extend_job_lease(job["id"], self.worker_id, self.lease_seconds):
+                        return
+                except Exception as e:
+                    logger.error("Erro ao renovar a reserva do trabalho %s: %s", job['id'], e)
+
+        thread = threading.Thread(target=renew, daemon=True, name=f"lease-{job['id']}")
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+
+def _worker_process(stop_event, drain, agent_options, index=0):
+    # Ponto de entrada de cada processo: cria o próprio agente (conexões, clientes)
+    from main import QAAgent
+
+    configure_logging()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT + index)
+
+    agent = QAAgent(**agent_options)
+    try:
+        with Heartbeat(agent.db_manager, "worker") as heartbeat:
+            JobWorker(agent, heartbeat=heartbeat).run(stop_event, drain)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.db_manager.close()
+
+
+def start_worker_processes(count, drain=False, agent_options=None):
+    """
+    Inicia `count` processos que consomem a fila. O método "spawn" evita herdar
+    conexões SQLite e threads do processo principal.
+    Returns:
+        tuple: (processos iniciados, Event que os encerra após o trabalho em andamento).
+    """
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    processes = [
+        context.Process(
+            target=_worker_process,
+            args=(stop_event, drain, agent_options or {}, n),
+            name=f"qa-worker-{n}",
+            daemon=True,
+        )
+        for n in range(1, count + 1)
+    ]
+    for process in processes:
+        process.start()
+    return processes, stop_event
@@ -0,0 +1,94 @@
+"""
+Configuração central de logging. Os módulos apenas obtêm `logging.getLogger(__name__)`
+e registram com formatação preguiçosa (`logger.info("... %s", valor)`); os pontos de
+entrada (agente, processos da fila e aplicação web) chamam `configure_logging()`.
+Os registros passam por uma fila: quem registra só enfileira, e uma thread escreve
+no stderr, de modo que a saída lenta nunca bloqueia o agente nem as requisições.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+
+# Nível mínimo (DEBUG inclui os textos gerados pela OpenAI) e formato: "json" ou "text"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+# Atributos padrão de LogRecord; os demais vêm de `extra=` e entram no JSON
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha: horário, nível, logger, mensagem, campos extras e exceção."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # O QueueHandler padrão formata a mensagem na thread que registra; aqui a
+    # formatação fica para a thread de escrita, só as exceções são convertidas em texto
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """
+    Direciona o logging de todo o processo para a fila e inicia a thread de escrita.
+    Chamadas seguintes apenas ajustam o nível.
+    Args:
+        level (str, opcional): Nível mínimo; padrão LOG_LEVEL.
+        fmt (str, opcional): "json" ou "text"; padrão LOG_FORMAT.
+        stream (arquivo, opcional): Destino; padrão sys.stderr.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    # Escreve os registros pendentes antes de o processo encerrar
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Esvazia a fila e encerra a thread de escrita."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
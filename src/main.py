@@ -6,42 +6,160 @@ import time
 import schedule
 from datetime import datetime, timedelta
 import argparse
-import traceback  # Para exibir rastreamentos detalhados de erros
+import logging
+import signal
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv  # Para carregar variáveis de ambiente de um arquivo .env
+import json
 import unicodedata  # Para normalizar caracteres Unicode
 
 # Importa os componentes do agente, como clientes para Jira e OpenAI, e o gerenciador de banco de dados
-from jira_client import JiraClient
-from openai_client import OpenAIClient
-from db_manager import DBManager
+from jira_client import AsyncJiraClient, JiraClient
+from openai_client import AsyncOpenAIClient, OpenAIClient
+from http_pool import create_async_http_client
+from db_manager import DBManager, story_hash, subtask_hash
+from health import STATUS_IDLE, Heartbeat
+from log_config import configure_logging
+from job_queue import JOB_FETCH, JOB_GENERATE, JOB_PUBLISH, JobWorker, start_worker_processes
+from metrics import CYCLE_SECONDS, CYCLE_STORIES, METRICS_PORT, PROFILER, start_metrics_server
+from pipeline import GenerationProgress, PipelineStats, chunked
+from scenarios import ScenarioStreamParser, parse_scenarios, render_jira_wiki, render_markdown
+from threaded_clients import ThreadedJiraClient, ThreadedOpenAIClient, iterate_in_thread
+from token_budget import TokenUsage
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class QAAgent:
     """
     Classe principal do agente de QA. Gerencia a conexão com serviços externos (Jira, OpenAI),
     interage com o banco de dados e executa o monitoramento de histórias de usuário.
     """
 
-    def __init__(self):
+    def __init__(self, force_regenerate=False, use_async=None, streaming=None, batch_prompts=None,
+                 workers=None, reuse_similar=None):
         """
         Inicializa o agente de QA, configurando conexões e parâmetros padrão.
+        Args:
+            force_regenerate (bool): Gera novamente os casos de teste mesmo que já
+                existam para a história ou estejam no cache de gerações.
+            use_async (bool, opcional): Usa os clientes assíncronos em um único event
+                loop em vez do pool de threads. Padrão: variável AGENT_ASYNC.
+            streaming (bool, opcional): Consome a geração em streaming e publica cada
+                cenário no Jira assim que ele termina. Padrão: variável AGENT_STREAMING.
+            batch_prompts (bool, opcional): Gera os casos de teste de várias histórias
+                pequenas em uma única chamada à OpenAI. Ignorado no modo streaming.
+                Padrão: variável AGENT_BATCH_PROMPTS.
+            workers (int, opcional): Processos que consomem a fila de trabalhos do
+                banco (busca, geração e publicação). 0 processa cada ciclo neste
+                processo. Padrão: variável AGENT_WORKERS.
+            reuse_similar (bool, opcional): Reutiliza os cenários de uma história quase
+                idêntica já gerada em vez de chamar a OpenAI (ver similarity.py).
+                Padrão: variável AGENT_REUSE_SIMILAR.
         """
-        # Inicializa os clientes para Jira e OpenAI, além do gerenciador de banco de dados
-        self.jira_client = JiraClient()
-        self.openai_client = OpenAIClient()
+        # Os clientes do Jira e da OpenAI são criados no primeiro uso (ver jira_client e
+        # openai_client abaixo): `--once` sem histórias novas e os processos da fila que
+        # só publicam não autenticam no serviço que não usam
         self.db_manager = DBManager()
+        self._jira_client = None
+        self._openai_client = None
+        self._clients_lock = threading.Lock()
+        self.force_regenerate = force_regenerate
+        if use_async is None:
+            use_async = os.getenv("AGENT_ASYNC", "0") == "1"
+        self.use_async = use_async
+        if streaming is None:
+            streaming = os.getenv("AGENT_STREAMING", "0") == "1"
+        self.streaming = streaming
+        if batch_prompts is None:
+            batch_prompts = os.getenv("AGENT_BATCH_PROMPTS", "0") == "1"
+        self.batch_prompts = batch_prompts
+        if workers is None:
+            workers = int(os.getenv("AGENT_WORKERS", "0"))
+        self.workers = workers
+        if reuse_similar is None:
+            reuse_similar = os.getenv("AGENT_REUSE_SIMILAR", "0") == "1"
+        self.reuse_similar = reuse_similar
+        self._similar_index = None
+        # Trabalhos concluídos e entregas de webhook são mantidos por este tempo
+        self.finished_jobs_ttl = float(os.getenv("QUEUE_FINISHED_TTL_HOURS", "24")) * 3600
 
         # Configurações padrão do agente, como chave do projeto e status das histórias
         self.project_key = os.getenv("JIRA_PROJECT_KEY", "KCA")
         self.status = os.getenv("JIRA_STATUS", "To Do")
         self.check_interval = 0.05  # Intervalo de monitoramento reduzido para ~3 segundos
+        # Com o webhook do Jira configurado, as histórias chegam pela fila assim que são
+        # criadas ou alteradas e a busca periódica vira apenas uma reconciliação lenta
+        self.webhooks_enabled = bool(os.getenv("JIRA_WEBHOOK_SECRET"))
+        if self.webhooks_enabled:
+            self.check_interval = float(os.getenv("AGENT_RECONCILE_INTERVAL_MINUTES", "60"))
+
+        # Limites de concorrência: histórias processadas em paralelo, chamadas
+        # simultâneas à OpenAI e escritas simultâneas no Jira
+        self.max_workers = int(os.getenv("AGENT_MAX_WORKERS", "8"))
+        # Histórias gravadas no banco por transação
+        self.db_batch_size = int(os.getenv("AGENT_DB_BATCH_SIZE", "100"))
+        self.openai_concurrency = int(os.getenv("OPENAI_CONCURRENCY", "4"))
+        self.jira_write_concurrency = int(os.getenv("JIRA_WRITE_CONCURRENCY", "4"))
+        # Reserva de uma subtarefa em publicação; expirada, outro processo a publica
+        self.publish_lease_seconds = float(os.getenv("JIRA_PUBLISH_LEASE_SECONDS", "300"))
+        # Histórias em andamento no modo assíncrono (no modo com threads, 2 x max_workers)
+        self.async_max_in_flight = int(os.getenv("AGENT_ASYNC_MAX_IN_FLIGHT", "200"))
+
+        # Busca incremental: janela da primeira sincronização e sobreposição da marca d'água
+        self.initial_lookback_days = int(os.getenv("JIRA_INITIAL_LOOKBACK_DAYS", "1"))
+        self.watermark_overlap_minutes = int(os.getenv("JIRA_WATERMARK_OVERLAP_MINUTES", "5"))
 
         # Armazena o timestamp da última verificação
         self.last_checked_time = None
+        # Estatísticas por etapa do último ciclo executado
+        self.last_cycle_stats = None
+        # Sinal de vida gravado no banco durante o monitoramento contínuo
+        self.heartbeat = None
+
+        logger.info("QA Agent inicializado para o projeto %s", self.project_key)
+
+    @property
+    def jira_client(self):
+        if self._jira_client is None:
+            with self._clients_lock:
+                if self._jira_client is None:
+                    self._jira_client = JiraClient()
+        return self._jira_client
 
-        print(f"QA Agent inicializado para o projeto {self.project_key}")
+    @jira_client.setter
+    def jira_client(self, client):
+        self._jira_client = client
+
+    @property
+    def openai_client(self):
+        if self._openai_client is None:
+            with self._clients_lock:
+                if self._openai_client is None:
+                    self._openai_client = OpenAIClient(cache=self.db_manager)
+        return self._openai_client
+
+    @openai_client.setter
+    def openai_client(self, client):
+        self._openai_client = client
+
+    @property
+    def similar_index(self):
+        if self._similar_index is None:
+            with self._clients_lock:
+                if self._similar_index is None:
+                    # NumPy só é carregado quando a reutilização está ativa
+                    from similarity import SimilarityIndex
+                    self._similar_index = SimilarityIndex(self.db_manager)
+        return self._similar_index
+
+    def _progress(self, status=None, detail=None):
+        if self.heartbeat is not None:
+            self.heartbeat.progress(status, detail)
 
     def format_jira_datetime(self, dt):
         """
@@ -55,135 +173,610 @@ class QAAgent:
         """
         return dt.strftime("%Y-%m-%d %H:%M")
 
-    def process_user_story(self, story):
+    async def process_user_story(self, clients, story, stats, prepared, raw_test_cases=None, usage=None):
         """
         Processa uma história de usuário, gerando casos de teste e salvando no banco de dados.
         Agora, cada cenário de teste é registrado como subtarefa no Jira.
+        As operações de banco de dados rodam em threads para não bloquear o event loop.
+        Args:
+            clients (_PipelineClients): Clientes e limites de concorrência da execução.
+            story (dict): História retornada pelo JiraClient.
+            stats (PipelineStats): Acumulador de métricas do ciclo.
+            prepared (tuple): (campos normalizados, story_id, possui casos de teste),
+                com a história já gravada em lote por `_prepare_batch`.
+            raw_test_cases (str, opcional): Casos de teste já gerados (prompt em lote
+                ou Batch API); dispensa a chamada à OpenAI.
+            usage (TokenUsage, opcional): Tokens gastos na geração de `raw_test_cases`
+                (parte da história no prompt em lote).
         """
-        print(f"[DEBUG] Iniciando processamento da história: {story.get('key', story)}")
+        logger.debug("Iniciando processamento da história: %s", story.get('key', story))
+        self._progress()
         try:
-            # Normaliza os caracteres Unicode para evitar problemas de codificação
-            jira_key = unicodedata.normalize("NFKD", story["key"]).encode("ascii", "ignore").decode("ascii")
-            title = unicodedata.normalize("NFKD", story["title"]).encode("ascii", "ignore").decode("ascii")
-            description = unicodedata.normalize("NFKD", story["description"]).encode("ascii", "ignore").decode("ascii")
-            status = unicodedata.normalize("NFKD", story["status"]).encode("ascii", "ignore").decode("ascii")
-
-            print(f"Processando história: {jira_key} - {title}")
-
-            # Salva a história no banco de dados e obtém o ID
-            story_id = self.db_manager.save_user_story(
-                jira_key=jira_key,
-                title=title,
-                description=description,
-                status=status
-            )
-            print(f"História {jira_key} salva/atualizada no DB com ID: {story_id}")
-            print(f"[DEBUG] História salva no banco: {jira_key}")
+            fields, story_id, has_test_cases = prepared
+            jira_key = fields["jira_key"]
+            logger.info("Processando história: %s - %s (ID: %s)", jira_key, fields['title'], story_id)
 
-            # Verificar se já existem casos de teste para a história (pelo story_id)
-            existing_test_cases = self.db_manager.get_test_cases_for_story(story_id)
-            if existing_test_cases:
-                print(f"Já existem casos de teste para a história {jira_key} (ID: {story_id}). Pulando geração.")
-                return True
+            if has_test_cases and not self.force_regenerate:
+                logger.info("Já existem casos de teste para a história %s (ID: %s). Pulando geração.",
+                            jira_key, story_id)
+                return await self._resume_publishing(clients, jira_key, story_id, stats)
 
-            # Prepara o texto da história para enviar ao modelo de IA
-            story_text = f"""
-            Título: {title}
+            if raw_test_cases is None:
+                raw_test_cases = await asyncio.to_thread(self._reused_test_cases, fields, story_id, stats)
+            if raw_test_cases is None and self.streaming:
+                return await self._process_streaming(clients, jira_key, story_id, fields, stats)
 
-            Descrição:
-            {description}
-            """
-
-            # Gera os casos de teste usando o OpenAI
-            raw_test_cases = self.openai_client.generate_test_cases(story_text)
-            print(f"[DEBUG] Casos de teste gerados para {jira_key}:\n{raw_test_cases}")
+            if raw_test_cases is None:
+                # Gera os casos de teste usando o OpenAI
+                usage = TokenUsage()
+                async with clients.openai_slots:
+                    with stats.stage("openai"):
+                        raw_test_cases = await clients.openai.generate_test_cases(
+                            self._build_story_text(fields), force_refresh=self.force_regenerate, usage=usage
+                        )
+            logger.debug("Casos de teste gerados para %s:\n%s", jira_key, raw_test_cases)
+            cenarios = parse_scenarios(raw_test_cases) if raw_test_cases else []
+            if not cenarios:
+                return self._generation_failed(jira_key, stats)
 
             # Salva os casos de teste no banco de dados
-            test_case_db_id = self.db_manager.save_test_cases(story_id, raw_test_cases)
-            print(f"Casos de teste gerados e salvos no DB para {jira_key} com ID: {test_case_db_id}")
-
-            # Divide os cenários de teste por "Cenário:" (padrão do prompt)
-            cenarios = []
-            current = []
-            for line in raw_test_cases.splitlines():
-                if line.strip().lower().startswith("cenário") or line.strip().lower().startswith("cenario"):
-                    if current:
-                        cenarios.append("\n".join(current))
-                        current = []
-                current.append(line)
-            if current:
-                cenarios.append("\n".join(current))
-
-            # Cria uma subtarefa para cada cenário
-            for idx, cenario in enumerate(cenarios, 1):
-                resumo = cenario.splitlines()[0].replace("Cenário:", "").replace("Cenario:", "").strip() or f"Cenário {idx}"
-                descricao_bruta = "\n".join(cenario.splitlines()[1:]).strip()
-                # Formata a descrição para Markdown antes de criar a subtarefa
-                descricao_formatada = self.format_test_cases_to_markdown(descricao_bruta)
-                self.jira_client.create_subtask(
-                    parent_issue_key=jira_key,
-                    summary=resumo,
-                    description=descricao_formatada
+            with stats.stage("db"):
+                test_case_db_id = await asyncio.to_thread(
+                    self.db_manager.save_test_cases, story_id, render_markdown(cenarios), cenarios,
+                    story_content_hash=fields.get("content_hash"), usage=usage
                 )
+            logger.info("Casos de teste gerados e salvos no DB para %s com ID: %s", jira_key, test_case_db_id)
 
-            print(f"[DEBUG] Subtarefas criadas para {jira_key} (total: {len(cenarios)})")
-            return True
+            subtarefas = self._build_subtasks(cenarios)
+
+            # Cria em lote as subtarefas da história que ainda não foram publicadas
+            criadas = await self._publish_subtasks(clients, jira_key, subtarefas, stats)
+            return self._record_subtask_failures(jira_key, criadas, stats)
 
         except Exception as e:
-            print(f"[ERRO] Falha ao processar história {story.get('key', story)}: {e}")
-            traceback.print_exc()
+            logger.exception("Falha ao processar história %s: %s", story.get('key', story), e)
             return False
 
+    async def _process_streaming(self, clients, jira_key, story_id, fields, stats):
+        """
+        Gera os casos de teste em streaming. Cada cenário é enviado ao Jira assim
+        que seu objeto JSON se fecha, em paralelo com o restante da geração, e os
+        cenários concluídos ficam disponíveis para a aplicação web.
+        Se a geração falhar no meio, os cenários já publicados permanecem no Jira.
+        """
+        progress = GenerationProgress(self.db_manager, story_id)
+        parser = ScenarioStreamParser()
+        usage = TokenUsage()
+        cenarios, partes, publicacoes = [], [], []
+
+        def publicar(novos):
+            for cenario in novos:
+                cenarios.append(cenario)
+                subtarefa = self._subtask_from_scenario(cenario, len(cenarios))
+                publicacoes.append(asyncio.create_task(
+                    self._publish_subtasks(clients, jira_key, [subtarefa], stats)
+                ))
+            progress.text = render_markdown(cenarios)
+
+        try:
+            async with clients.openai_slots:
+                with stats.stage("openai"):
+                    async for delta in clients.openai.stream_test_cases(
+                        self._build_story_text(fields), force_refresh=self.force_regenerate, usage=usage
+                    ):
+                        partes.append(delta)
+                        novos = parser.feed(delta)
+                        if novos:
+                            publicar(novos)
+                            await asyncio.to_thread(progress.flush)
+        except Exception as e:
+            logger.error("Erro ao gerar casos de teste com OpenAI: %s", e)
+            await asyncio.to_thread(progress.flush, "failed")
+            await asyncio.gather(*publicacoes, return_exceptions=True)
+            return self._generation_failed(jira_key, stats)
+
+        if not cenarios:
+            # Resposta fora do esquema: interpretada por inteiro ao final
+            publicar(parse_scenarios("".join(partes)))
+        if not cenarios:
+            await asyncio.to_thread(progress.flush, "failed")
+            return self._generation_failed(jira_key, stats)
+
+        with stats.stage("db"):
+            await asyncio.to_thread(
+                self.db_manager.save_test_cases, story_id, progress.text, cenarios,
+                story_content_hash=fields.get("content_hash"), usage=usage
+            )
+        await asyncio.to_thread(progress.clear)
+        resultados = await asyncio.gather(*publicacoes)
+        criadas = [issue for resultado in resultados for issue in resultado]
+        return self._record_subtask_failures(jira_key, criadas, stats)
+
+    async def _publish_subtasks(self, clients, jira_key, subtarefas, stats):
+        """
+        Cria no Jira as subtarefas ainda não publicadas. Cada uma é identificada pela
+        chave da história e pelo hash do conteúdo (tabela published_subtasks): as já
+        publicadas são puladas, as reservadas por outro processo ficam para ele, e
+        uma nova tentativa após falha parcial cria apenas as que faltaram.
+        Returns:
+            list: Chave da issue de cada subtarefa, na mesma ordem, ou None nas que
+            não foram publicadas.
+        """
+        hashes = [subtask_hash(summary, description) for summary, description in subtarefas]
+        with stats.stage("db"):
+            publicadas = await asyncio.to_thread(
+                self.db_manager.claim_subtasks, jira_key, hashes, self.publish_lease_seconds
+            )
+        pendentes = {
+            scenario_hash: subtarefa for scenario_hash, subtarefa in zip(hashes, subtarefas)
+            if scenario_hash in publicadas and publicadas[scenario_hash] is None
+        }
+        if pendentes:
+            try:
+                criadas = await self._create_subtasks(clients, jira_key, list(pendentes.values()), stats)
+            except Exception:
+                await asyncio.to_thread(self.db_manager.finish_subtasks, jira_key, dict.fromkeys(pendentes))
+                raise
+            resultados = dict(zip(pendentes, map(_issue_key, criadas)))
+            with stats.stage("db"):
+                await asyncio.to_thread(self.db_manager.finish_subtasks, jira_key, resultados)
+            publicadas.update(resultados)
+        return [publicadas.get(scenario_hash) for scenario_hash in hashes]
+
+    def _unpublished_subtasks(self, jira_key, story_id):
+        """
+        Subtarefas do caso de teste mais recente da história a publicar novamente,
+        se alguma publicação anterior falhou ou ficou pela metade.
+        Returns:
+            list: Pares (resumo, descrição); vazia se não há o que retomar.
+        """
+        if not self.db_manager.get_keys_with_unpublished_subtasks([jira_key]):
+            return []
+        cenarios = self.db_manager.get_scenarios_for_story(story_id)
+        subtarefas = self._build_subtasks(cenarios[max(cenarios)]) if cenarios else []
+        # Falhas de cenários de gerações anteriores não são mais publicadas
+        self.db_manager.discard_unpublished_subtasks(
+            jira_key, [subtask_hash(summary, description) for summary, description in subtarefas]
+        )
+        return subtarefas
+
+    async def _resume_publishing(self, clients, jira_key, story_id, stats):
+        with stats.stage("db"):
+            subtarefas = await asyncio.to_thread(self._unpublished_subtasks, jira_key, story_id)
+        if not subtarefas:
+            return True
+        logger.info("Retomando a publicação das subtarefas de %s.", jira_key)
+        criadas = await self._publish_subtasks(clients, jira_key, subtarefas, stats)
+        return self._record_subtask_failures(jira_key, criadas, stats)
+
+    async def _create_subtasks(self, clients, jira_key, subtarefas, stats):
+        async with clients.jira_write_slots:
+            with stats.stage("jira", items=len(subtarefas)):
+                return await clients.jira.create_subtasks(jira_key, subtarefas)
+
+    def _generation_units(self, clients, prepared):
+        """
+        Agrupa as histórias preparadas por `_prepare_batch` em unidades de trabalho.
+        Com prompts em lote, as que precisam de geração são reunidas conforme o
+        orçamento de tokens do OpenAIClient; as demais seguem uma a uma.
+        Returns:
+            list: Listas de pares (história, preparada).
+        """
+        if not self.batch_prompts or self.streaming:
+            return [[item] for item in prepared]
+        units, to_generate = [], {}
+        for story, (fields, story_id, has_test_cases) in prepared:
+            if (has_test_cases and not self.force_regenerate) or self._find_similar(fields, story_id):
+                # Sem geração (ou reutilizando os cenários de uma história parecida): segue sozinha
+                units.append([(story, (fields, story_id, has_test_cases))])
+            else:
+                to_generate[fields["jira_key"]] = (story, (fields, story_id, has_test_cases))
+        plan = clients.openai.plan_batches(
+            [(key, self._build_story_text(item[1][0])) for key, item in to_generate.items()]
+        )
+        units.extend([to_generate[key] for key in keys] for keys in plan)
+        return units
+
+    async def _process_group(self, clients, unit, stats):
+        """
+        Gera com um único prompt os casos de teste de um grupo de histórias e
+        conclui cada uma (banco de dados e subtarefas) em paralelo com o texto recebido.
+        Returns:
+            list: Sucesso de cada história do grupo.
+        """
+        with stats.stage("stories", items=len(unit)):
+            textos = {fields["jira_key"]: self._build_story_text(fields) for _, (fields, _, _) in unit}
+            usos = {}
+            async with clients.openai_slots:
+                with stats.stage("openai", items=len(unit)):
+                    gerados = await clients.openai.generate_test_cases_batch(
+                        textos, force_refresh=self.force_regenerate, usages=usos
+                    )
+
+            async def concluir(story, prepared):
+                jira_key = prepared[0]["jira_key"]
+                if not gerados.get(jira_key):
+                    return self._generation_failed(jira_key, stats)
+                return await self.process_user_story(
+                    clients, story, stats, prepared, gerados[jira_key], usage=usos.get(jira_key)
+                )
+
+            return await asyncio.gather(*(concluir(story, prepared) for story, prepared in unit))
+
+    def _normalize_story(self, story):
+        """
+        Normaliza os caracteres Unicode dos campos da história para evitar problemas de codificação.
+        Returns:
+            dict: Campos jira_key, title, description e status em ASCII, além de
+            jira_updated e content_hash, usados para detectar histórias inalteradas.
+        """
+        def to_ascii(value):
+            return unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii")
+
+        fields = {
+            "jira_key": to_ascii(story["key"]),
+            "title": to_ascii(story["title"]),
+            "description": to_ascii(story["description"]),
+            "status": to_ascii(story["status"]),
+            "jira_updated": story.get("updated"),
+        }
+        fields["content_hash"] = story_hash(fields["title"], fields["description"])
+        return fields
+
+    def _prepare_batch(self, batch, stats):
+        """
+        Normaliza um lote de histórias e grava todas de uma vez (um único commit),
+        consultando também quais já possuem casos de teste. Histórias com o mesmo
+        "updated" do Jira e casos de teste atuais são descartadas com uma única
+        consulta, sem normalização nem escrita no banco.
+        Returns:
+            list: Pares (história, (campos, story_id, possui casos de teste)). Se a
+            mesma chave aparecer mais de uma vez no lote, vale a última ocorrência.
+        """
+        batch = self._skip_unchanged(batch, stats)
+        normalized = {}
+        for story in batch:
+            try:
+                fields = self._normalize_story(story)
+            except Exception as e:
+                logger.error("História inválida %s: %s", story.get('key', story), e)
+                stats.record("failed", 0.0)
+                continue
+            normalized[fields["jira_key"]] = (story, fields)
+        if not normalized:
+            return []
+
+        with stats.stage("db", items=len(normalized)):
+            story_ids = self.db_manager.bulk_upsert_user_stories(fields for _, fields in normalized.values())
+            with_test_cases = self.db_manager.get_story_ids_with_test_cases(list(story_ids.values()))
+        return [
+            (story, (fields, story_ids[key], story_ids[key] in with_test_cases))
+            for key, (story, fields) in normalized.items()
+        ]
+
+    def _skip_unchanged(self, batch, stats):
+        """
+        Returns:
+            list: Histórias do lote que são novas, foram alteradas no Jira ou ainda
+            não têm casos de teste para o conteúdo atual.
+        """
+        batch = list(batch)
+        if self.force_regenerate or not batch:
+            return batch
+        states = self.db_manager.get_story_sync_states({story.get("key") for story in batch})
+        changed, unchanged = [], []
+        for story in batch:
+            state = states.get(story.get("key"))
+            if (state and story.get("updated") and state["jira_updated"] == story.get("updated")
+                    and state["generated_hash"] == state["content_hash"]):
+                unchanged.append(story)
+            else:
+                changed.append(story)
+        if unchanged:
+            # Histórias inalteradas, mas com subtarefas a publicar, seguem para retomar a publicação
+            unpublished = self.db_manager.get_keys_with_unpublished_subtasks({story["key"] for story in unchanged})
+            changed.extend(story for story in unchanged if story["key"] in unpublished)
+        if len(changed) < len(batch):
+            stats.record("unchanged", 0.0, items=len(batch) - len(changed))
+        return changed
+
+    def _build_story_text(self, fields):
+        # Prepara o texto da história para enviar ao modelo de IA
+        return f"""
+            Título: {fields['title']}
+
+            Descrição:
+            {fields['description']}
+            """
+
+    def _build_subtasks(self, cenarios):
+        """
+        Returns:
+            list: Pares (resumo, descrição no formato wiki do Jira) de cada cenário.
+        """
+        return [self._subtask_from_scenario(cenario, idx) for idx, cenario in enumerate(cenarios, 1)]
+
+    def _subtask_from_scenario(self, cenario, idx):
+        """Resumo e descrição da subtarefa de um cenário."""
+        return cenario.title or f"Cenário {idx}", render_jira_wiki(cenario)
+
+    def _find_similar(self, fields, story_id):
+        """
+        Returns:
+            tuple: (story_id, similaridade) da história quase idêntica com casos de
+            teste atuais, ou None se a reutilização estiver desativada.
+        """
+        if not self.reuse_similar or self.force_regenerate:
+            return None
+        try:
+            return self.similar_index.find(fields["title"], fields["description"], exclude=story_id)
+        except Exception as e:
+            logger.error("Erro ao buscar histórias parecidas com %s: %s", fields["jira_key"], e)
+            return None
+
+    def _reused_test_cases(self, fields, story_id, stats):
+        """
+        Cenários de uma história quase idêntica, no formato da geração da OpenAI.
+        Returns:
+            str: JSON no formato de scenarios.TEST_CASES_SCHEMA, ou None para gerar.
+        """
+        if not self.reuse_similar or self.force_regenerate:
+            return None
+        with stats.stage("similarity"):
+            match = self._find_similar(fields, story_id)
+            if match is None:
+                return None
+            similar_id, score = match
+            cenarios = self.db_manager.get_scenarios_for_story(similar_id)
+        if not cenarios:
+            return None
+        logger.info("Reutilizando os casos de teste da história %s para %s (similaridade %.2f).",
+                    similar_id, fields["jira_key"], score)
+        stats.record("reused", 0.0)
+        return json.dumps({"scenarios": [cenario.to_dict() for cenario in cenarios[max(cenarios)]]},
+                          ensure_ascii=False)
+
+    def _generation_failed(self, jira_key, stats):
+        # Nada é salvo: a história volta a ser processada no próximo ciclo
+        stats.record("openai_failed", 0.0)
+        logger.error("Não foi possível gerar casos de teste para %s; nova tentativa no próximo ciclo.", jira_key)
+        return False
+
+    def _record_subtask_failures(self, jira_key, criadas, stats):
+        """
+        Returns:
+            bool: True se todas as subtarefas foram publicadas. Do contrário a história
+            conta como falha e a publicação é retomada no próximo ciclo.
+        """
+        falhas = sum(1 for issue in criadas if issue is None)
+        if falhas:
+            stats.record("jira_failed", 0.0, items=falhas)
+        logger.debug("Subtarefas criadas para %s (total: %s/%s)", jira_key, len(criadas) - falhas, len(criadas))
+        return not falhas
+
     def check_for_new_stories(self):
         """
         Verifica se há novas histórias de usuário no Jira e as processa.
+        Apenas as histórias atualizadas desde a marca d'água da última sincronização
+        bem-sucedida (tabela sync_logs) são buscadas, página a página.
         """
-        print(f"[DEBUG] Iniciando verificação de novas histórias no Jira...")
+        logger.debug("Iniciando verificação de novas histórias no Jira...")
         try:
-            print(f"Verificando novas histórias em {self.project_key} com status '{self.status}'...")
+            cycle_started = datetime.now()
+            updated_since = self._updated_since(cycle_started)
+
+            # Busca histórias no Jira (paginação consumida sob demanda)
+            stats = self._run_pipeline(lambda clients: self._process_stories(
+                clients,
+                clients.jira.iter_user_stories(
+                    project_key=self.project_key,
+                    status=self.status,
+                    updated_since=updated_since
+                ),
+            ))
+            self._finish_cycle(stats, cycle_started)
 
-            # Define o período de busca para as últimas 24 horas
-            last_checked = datetime.now() - timedelta(days=1)
-            print(f"Buscando histórias criadas após {self.format_jira_datetime(last_checked)}")
+        except Exception as e:
+            logger.exception("Falha ao verificar novas histórias: %s", e)
 
-            # Busca histórias no Jira
-            stories = self.jira_client.get_user_stories(
-                project_key=self.project_key,
-                status=self.status,
-                days_ago=1
+    def _updated_since(self, cycle_started, project_key=None, status=None):
+        """
+        Calcula o início da janela de busca a partir da marca d'água do projeto
+        (por padrão, o projeto configurado no agente).
+        """
+        project_key = project_key or self.project_key
+        logger.info("Verificando novas histórias em %s com status '%s'...", project_key, status or self.status)
+        watermark = self.db_manager.get_last_watermark(project_key)
+        if watermark is None:
+            # Primeira sincronização do projeto: janela inicial configurável
+            updated_since = cycle_started - timedelta(days=self.initial_lookback_days)
+        else:
+            # Sobreposição para cobrir diferenças de relógio com o Jira
+            updated_since = watermark - timedelta(minutes=self.watermark_overlap_minutes)
+        logger.info("Buscando histórias atualizadas após %s", self.format_jira_datetime(updated_since))
+        return updated_since
+
+    def _finish_cycle(self, stats, cycle_started):
+        summary = stats.summary()
+        processed = summary.get("stories", {}).get("items", 0)
+        failed = summary.get("failed", {}).get("items", 0)
+        unchanged = summary.get("unchanged", {}).get("items", 0)
+
+        # Atualiza o timestamp da última verificação para o momento atual
+        self.last_checked_time = datetime.now()
+        # A marca d'água só avança se todas as histórias foram processadas;
+        # do contrário a próxima busca cobre novamente a mesma janela
+        self.db_manager.log_sync_time(
+            project_key=self.project_key,
+            watermark=cycle_started if not failed else None
+        )
+        if self.webhooks_enabled:
+            self.db_manager.purge_finished_jobs(self.finished_jobs_ttl)
+            self.db_manager.purge_webhook_deliveries(self.finished_jobs_ttl)
+
+        if unchanged:
+            logger.info("%s histórias inalteradas desde a última sincronização.", unchanged)
+        if not processed:
+            logger.info("Nenhuma nova história encontrada.")
+        else:
+            logger.info("Encontradas %s novas histórias (%s com falha).", processed, failed)
+
+    def run_cycle(self):
+        """
+        Executa um ciclo de verificação no modo configurado (threads ou asyncio).
+        Com processos da fila, apenas enfileira a busca no Jira.
+        """
+        self._progress("ciclo")
+        try:
+            if self.workers:
+                self.enqueue_fetch()
+            else:
+                self.check_for_new_stories()
+        finally:
+            self._progress(STATUS_IDLE)
+
+    def process_stories(self, stories):
+        """
+        Processa as histórias de um iterável (ver `_process_stories`).
+        Args:
+            stories (iterable): Histórias retornadas pelo JiraClient.
+        Returns:
+            PipelineStats: Métricas por etapa do lote processado.
+        """
+        return self._run_pipeline(lambda clients: self._process_stories(clients, iterate_in_thread(stories)))
+
+    def _run_pipeline(self, pipeline):
+        """
+        Executa a corrotina `pipeline(clients)` em um event loop próprio. O pipeline
+        é o mesmo nos dois modos; mudam apenas os clientes:
+        - assíncrono: AsyncJiraClient e AsyncOpenAIClient compartilham um pool de
+          conexões keep-alive, com até `async_max_in_flight` histórias em andamento;
+        - threads: JiraClient e OpenAIClient rodam em um executor de `max_workers`
+          threads, com até o dobro de histórias em andamento.
+        Returns:
+            O resultado de `pipeline`.
+        """
+        with PROFILER.sample():
+            return asyncio.run(self._with_clients(pipeline))
+
+    async def _with_clients(self, pipeline):
+        limits = (self.openai_concurrency, self.jira_write_concurrency)
+        if not self.use_async:
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="qa-story")
             )
+            return await pipeline(_PipelineClients(
+                ThreadedJiraClient(self.jira_client), ThreadedOpenAIClient(self.openai_client),
+                self.max_workers * 2, *limits
+            ))
+        async with create_async_http_client() as http_client:
+            return await pipeline(_PipelineClients(
+                AsyncJiraClient(http_client=http_client),
+                AsyncOpenAIClient(cache=self.db_manager, http_client=http_client),
+                self.async_max_in_flight, *limits
+            ))
+
+    async def _process_stories(self, clients, stories):
+        """
+        Processa histórias concorrentemente, com no máximo `clients.max_in_flight`
+        em andamento. As histórias são consumidas do iterável assíncrono sob demanda
+        em lotes de `db_batch_size`, gravados no banco com um único commit por lote.
+        Se a mesma chave aparecer novamente, ela só é regravada após o término da
+        anterior, preservando a ordem das escritas no banco. Com prompts em lote,
+        o grupo de histórias geradas juntas é tratado como uma unidade.
+        Returns:
+            PipelineStats: Métricas por etapa do lote processado.
+        """
+        stats = PipelineStats()
 
-            # Atualiza o timestamp da última verificação para o momento atual
-            self.last_checked_time = datetime.now()
-            self.db_manager.log_sync_time()  # Registra o horário da sincronização
+        async def run(unit):
+            if len(unit) > 1:
+                results = await self._process_group(clients, unit, stats)
+            else:
+                (story, prepared), = unit
+                with stats.stage("stories"):
+                    results = [await self.process_user_story(clients, story, stats, prepared)]
+            for (story, _), succeeded in zip(unit, results):
+                if not succeeded:
+                    stats.record("failed", 0.0)
+                logger.debug("História %s finalizada (sucesso: %s)", story.get('key', story), succeeded)
 
-            if not stories:
-                print("Nenhuma nova história encontrada.")
-                return
+        in_flight = {}
 
-            print(f"[DEBUG] {len(stories)} histórias encontradas para processar.")
-            print(f"Encontradas {len(stories)} novas histórias.")
+        async def submit(batch):
+            nonlocal in_flight
+            # Mesma chave repetida: aguarda a anterior para manter a ordem das escritas
+            for story in batch:
+                previous = in_flight.pop(story["key"], None)
+                if previous is not None:
+                    await previous
+            prepared = await asyncio.to_thread(self._prepare_batch, batch, stats)
+            for unit in await asyncio.to_thread(self._generation_units, clients, prepared):
+                while len(set(in_flight.values())) >= clients.max_in_flight:
+                    await asyncio.wait(set(in_flight.values()), return_when=asyncio.FIRST_COMPLETED)
+                    in_flight = {key: task for key, task in in_flight.items() if not task.done()}
+                task = asyncio.create_task(run(unit))
+                for story, _ in unit:
+                    in_flight[story["key"]] = task
 
-            # Processa cada história encontrada
-            for story in stories:
-                print(f"[DEBUG] Processando história: {story.get('key', story)}")
-                self.process_user_story(story)
+        batch = []
+        async for story in stories:
+            batch.append(story)
+            if len(batch) >= self.db_batch_size:
+                await submit(batch)
+                batch = []
+        if batch:
+            await submit(batch)
+        if in_flight:
+            await asyncio.gather(*set(in_flight.values()))
+        stats.finish()
 
-        except Exception as e:
-            print(f"[ERRO] Falha ao verificar novas histórias: {e}")
-            traceback.print_exc()
+        self._report_cycle(stats, clients.openai)
+        return stats
+
+    def _report_cycle(self, stats, openai_client):
+        self.last_cycle_stats = stats
+        CYCLE_SECONDS.observe(stats.wall_seconds)
+        CYCLE_STORIES.set(stats.summary().get("stories", {}).get("items", 0))
+        logger.info("Relatório do ciclo:\n%s", stats.format_report())
+        cache_stats = openai_client.cache_stats()
+        logger.info(
+            "Cache de gerações: %s acertos, %s falhas (taxa de acerto %.0f%%)",
+            cache_stats['hits'], cache_stats['misses'], cache_stats['hit_rate'] * 100,
+        )
 
     def start_monitoring(self):
         """
         Inicia o monitoramento periódico de novas histórias.
         """
-        print(f"Iniciando monitoramento a cada {self.check_interval} minutos...")
+        logger.info("Iniciando monitoramento a cada %s minutos...", self.check_interval)
+        self.heartbeat = Heartbeat(self.db_manager, "agent").start()
+        try:
+            if self.workers:
+                return self._run_workers(drain=False)
+            self._monitor()
+        finally:
+            self.heartbeat.stop()
+            self.heartbeat = None
+
+    def _monitor(self):
+        """Ciclos periódicos neste processo (sem processos da fila)."""
+        stop_event = threading.Event()
+        cycle = self.run_cycle
+        if self.webhooks_enabled:
+            # Histórias recebidas por webhook são consumidas da fila por uma thread.
+            # A reconciliação periódica também passa pela fila (apenas enfileira a
+            # busca): um ciclo direto geraria em paralelo com a thread a mesma história
+            threading.Thread(
+                target=JobWorker(self).run, args=(stop_event,), daemon=True, name="webhook-jobs"
+            ).start()
+            cycle = self.enqueue_fetch
 
         # Executa imediatamente na primeira vez
-        self.check_for_new_stories()
+        cycle()
 
         # Agenda execuções periódicas
-        schedule.every(self.check_interval).minutes.do(self.check_for_new_stories)
+        schedule.every(self.check_interval).minutes.do(cycle)
 
         # Loop principal para executar as tarefas agendadas
         try:
@@ -191,39 +784,232 @@ class QAAgent:
                 schedule.run_pending()
                 time.sleep(1)
         except KeyboardInterrupt:
-            print("Monitoramento interrompido pelo usuário.")
+            logger.info("Monitoramento interrompido pelo usuário.")
+        finally:
+            stop_event.set()
 
     def run_once(self):
         """
         Executa uma única verificação de novas histórias.
         """
-        self.check_for_new_stories()
-        print("Verificação única concluída.")
+        if self.workers:
+            self._run_workers(drain=True)
+        else:
+            self.run_cycle()
+        logger.info("Verificação única concluída.")
 
-    def format_test_cases_to_markdown(self, test_cases_text):
+    def enqueue_fetch(self):
+        """Enfileira a busca de histórias no Jira (no máximo uma ativa por projeto)."""
+        payload = {"project_key": self.project_key, "status": self.status}
+        if self.db_manager.enqueue_job(JOB_FETCH, payload, dedupe_key=f"fetch:{self.project_key}"):
+            logger.info("Busca de novas histórias em %s enfileirada.", self.project_key)
+        self.db_manager.purge_finished_jobs(self.finished_jobs_ttl)
+        self.db_manager.purge_webhook_deliveries(self.finished_jobs_ttl)
+
+    def _run_workers(self, drain):
         """
-        Formata o texto dos casos de teste para Markdown, destacando títulos e cenários.
-        Args:
-            test_cases_text (str): O texto dos casos de teste gerados.
-        Returns:
-            str: O texto formatado em Markdown.
-        """
-        lines = test_cases_text.splitlines()
-        formatted_lines = []
-        for line in lines:
-            if line.startswith("Título:"):
-                formatted_lines.append(f"h2. {line.replace('Título:', '').strip()}\n")
-            elif line.startswith("Cenário:"):
-                formatted_lines.append(f"h3. {line.strip()}\n")
-            elif line.strip().startswith("Dado que") or \
-                 line.strip().startswith("Quando") or \
-                 line.strip().startswith("Então") or \
-                 line.strip().startswith("E") or \
-                 line.strip().startswith("Mas"):
-                formatted_lines.append(f"* {line.strip()}\n")
-            elif line.strip(): # Adiciona linhas não vazias que não são títulos ou cenários
-                formatted_lines.append(f"{{code}}{line.strip()}{{code}}\n")
-        return "".join(formatted_lines)
+        Inicia `workers` processos que consomem a fila. Este processo enfileira a
+        busca no Jira a cada `check_interval` minutos (ou uma única vez com
+        `drain`, aguardando a fila esvaziar).
+        """
+        self.enqueue_fetch()
+        processes, stop_event = start_worker_processes(
+            self.workers, drain=drain, agent_options={"force_regenerate": self.force_regenerate, "workers": 0}
+        )
+        logger.info("%s processos consumindo a fila de trabalhos.", len(processes))
+        self._progress(STATUS_IDLE, f"{len(processes)} processos da fila")
+        try:
+            if drain:
+                for process in processes:
+                    process.join()
+            else:
+                schedule.every(self.check_interval).minutes.do(self.enqueue_fetch)
+                while True:
+                    schedule.run_pending()
+                    time.sleep(1)
+        except KeyboardInterrupt:
+            logger.info("Monitoramento interrompido pelo usuário.")
+        finally:
+            # Os processos terminam o trabalho em andamento antes de sair
+            stop_event.set()
+            for process in processes:
+                process.join()
+        logger.info("Fila de trabalhos: %s", self.db_manager.get_job_counts())
+
+    def handle_fetch_job(self, payload):
+        """
+        Trabalho "fetch": busca as histórias atualizadas no Jira, grava-as em lote
+        e enfileira a geração das que ainda não têm casos de teste. A marca d'água
+        avança assim que as histórias estão na fila, que é durável.
+        """
+        cycle_started = datetime.now()
+        project_key = payload.get("project_key", self.project_key)
+        status = payload.get("status", self.status)
+        updated_since = self._updated_since(cycle_started, project_key, status)
+        stats = PipelineStats()
+        enqueued = 0
+        stories = self.jira_client.iter_user_stories(
+            project_key=project_key,
+            status=status,
+            updated_since=updated_since
+        )
+        for batch in chunked(stories, self.db_batch_size):
+            enqueued += self._enqueue_generation(self._prepare_batch(batch, stats))
+        failed = stats.summary().get("failed", {}).get("items", 0)
+        self.db_manager.log_sync_time(project_key=project_key, watermark=cycle_started if not failed else None)
+        logger.info("%s histórias enfileiradas para geração (%s inválidas).", enqueued, failed)
+
+    def handle_story_job(self, payload):
+        """
+        Trabalho "story": história recebida pelo webhook do Jira. É gravada e, se
+        ainda não tiver casos de teste para o conteúdo atual, tem a geração enfileirada.
+        """
+        if not self._enqueue_generation(self._prepare_batch([payload], PipelineStats())):
+            logger.info("História %s sem alterações desde a última geração.", payload['key'])
+
+    def _enqueue_generation(self, prepared):
+        """
+        Enfileira a geração das histórias preparadas por `_prepare_batch` que ainda
+        não têm casos de teste atuais (no máximo uma geração ativa por história).
+        Returns:
+            int: Trabalhos enfileirados.
+        """
+        return self.db_manager.enqueue_jobs(
+            (JOB_GENERATE, {"story_id": story_id, "jira_key": fields["jira_key"]}, f"generate:{fields['jira_key']}")
+            for _, (fields, story_id, has_test_cases) in prepared
+            if not has_test_cases or self.force_regenerate
+        )
+
+    def handle_generate_job(self, payload):
+        """
+        Trabalho "generate": gera e grava os casos de teste da história e enfileira
+        a criação das subtarefas, na mesma transação. Uma nova tentativa após a
+        gravação encontra os casos de teste e não gera novamente.
+        """
+        story = self.db_manager.get_user_story(payload["story_id"])
+        if story is None:
+            logger.info("História %s não existe mais no banco; geração descartada.", payload['jira_key'])
+            return
+        if not self.force_regenerate and self.db_manager.get_story_ids_with_test_cases([story["id"]]):
+            logger.info("Já existem casos de teste para a história %s. Pulando geração.", story['jira_key'])
+            return
+        raw_test_cases = self._reused_test_cases(story, story["id"], PipelineStats())
+        usage = None
+        if raw_test_cases is None:
+            usage = TokenUsage()
+            raw_test_cases = self.openai_client.generate_test_cases(
+                self._build_story_text(story), force_refresh=self.force_regenerate, usage=usage
+            )
+        cenarios = parse_scenarios(raw_test_cases) if raw_test_cases else []
+        if not cenarios:
+            raise RuntimeError(f"Não foi possível gerar casos de teste para {story['jira_key']}")
+        with self.db_manager.transaction():
+            test_case_id = self.db_manager.save_test_cases(
+                story["id"], render_markdown(cenarios), cenarios, story_content_hash=story["content_hash"],
+                usage=usage
+            )
+            self.db_manager.enqueue_job(
+                JOB_PUBLISH,
+                {"story_id": story["id"], "jira_key": story["jira_key"], "test_case_id": test_case_id},
+                dedupe_key=f"publish:{test_case_id}",
+            )
+
+    def handle_publish_job(self, payload):
+        """
+        Trabalho "publish": cria no Jira as subtarefas dos cenários gravados. Se
+        alguma falhar o trabalho é repetido, e a nova tentativa cria apenas as que
+        faltaram (ver `_publish_subtasks`).
+        """
+        jira_key = payload["jira_key"]
+        cenarios = self.db_manager.get_scenarios_for_story(payload["story_id"]).get(payload["test_case_id"])
+        if not cenarios:
+            logger.info("Caso de teste %s sem cenários; nada a publicar para %s.",
+                        payload['test_case_id'], jira_key)
+            return
+        stats = PipelineStats()
+        subtarefas = self._build_subtasks(cenarios)
+        criadas = self._run_pipeline(
+            lambda clients: self._publish_subtasks(clients, jira_key, subtarefas, stats)
+        )
+        if not self._record_subtask_failures(jira_key, criadas, stats):
+            raise RuntimeError(f"Subtarefas não publicadas para {jira_key}")
+
+    def export_batch_file(self, path, limit=None):
+        """
+        Grava no arquivo de entrada da Batch API da OpenAI as histórias do banco que
+        ainda não têm casos de teste, para uma geração sem urgência (backfill).
+        Returns:
+            int: Quantidade de histórias exportadas.
+        """
+        stories = self.db_manager.get_stories_without_test_cases(limit)
+        total = self.openai_client.write_batch_file(
+            {story["jira_key"]: self._build_story_text(story) for story in stories}, path
+        )
+        logger.info("%s histórias exportadas para %s.", total, path)
+        return total
+
+    def import_batch_results(self, path):
+        """
+        Importa o arquivo de saída de um lote da Batch API: salva os casos de teste
+        de cada história e cria as subtarefas no Jira, como no processamento normal.
+        Returns:
+            PipelineStats: Métricas da importação.
+        """
+        stats = PipelineStats()
+        results = self.openai_client.read_batch_results(path)
+        stories = self.db_manager.get_user_stories_by_keys(results)
+        with_test_cases = self.db_manager.get_story_ids_with_test_cases(
+            [story["id"] for story in stories.values()]
+        )
+
+        async def importar(clients):
+            for jira_key, raw_test_cases in results.items():
+                story = stories.get(jira_key)
+                if story is None:
+                    logger.error("História %s do lote não encontrada no banco.", jira_key)
+                    stats.record("failed", 0.0)
+                    continue
+                if not raw_test_cases:
+                    self._generation_failed(jira_key, stats)
+                    continue
+                fields = {name: story[name] for name in ("jira_key", "title", "description", "status", "content_hash")}
+                prepared = (fields, story["id"], story["id"] in with_test_cases)
+                with stats.stage("stories"):
+                    succeeded = await self.process_user_story(clients, {"key": jira_key}, stats, prepared,
+                                                              raw_test_cases)
+                if not succeeded:
+                    stats.record("failed", 0.0)
+
+        self._run_pipeline(importar)
+        stats.finish()
+        logger.info("Relatório do ciclo:\n%s", stats.format_report())
+        return stats
+
+
+class _PipelineClients:
+    """
+    Clientes do Jira e da OpenAI de uma execução do pipeline e seus limites de
+    concorrência, como semáforos do event loop da execução.
+    """
+
+    def __init__(self, jira, openai, max_in_flight, openai_concurrency, jira_write_concurrency):
+        self.jira = jira
+        self.openai = openai
+        self.max_in_flight = max_in_flight
+        self.openai_slots = asyncio.Semaphore(openai_concurrency)
+        self.jira_write_slots = asyncio.Semaphore(jira_write_concurrency)
+
+
+def _issue_key(issue):
+    """Chave da issue criada (objeto do JiraClient ou dict do AsyncJiraClient)."""
+    if issue is None:
+        return None
+    return issue["key"] if isinstance(issue, dict) else issue.key
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
 
 def main():
     """
@@ -232,13 +1018,41 @@ def main():
     # Configura o parser de argumentos para permitir execução única ou contínua
     parser = argparse.ArgumentParser(description='QA Agent - Gerador automático de casos de teste')
     parser.add_argument('--once', action='store_true', help='Executa uma única verificação e encerra')
+    parser.add_argument('--force-regenerate', action='store_true',
+                        help='Ignora casos de teste existentes e o cache de gerações')
+    parser.add_argument('--async', dest='use_async', action='store_true', default=None,
+                        help='Processa as histórias com clientes assíncronos em um único event loop')
+    parser.add_argument('--stream', dest='streaming', action='store_true', default=None,
+                        help='Gera os casos de teste em streaming, publicando cada cenário assim que concluído')
+    parser.add_argument('--batch-prompts', dest='batch_prompts', action='store_true', default=None,
+                        help='Gera os casos de teste de várias histórias pequenas em uma única chamada')
+    parser.add_argument('--reuse-similar', dest='reuse_similar', action='store_true', default=None,
+                        help='Reutiliza os casos de teste de histórias quase idênticas em vez de gerar')
+    parser.add_argument('--workers', type=int, default=None, metavar='N',
+                        help='Processos que consomem a fila de trabalhos do banco (0 = processamento direto)')
+    parser.add_argument('--batch-export', metavar='ARQUIVO',
+                        help='Exporta as histórias sem casos de teste para a Batch API da OpenAI e encerra')
+    parser.add_argument('--batch-import', metavar='ARQUIVO',
+                        help='Importa o resultado de um lote da Batch API da OpenAI e encerra')
     args = parser.parse_args()
 
+    configure_logging()
+    # SIGTERM (supervisor, systemd) encerra como Ctrl+C: o trabalho em andamento termina
+    signal.signal(signal.SIGTERM, _interrupt)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
     # Inicializa o agente de QA
-    agent = QAAgent()
+    agent = QAAgent(force_regenerate=args.force_regenerate, use_async=args.use_async,
+                    streaming=args.streaming, batch_prompts=args.batch_prompts, workers=args.workers,
+                    reuse_similar=args.reuse_similar)
 
     # Decide entre execução única ou monitoramento contínuo
-    if args.once:
+    if args.batch_export:
+        agent.export_batch_file(args.batch_export)
+    elif args.batch_import:
+        agent.import_batch_results(args.batch_import)
+    elif args.once:
         agent.run_once()
     else:
         agent.start_monitoring()
@@ -0,0 +1,398 @@
+"""
+Métricas do agente no formato de exposição do Prometheus (contadores, gauges e
+histogramas com rótulos) e um perfilador cProfile por amostragem que pode ser
+ligado em tempo de execução. Cada processo mantém as próprias métricas: a
+aplicação web as expõe em /metrics e o agente, com METRICS_PORT, em um servidor
+HTTP próprio.
+"""
+import cProfile
+import functools
+import hmac
+import io
+import logging
+import math
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Limites (em segundos) dos histogramas de latência
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """Base das métricas: um valor por combinação de rótulos, seguro entre threads."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: rótulos esperados {self.labelnames}, recebidos {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels_text(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{self._labels_text(key)} {_format_value(value)}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    """Valor instantâneo; com `set_function` é calculado a cada coleta (ex: tamanho da fila)."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """
+        Args:
+            function (callable): Sem rótulos, retorna o valor; com rótulos, um dict
+                {tupla de valores dos rótulos: valor}.
+        """
+        self._function = function
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+        try:
+            values = self._function()
+        except Exception as e:
+            logger.error("Erro ao coletar a métrica %s: %s", self.name, e)
+            return []
+        if not self.labelnames:
+            return [((), values)]
+        return sorted((tuple(str(part) for part in key), value) for key, value in values.items())
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["sum"] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Mede a duração do bloco."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state["counts"]) if state else 0
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            states = sorted((key, (list(state["counts"]), state["sum"])) for key, state in self._values.items())
+        for key, (counts, total) in states:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = self._labels_text(key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels_text(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels_text(key)} {cumulative}")
+        return lines
+
+
+def timed(histogram, label="operation"):
+    """Decorador que mede cada chamada no histograma, rotulada pelo nome da função."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**{label: function.__name__}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica {metric.name} já registrada")
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Chamadas ao Jira e à OpenAI (cada tentativa feita pelo RateLimiter)
+EXTERNAL_REQUEST_SECONDS = Histogram(
+    "qa_agent_external_request_seconds", "Latência das chamadas ao Jira e à OpenAI.", ("service", "endpoint"))
+EXTERNAL_REQUESTS = Counter(
+    "qa_agent_external_requests_total", "Chamadas ao Jira e à OpenAI por resultado.",
+    ("service", "endpoint", "outcome"))
+OPENAI_TOKENS = Counter("qa_agent_openai_tokens_total", "Tokens consumidos na OpenAI.", ("kind",))
+CACHE_REQUESTS = Counter("qa_agent_cache_requests_total", "Consultas aos caches por resultado.", ("cache", "result"))
+DB_QUERY_SECONDS = Histogram("qa_agent_db_query_seconds", "Duração das operações no SQLite.", ("operation",))
+WEB_REQUEST_SECONDS = Histogram(
+    "qa_agent_web_request_seconds", "Latência das rotas da aplicação web.", ("method", "route", "status"))
+# Etapas do PipelineStats (db, openai, jira, stories, failed, unchanged...)
+PIPELINE_ITEMS = Counter("qa_agent_pipeline_items_total", "Itens processados por etapa do ciclo.", ("stage",))
+PIPELINE_STAGE_SECONDS = Histogram(
+    "qa_agent_pipeline_stage_seconds", "Duração de cada execução das etapas do ciclo.", ("stage",))
+CYCLE_SECONDS = Histogram("qa_agent_cycle_seconds", "Duração dos ciclos de verificação.")
+CYCLE_STORIES = Gauge("qa_agent_last_cycle_stories", "Histórias processadas no último ciclo.")
+JOBS = Gauge("qa_agent_jobs", "Trabalhos na fila por status.", ("status",))
+JOB_SECONDS = Histogram("qa_agent_job_seconds", "Duração dos trabalhos da fila.", ("kind", "outcome"))
+
+
+class SampledProfiler:
+    """
+    Perfil cProfile de uma fração `rate` das execuções marcadas com `sample()`
+    (histórias, trabalhos da fila, requisições web), acumulado para consulta em
+    `report()`. Apenas uma execução é perfilada por vez; as demais seguem sem
+    perfil. `rate` = 0 desliga sem custo além de uma comparação.
+    """
+
+    def __init__(self, rate=0.0):
+        self.rate = 0.0
+        self.set_rate(rate)
+        self.samples = 0
+        self._stats = None
+        self._stats_lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def set_rate(self, rate):
+        self.rate = min(max(float(rate), 0.0), 1.0)
+
+    def start(self):
+        """
+        Returns:
+            cProfile.Profile: Perfil iniciado, ou None se esta execução não foi sorteada.
+        """
+        if self.rate <= 0 or random.random() >= self.rate or not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Outro perfilador já ativo no interpretador
+            self._active.release()
+            return None
+        return profile
+
+    def stop(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        self._active.release()
+        with self._stats_lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.samples += 1
+
+    @contextmanager
+    def sample(self):
+        profile = self.start()
+        try:
+            yield
+        finally:
+            self.stop(profile)
+
+    def profiled(self, function):
+        """Decorador que amostra as chamadas de `function`."""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.sample():
+                return function(*args, **kwargs)
+        return wrapper
+
+    def report(self, limit=40, sort="cumulative"):
+        """Texto com as funções mais custosas nas execuções amostradas."""
+        with self._stats_lock:
+            if self._stats is None:
+                return f"Nenhuma execução amostrada (taxa {self.rate:g}).\n"
+            output = io.StringIO()
+            self._stats.stream = output
+            output.write(f"{self.samples} execuções amostradas (taxa {self.rate:g}).\n")
+            self._stats.sort_stats(sort).print_stats(limit)
+            return output.getvalue()
+
+    def reset(self):
+        with self._stats_lock:
+            self._stats = None
+            self.samples = 0
+
+
+# Fração de execuções perfiladas; alterável em tempo de execução por POST /debug/profile?rate=
+PROFILER = SampledProfiler(float(os.getenv("PROFILE_SAMPLE_RATE", "0")))
+
+# Porta do servidor de métricas do agente (0 = desativado); os processos da
+# fila usam as portas seguintes, uma por processo
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Endereço do servidor de métricas do agente (por padrão, apenas a máquina local)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Token exigido (cabeçalho X-Profile-Token) para alterar o perfilador; vazio desativa o POST
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+
+
+def handle_profile_request(method, params, token=None):
+    """
+    Consulta (GET) ou altera (POST, parâmetros `rate` e `reset`) o perfilador.
+    O POST exige `token` igual a PROFILE_ADMIN_TOKEN.
+    Returns:
+        tuple: (status HTTP, texto da resposta).
+    """
+    if method == "POST":
+        if not PROFILE_ADMIN_TOKEN:
+            return 403, "Alteração do perfilador desativada (defina PROFILE_ADMIN_TOKEN).\n"
+        if not hmac.compare_digest((token or "").encode(), PROFILE_ADMIN_TOKEN.encode()):
+            return 401, "Token inválido.\n"
+        try:
+            if "rate" in params:
+                PROFILER.set_rate(params["rate"])
+        except ValueError:
+            return 400, "Parâmetro rate inválido.\n"
+        if params.get("reset") == "1":
+            PROFILER.reset()
+        return 200, f"Taxa de amostragem: {PROFILER.rate:g}\n"
+    return 200, PROFILER.report()
+
+
+def start_metrics_server(port, host=None):
+    """
+    Expõe /metrics e /debug/profile em um servidor HTTP em segundo plano (processos
+    do agente, que não rodam a aplicação web).
+    Returns:
+        ThreadingHTTPServer: Servidor iniciado.
+    """
+    host = host or METRICS_HOST
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body, content_type="text/plain; charset=utf-8"):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _dispatch(self, method):
+            parsed = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            if parsed.path == "/metrics" and method == "GET":
+                self._reply(200, REGISTRY.render(), CONTENT_TYPE)
+            elif parsed.path == "/debug/profile":
+                self._reply(*handle_profile_request(method, params, self.headers.get("X-Profile-Token")))
+            else:
+                self._reply(404, "Não encontrado.\n")
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    logger.info("Métricas disponíveis em http://%s:%s/metrics", host, server.server_address[1])
+    return server
@@ -1,49 +1,770 @@
 import os
-from openai import OpenAI
+import asyncio
+import json
+import hashlib
+import logging
+import threading
+from metrics import CACHE_REQUESTS, OPENAI_TOKENS
+from rate_limiter import get_limiter
+from scenarios import TEST_CASES_SCHEMA, parse_scenarios, render_markdown
+from token_budget import (
+    PROMPT_MAX_TOKENS, TokenUsage, clean_story_text, completion_budget, count_tokens, split_story,
+)
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+PROMPT_TEMPLATE = """
+Você é um especialista em QA. Dada a seguinte história de usuário, gere casos de teste detalhados.
+Inclua cenários de sucesso, cenários de falha e casos de borda, se aplicável.
+Para cada cenário informe o título, as pré-condições, os passos e o resultado esperado,
+em texto simples, sem Markdown.
+História do usuário:
+{user_story_description}
+    """
+
+# Prompt de uma parte de uma história longa, dividida para caber no orçamento de
+# tokens; os cenários das partes são reunidos por merge_generations
+PART_PROMPT_TEMPLATE = """
+Você é um especialista em QA. A história de usuário abaixo é longa e foi dividida em partes;
+esta é a parte {part} de {total}. Gere casos de teste detalhados apenas para o que esta parte descreve.
+Inclua cenários de sucesso, cenários de falha e casos de borda, se aplicável.
+Para cada cenário informe o título, as pré-condições, os passos e o resultado esperado,
+em texto simples, sem Markdown.
+História do usuário (parte {part} de {total}):
+{user_story_description}
+    """
+
+# Prompt com várias histórias em uma única chamada; a resposta é um objeto JSON
+# com os casos de teste de cada história, identificada pela chave do Jira
+BATCH_PROMPT_TEMPLATE = """
+Você é um especialista em QA. Para cada história de usuário abaixo, gere casos de teste detalhados.
+Inclua cenários de sucesso, cenários de falha e casos de borda, se aplicável.
+Para cada cenário informe o título, as pré-condições, os passos e o resultado esperado,
+em texto simples, sem Markdown. Responda com exatamente um item em "stories" para cada
+história, usando as chaves informadas em "jira_key".
+Histórias de usuário:
+{stories}
+"""
+
+# Formatos de resposta (structured outputs): os cenários de uma história e, no
+# prompt em lote, os cenários de cada história identificada pela chave do Jira
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "test_cases", "strict": True, "schema": TEST_CASES_SCHEMA},
+}
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "test_cases_batch",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "stories": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "jira_key": {"type": "string"},
+                            "scenarios": TEST_CASES_SCHEMA["properties"]["scenarios"],
+                        },
+                        "required": ["jira_key", "scenarios"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["stories"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Endpoint usado nas linhas do arquivo de entrada da Batch API
+BATCH_API_URL = "/v1/chat/completions"
+
+
+def parse_batch_response(content, keys):
+    """
+    Separa por história a resposta JSON de um prompt em lote.
+    Args:
+        content (str): Texto retornado pelo modelo.
+        keys (iterable): Chaves do Jira enviadas no lote.
+    Returns:
+        dict: Casos de teste por chave, no mesmo JSON de uma geração individual
+        ({"scenarios": [...]}). Chaves ausentes, desconhecidas ou sem cenários
+        ficam de fora (e são geradas individualmente pelo chamador); JSON inválido
+        resulta em um dicionário vazio.
+    """
+    try:
+        data = json.loads(content or "")
+    except json.JSONDecodeError:
+        return {}
+    items = data.get("stories") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return {}
+    keys = set(keys)
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        key, scenarios = item.get("jira_key"), item.get("scenarios")
+        if key in keys and isinstance(scenarios, list) and scenarios:
+            results[key] = json.dumps({"scenarios": scenarios}, ensure_ascii=False)
+    return results
+
+
+def merge_generations(contents):
+    """
+    Reúne as gerações das partes de uma história longa em um único JSON
+    ({"scenarios": [...]}), descartando cenários com título repetido.
+    """
+    scenarios, titles = [], set()
+    for content in contents:
+        for scenario in parse_scenarios(content):
+            title = " ".join(scenario.title.casefold().split())
+            if title and title in titles:
+                continue
+            titles.add(title)
+            scenarios.append(scenario.to_dict())
+    return json.dumps({"scenarios": scenarios}, ensure_ascii=False)
+
+
 class OpenAIClient:
-    def __init__(self):
+    def __init__(self, cache=None):
+        """
+        Args:
+            cache (DBManager, opcional): Armazenamento persistente das gerações já
+                realizadas. Sem ele toda chamada vai à API.
+        """
         self.openai_api_key = os.getenv('OPENAI_API_KEY')
+        self.model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+        self.temperature = float(os.getenv('OPENAI_TEMPERATURE', '0.7'))
+        # Teto do max_tokens calculado para cada história (ver token_budget.completion_budget)
+        self.max_tokens = int(os.getenv('OPENAI_MAX_TOKENS', '4000'))
+        # Tokens da história por chamada; histórias maiores são divididas em partes
+        self.prompt_max_tokens = PROMPT_MAX_TOKENS
+        # Prompts em lote: tokens por chamada (entrada + max_tokens de saída de
+        # cada história) e máximo de histórias por chamada
+        self.batch_token_budget = int(os.getenv('OPENAI_BATCH_TOKEN_BUDGET', '6000'))
+        self.batch_max_stories = int(os.getenv('OPENAI_BATCH_MAX_STORIES', '10'))
+
+        self.cache = cache
+        self.cache_ttl_seconds = float(os.getenv('OPENAI_CACHE_TTL_HOURS', '720')) * 3600
+        self.cache_max_entries = int(os.getenv('OPENAI_CACHE_MAX_ENTRIES', '5000'))
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache_writes = 0
+        self._cache_lock = threading.Lock()
+        self.limiter = get_limiter("openai")
         
         try:
-            self.client = OpenAI(api_key=self.openai_api_key)
-            print("Conexão com OpenAI estabelecida com sucesso.")
+            self.client = self._create_client()
+            logger.info("Conexão com OpenAI estabelecida com sucesso.")
         except Exception as e:
-            print(f"Erro ao conectar com OpenAI: {e}")
+            logger.error("Erro ao conectar com OpenAI: %s", e)
             raise
 
-    def generate_test_cases(self, user_story_description: str) -> str: 
-        
-        prompt = f"""
-Você é um especialista em QA. Dada a seguinte história de usuário, gere casos de teste detalhados.
-Inclua cenários de sucesso, cenários de falha e casos de borda, se aplicável.
-Formate a saída de forma clara e estruturada, por exemplo, usando Markdown.
-História do usuário:
-{user_story_description} 
-casos de teste:
-    """
+    def _create_client(self):
+        # O pacote openai leva centenas de milissegundos para importar; só quem
+        # gera casos de teste paga esse custo
+        from openai import DefaultHttpxClient, OpenAI
+
+        # Novas tentativas ficam a cargo do RateLimiter compartilhado, que também
+        # recebe os cabeçalhos de cota de cada resposta
+        return OpenAI(
+            api_key=self.openai_api_key,
+            max_retries=0,
+            http_client=DefaultHttpxClient(event_hooks={"response": [self.limiter.observe]}),
+        )
+
+    def cache_key(self, user_story_description: str, prompt_template: str = PROMPT_TEMPLATE) -> str:
+        """
+        Chave de cache: hash do texto normalizado da história (sem marcação wiki e
+        com espaços colapsados), do modelo, da temperatura, do template do prompt
+        usado na geração (PROMPT_TEMPLATE ou BATCH_PROMPT_TEMPLATE), do template das
+        partes de histórias longas e do esquema da resposta. Alterar qualquer um
+        deles invalida as gerações anteriores.
+        """
+        normalized = " ".join(clean_story_text(user_story_description).split())
+        payload = json.dumps(
+            [normalized, self.model, self.temperature, prompt_template, PART_PROMPT_TEMPLATE,
+             TEST_CASES_SCHEMA],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cache_stats(self):
+        """
+        Returns:
+            dict: Acertos, falhas e taxa de acerto do cache desde a criação do cliente.
+        """
+        with self._cache_lock:
+            hits, misses = self.cache_hits, self.cache_misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+    def generate_test_cases(self, user_story_description: str, force_refresh: bool = False,
+                            usage=None) -> str:
+        """
+        Gera casos de teste para a história, reutilizando uma geração anterior
+        idêntica quando disponível no cache. Uma história acima de
+        `prompt_max_tokens` é gerada em partes, reunidas por merge_generations.
+        Args:
+            user_story_description (str): Texto da história de usuário.
+            force_refresh (bool): Ignora o cache e força uma nova geração.
+            usage (TokenUsage, opcional): Recebe os tokens gastos nas chamadas.
+        Returns:
+            str: Casos de teste gerados (JSON no formato de scenarios.TEST_CASES_SCHEMA,
+            interpretado com scenarios.parse_scenarios), ou None se a geração falhar
+            após as novas tentativas do RateLimiter.
+        """
+        key, cached = self._lookup_cache(user_story_description, force_refresh)
+        if cached is not None:
+            return cached
+        return self._generate(user_story_description, key, usage)
+
+    def _generate(self, user_story_description, key, usage=None):
+        parts = self._story_parts(user_story_description)
+        contents = []
+        for number, part in enumerate(parts, 1):
+            content = self._generate_part(part, number, len(parts), usage)
+            if not content:
+                return None
+            contents.append(content)
+        return self._finish_generation(key, contents)
+
+    def _generate_part(self, story_text, part, total, usage):
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt,
+            chat_completion = self.limiter.call(
+                "chat.completions",
+                self.client.chat.completions.create,
+                **self._completion_kwargs(story_text, part, total)
+            )
+            _record_usage(chat_completion, usage)
+            if usage is not None:
+                usage.calls += 1
+            _warn_if_truncated(chat_completion)
+            logger.debug("Casos de teste gerados com sucesso.")
+            return chat_completion.choices[0].message.content
+
+        except Exception as e:
+            # Não devolve a mensagem de erro como se fosse conteúdo: o chamador
+            # decide se tenta novamente no próximo ciclo
+            logger.error("Erro ao gerar casos de teste com OpenAI: %s", e)
+            return None
+
+    def _story_parts(self, user_story_description):
+        """
+        Returns:
+            list: Texto limpo da história, dividido em partes de até
+            `prompt_max_tokens` tokens (uma só parte na maioria dos casos).
+        """
+        parts = split_story(clean_story_text(user_story_description), self.prompt_max_tokens, self.model)
+        if len(parts) > 1:
+            logger.info("História longa dividida em %s partes de até %s tokens.",
+                        len(parts), self.prompt_max_tokens)
+        return parts
+
+    def _finish_generation(self, key, contents):
+        test_cases = contents[0] if len(contents) == 1 else merge_generations(contents)
+        if key is not None and test_cases:
+            self._store_in_cache(key, test_cases)
+        return test_cases
+
+    def plan_batches(self, stories):
+        """
+        Agrupa histórias em lotes que cabem no orçamento de tokens de uma chamada.
+        Args:
+            stories (list): Pares (chave do Jira, texto da história), na ordem de envio.
+        Returns:
+            list: Listas de chaves; uma história que sozinha excede o orçamento, ou
+            que precisa ser dividida em partes, forma um lote próprio (gerada com o
+            prompt individual).
+        """
+        overhead = count_tokens(BATCH_PROMPT_TEMPLATE, self.model)
+        batches, current, used = [], [], overhead
+        for key, text in stories:
+            tokens = count_tokens(clean_story_text(text), self.model)
+            if tokens > self.prompt_max_tokens:
+                batches.append([key])
+                continue
+            cost = tokens + completion_budget(tokens, self.max_tokens)
+            if current and (used + cost > self.batch_token_budget or len(current) >= self.batch_max_stories):
+                batches.append(current)
+                current, used = [], overhead
+            current.append(key)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def generate_test_cases_batch(self, stories, force_refresh: bool = False, usages=None):
+        """
+        Gera os casos de teste de várias histórias com uma única chamada (resposta
+        em JSON), evitando repetir as instruções do prompt e a latência de uma
+        requisição por história. Histórias já geradas (no cache do prompt em lote
+        ou do individual) não são enviadas; as que faltarem na resposta, ou todas
+        se ela for inválida, são geradas com o prompt individual.
+        Args:
+            stories (dict): Texto de cada história, pela chave do Jira.
+            force_refresh (bool): Ignora o cache e força uma nova geração.
+            usages (dict, opcional): Recebe o TokenUsage de cada história gerada, pela
+                chave do Jira; os tokens do prompt em lote são divididos entre elas.
+        Returns:
+            dict: Casos de teste por chave (None para as que falharam).
+        """
+        results, pending = self._batch_lookup(stories, force_refresh)
+        if len(pending) > 1:
+            batch_usage = TokenUsage()
+            try:
+                chat_completion = self.limiter.call(
+                    "chat.completions",
+                    self.client.chat.completions.create,
+                    **self._batch_completion_kwargs(pending)
+                )
+                _record_usage(chat_completion, batch_usage)
+                batch_usage.calls += 1
+                generated = parse_batch_response(chat_completion.choices[0].message.content, pending)
+            except Exception as e:
+                logger.error("Erro ao gerar casos de teste em lote com OpenAI: %s", e)
+                generated = {}
+            self._split_batch_usage(batch_usage, pending, usages)
+            self._collect_batch(generated, pending, results)
+        # O cache das que faltaram já foi consultado (e contado) em `_batch_lookup`
+        for jira_key, (_, text) in pending.items():
+            results[jira_key] = self._generate(text, self._single_cache_key(text), _story_usage(usages, jira_key))
+        return results
+
+    def _batch_lookup(self, stories, force_refresh):
+        """
+        Returns:
+            tuple: (resultados em cache por chave do Jira, {chave do Jira: (chave de
+            cache do prompt em lote, texto)} das histórias a gerar).
+        """
+        results, pending = {}, {}
+        for jira_key, text in stories.items():
+            key, cached = self._lookup_cache(text, force_refresh, BATCH_PROMPT_TEMPLATE, PROMPT_TEMPLATE)
+            if cached is not None:
+                results[jira_key] = cached
+            else:
+                pending[jira_key] = (key, text)
+        return results, pending
+
+    def _single_cache_key(self, text):
+        """Chave de cache do prompt individual, ou None sem cache configurado."""
+        return self.cache_key(text) if self.cache is not None else None
+
+    def _split_batch_usage(self, batch_usage, pending, usages):
+        # Cada história enviada no lote recebe uma parte dos tokens proporcional ao
+        # tamanho do seu texto, inclusive as que serão geradas individualmente depois
+        if usages is None:
+            return
+        weights = [count_tokens(clean_story_text(text), self.model) for _, text in pending.values()]
+        usages.update(zip(pending, batch_usage.split(weights)))
+
+    def _collect_batch(self, generated, pending, results):
+        # Move as histórias geradas no lote de `pending` para `results`
+        for jira_key, test_cases in generated.items():
+            key, _ = pending.pop(jira_key)
+            if key is not None:
+                self._store_in_cache(key, test_cases)
+            results[jira_key] = test_cases
+        logger.info("Casos de teste gerados em lote: %s histórias em uma chamada.", len(generated))
+        if pending:
+            logger.info("%s histórias do lote serão geradas individualmente.", len(pending))
+
+    def _batch_completion_kwargs(self, pending):
+        texts = {jira_key: clean_story_text(text) for jira_key, (_, text) in pending.items()}
+        stories = "\n\n".join(f"### {jira_key}\n{text}" for jira_key, text in texts.items())
+        max_tokens = sum(
+            completion_budget(count_tokens(text, self.model), self.max_tokens) for text in texts.values()
+        )
+        return {
+            "messages": [
+                {
+                    "role": "user",
+                    "content": BATCH_PROMPT_TEMPLATE.format(stories=stories),
+                }
+            ],
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": max_tokens,
+            "response_format": BATCH_RESPONSE_FORMAT,
+        }
+
+    def write_batch_file(self, stories, path):
+        """
+        Grava o arquivo de entrada da Batch API da OpenAI (JSONL, uma requisição
+        por história com o prompt individual), para gerações sem urgência que
+        podem esperar até 24h com custo reduzido. Uma história longa gera uma
+        requisição por parte, com custom_id "<id>#<parte>".
+        Args:
+            stories (dict): Texto de cada história, pelo identificador (custom_id).
+            path (str): Caminho do arquivo .jsonl.
+        Returns:
+            int: Quantidade de histórias gravadas.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            for custom_id, text in stories.items():
+                parts = self._story_parts(text)
+                for number, part in enumerate(parts, 1):
+                    line = {
+                        "custom_id": custom_id if len(parts) == 1 else f"{custom_id}#{number}",
+                        "method": "POST",
+                        "url": BATCH_API_URL,
+                        "body": self._completion_kwargs(part, number, len(parts)),
                     }
-                ],
-                model="gpt-4o-mini",  #
-                temperature=0.7,
-                max_tokens=1000,  # Ajuste conforme necessário
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return len(stories)
+
+    @staticmethod
+    def read_batch_results(path):
+        """
+        Lê o arquivo de saída de um lote concluído da Batch API.
+        Args:
+            path (str): Caminho do arquivo .jsonl baixado da OpenAI.
+        Returns:
+            dict: Casos de teste por custom_id (None para requisições com erro). As
+            partes de uma história longa são reunidas por merge_generations; basta
+            uma parte com erro para a história inteira ficar como None.
+        """
+        results, parts = {}, {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                content = None
+                if not item.get("error") and response.get("status_code") == 200:
+                    choices = (response.get("body") or {}).get("choices") or [{}]
+                    content = (choices[0].get("message") or {}).get("content")
+                custom_id, separator, number = item["custom_id"].rpartition("#")
+                if separator and number.isdigit():
+                    parts.setdefault(custom_id, {})[int(number)] = content or None
+                else:
+                    results[item["custom_id"]] = content or None
+        for custom_id, contents in parts.items():
+            contents = [contents[number] for number in sorted(contents)]
+            results[custom_id] = merge_generations(contents) if all(contents) else None
+        return results
+
+    def stream_test_cases(self, user_story_description: str, force_refresh: bool = False, usage=None):
+        """
+        Gera os casos de teste em streaming, entregando o texto à medida que os
+        tokens chegam. Uma geração em cache, ou de uma história longa (gerada em
+        partes), é entregue de uma só vez e a geração completa é gravada no cache
+        ao final.
+        Args:
+            user_story_description (str): Texto da história de usuário.
+            force_refresh (bool): Ignora o cache e força uma nova geração.
+            usage (TokenUsage, opcional): Recebe os tokens gastos nas chamadas.
+        Yields:
+            str: Próximo trecho do texto gerado.
+        Raises:
+            Exception: Falha da API. Apenas a abertura do stream passa pelas novas
+            tentativas do RateLimiter; uma interrupção no meio não é repetida, pois
+            parte do texto já foi entregue.
+        """
+        key, cached = self._lookup_cache(user_story_description, force_refresh)
+        if cached is not None:
+            yield cached
+            return
+        story_parts = self._story_parts(user_story_description)
+        if len(story_parts) > 1:
+            test_cases = self._generate(user_story_description, key, usage)
+            if not test_cases:
+                raise RuntimeError("Falha ao gerar os casos de teste de uma das partes da história.")
+            yield test_cases
+            return
+
+        stream = self.limiter.call(
+            "chat.completions",
+            self.client.chat.completions.create,
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._completion_kwargs(story_parts[0])
+        )
+        if usage is not None:
+            usage.calls += 1
+        parts = []
+        try:
+            for chunk in stream:
+                _record_usage(chunk, usage)
+                delta = _delta_text(chunk)
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        test_cases = "".join(parts)
+        logger.debug("Casos de teste gerados com sucesso.")
+        if key is not None and test_cases:
+            self._store_in_cache(key, test_cases)
+
+    def _completion_kwargs(self, story_text, part=1, total=1):
+        """
+        Args:
+            story_text (str): Texto limpo da história (ou de uma parte dela).
+            part, total (int): Número da parte e quantidade de partes da história.
+        """
+        if total > 1:
+            prompt = PART_PROMPT_TEMPLATE.format(part=part, total=total, user_story_description=story_text)
+        else:
+            prompt = PROMPT_TEMPLATE.format(user_story_description=story_text)
+        return {
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": completion_budget(count_tokens(story_text, self.model), self.max_tokens),
+            "response_format": RESPONSE_FORMAT,
+        }
+
+    def _lookup_cache(self, user_story_description, force_refresh, prompt_template=PROMPT_TEMPLATE,
+                      fallback_template=None):
+        """
+        Consulta o cache de gerações, contando um acerto ou uma falha por história.
+        Args:
+            fallback_template (str, opcional): Prompt cuja geração também serve se
+                não houver uma com `prompt_template` (ex: a geração individual de
+                uma história enviada no prompt em lote).
+        Returns:
+            tuple: (chave de cache de `prompt_template` ou None sem cache configurado,
+            conteúdo em cache ou None).
+        """
+        if self.cache is None:
+            return None, None
+        key = self.cache_key(user_story_description, prompt_template)
+        if not force_refresh:
+            keys = [key]
+            if fallback_template is not None:
+                keys.append(self.cache_key(user_story_description, fallback_template))
+            for candidate in keys:
+                cached = self.cache.get_cached_generation(candidate, max_age_seconds=self.cache_ttl_seconds)
+                if cached is not None:
+                    with self._cache_lock:
+                        self.cache_hits += 1
+                    CACHE_REQUESTS.inc(cache="openai", result="hit")
+                    logger.debug("Casos de teste recuperados do cache.")
+                    return key, cached
+        with self._cache_lock:
+            self.cache_misses += 1
+        CACHE_REQUESTS.inc(cache="openai", result="miss")
+        return key, None
+
+    def _store_in_cache(self, key, test_cases):
+        try:
+            self.cache.save_cached_generation(key, self.model, test_cases)
+            with self._cache_lock:
+                self._cache_writes += 1
+                should_evict = self._cache_writes % 50 == 0
+            if should_evict:
+                self.cache.evict_generation_cache(
+                    max_entries=self.cache_max_entries,
+                    max_age_seconds=self.cache_ttl_seconds,
+                )
+        except Exception as e:
+            # Falha no cache não deve impedir o uso da geração
+            logger.error("Erro ao gravar geração no cache: %s", e)
+
+
+class AsyncOpenAIClient(OpenAIClient):
+    """
+    Variante assíncrona do OpenAIClient, com o mesmo prompt, configuração e cache.
+    Recebe opcionalmente o httpx.AsyncClient compartilhado com o AsyncJiraClient,
+    reaproveitando as conexões keep-alive do pool. As leituras e gravações do cache
+    (SQLite) rodam em threads para não bloquear o event loop.
+    """
+
+    def __init__(self, cache=None, http_client=None):
+        self._http_client = http_client
+        super().__init__(cache=cache)
+
+    def _create_client(self):
+        from http_pool import create_async_http_client
+        from openai import AsyncOpenAI
+
+        http_client = self._http_client or create_async_http_client()
+        client = AsyncOpenAI(api_key=self.openai_api_key, max_retries=0, http_client=http_client)
+        host = client.base_url.host
+
+        async def observe(response):
+            # O pool pode ser compartilhado com o Jira: apenas as respostas da OpenAI
+            if response.request.url.host == host:
+                self.limiter.observe(response)
+
+        http_client.event_hooks["response"].append(observe)
+        return client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        # O cliente HTTP compartilhado pertence a quem o criou
+        if self._http_client is None:
+            await self.client.close()
+
+    async def generate_test_cases(self, user_story_description: str, force_refresh: bool = False,
+                                  usage=None) -> str:
+        """
+        Equivalente assíncrono de OpenAIClient.generate_test_cases; as partes de
+        uma história longa são geradas em paralelo.
+        """
+        key, cached = await asyncio.to_thread(self._lookup_cache, user_story_description, force_refresh)
+        if cached is not None:
+            return cached
+        return await self._generate(user_story_description, key, usage)
+
+    async def _generate(self, user_story_description, key, usage=None):
+        parts = self._story_parts(user_story_description)
+        contents = await asyncio.gather(*(
+            self._generate_part(part, number, len(parts), usage) for number, part in enumerate(parts, 1)
+        ))
+        if not all(contents):
+            return None
+        return await asyncio.to_thread(self._finish_generation, key, contents)
+
+    async def _generate_part(self, story_text, part, total, usage):
+        try:
+            chat_completion = await self.limiter.acall(
+                "chat.completions",
+                self.client.chat.completions.create,
+                **self._completion_kwargs(story_text, part, total)
             )
-            test_cases = chat_completion.choices[0].message.content
-            print("Casos de teste gerados com sucesso.")
-            return test_cases
+            _record_usage(chat_completion, usage)
+            if usage is not None:
+                usage.calls += 1
+            _warn_if_truncated(chat_completion)
+            logger.debug("Casos de teste gerados com sucesso.")
+            return chat_completion.choices[0].message.content
 
         except Exception as e:
-            print(f"Erro ao gerar casos de teste com OpenAI: {e}")
-            return f"Erro ao gerar casos de teste: {e}"
+            # Não devolve a mensagem de erro como se fosse conteúdo: o chamador
+            # decide se tenta novamente no próximo ciclo
+            logger.error("Erro ao gerar casos de teste com OpenAI: %s", e)
+            return None
+
+    async def generate_test_cases_batch(self, stories, force_refresh: bool = False, usages=None):
+        """
+        Equivalente assíncrono de OpenAIClient.generate_test_cases_batch; as
+        histórias que faltarem na resposta são geradas individualmente em paralelo.
+        """
+        results, pending = await asyncio.to_thread(self._batch_lookup, stories, force_refresh)
+        if len(pending) > 1:
+            batch_usage = TokenUsage()
+            try:
+                chat_completion = await self.limiter.acall(
+                    "chat.completions",
+                    self.client.chat.completions.create,
+                    **self._batch_completion_kwargs(pending)
+                )
+                _record_usage(chat_completion, batch_usage)
+                batch_usage.calls += 1
+                generated = parse_batch_response(chat_completion.choices[0].message.content, pending)
+            except Exception as e:
+                logger.error("Erro ao gerar casos de teste em lote com OpenAI: %s", e)
+                generated = {}
+            self._split_batch_usage(batch_usage, pending, usages)
+            await asyncio.to_thread(self._collect_batch, generated, pending, results)
+        individual = await asyncio.gather(*(
+            self._generate(text, self._single_cache_key(text), _story_usage(usages, jira_key))
+            for jira_key, (_, text) in pending.items()
+        ))
+        results.update(zip(pending, individual))
+        return results
+
+    async def stream_test_cases(self, user_story_description: str, force_refresh: bool = False,
+                                usage=None):
+        """
+        Equivalente assíncrono de OpenAIClient.stream_test_cases.
+        """
+        key, cached = await asyncio.to_thread(self._lookup_cache, user_story_description, force_refresh)
+        if cached is not None:
+            yield cached
+            return
+        story_parts = self._story_parts(user_story_description)
+        if len(story_parts) > 1:
+            test_cases = await self._generate(user_story_description, key, usage)
+            if not test_cases:
+                raise RuntimeError("Falha ao gerar os casos de teste de uma das partes da história.")
+            yield test_cases
+            return
+
+        stream = await self.limiter.acall(
+            "chat.completions",
+            self.client.chat.completions.create,
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._completion_kwargs(story_parts[0])
+        )
+        if usage is not None:
+            usage.calls += 1
+        parts = []
+        try:
+            async for chunk in stream:
+                _record_usage(chunk, usage)
+                delta = _delta_text(chunk)
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                await close()
+        test_cases = "".join(parts)
+        logger.debug("Casos de teste gerados com sucesso.")
+        if key is not None and test_cases:
+            await asyncio.to_thread(self._store_in_cache, key, test_cases)
+
+
+def _story_usage(usages, jira_key):
+    """TokenUsage da história em `usages` (criado se preciso), ou None sem `usages`."""
+    if usages is None:
+        return None
+    return usages.setdefault(jira_key, TokenUsage())
+
+
+def _record_usage(response, usage=None):
+    """
+    Soma os tokens informados pela API (no streaming, apenas o último chunk traz
+    `usage`) na métrica e, se informado, no TokenUsage da geração.
+    """
+    reported = getattr(response, "usage", None)
+    counts = {}
+    for kind in ("prompt", "completion"):
+        tokens = getattr(reported, f"{kind}_tokens", None)
+        if isinstance(tokens, int):
+            OPENAI_TOKENS.inc(tokens, kind=kind)
+            counts[f"{kind}_tokens"] = tokens
+    if usage is not None and counts:
+        usage.add(**counts)
+
+
+def _warn_if_truncated(chat_completion):
+    # finish_reason "length": a resposta atingiu max_tokens e o JSON ficou incompleto
+    if getattr(chat_completion.choices[0], "finish_reason", None) == "length":
+        logger.warning("Resposta da OpenAI truncada em max_tokens; aumente OPENAI_MAX_TOKENS "
+                       "ou reduza OPENAI_PROMPT_MAX_TOKENS.")
+
+
+def _delta_text(chunk):
+    """Texto incremental de um chunk do streaming (o último pode vir sem choices)."""
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
 
 
 if __name__ == "__main__":
@@ -67,4 +788,4 @@ if __name__ == "__main__":
 
     # Exibe os casos de teste gerados
     print("\nCasos de Teste Gerados:")
-    print(test_cases)
+    print(render_markdown(parse_scenarios(test_cases)))
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import PIPELINE_ITEMS, PIPELINE_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(items, size):
+    """Divide um iterável em listas de até `size` elementos, consumindo-o sob demanda."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class PipelineStats:
+    """
+    Acumula volume e tempo gasto em cada etapa do processamento de histórias
+    (banco de dados, geração na OpenAI, escrita no Jira) durante um ciclo.
+    Seguro para uso a partir de várias threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    @contextmanager
+    def stage(self, name, items=1):
+        """
+        Mede o tempo de execução de um bloco e o contabiliza na etapa `name`.
+        Args:
+            name (str): Nome da etapa (ex: "openai").
+            items (int): Quantidade de itens processados pelo bloco.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, items)
+
+    def record(self, name, elapsed, items=1):
+        with self._lock:
+            stage = self._stages.setdefault(name, {"items": 0, "busy_seconds": 0.0})
+            stage["items"] += items
+            stage["busy_seconds"] += elapsed
+        PIPELINE_ITEMS.inc(items, stage=name)
+        PIPELINE_STAGE_SECONDS.observe(elapsed, stage=name)
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    @property
+    def wall_seconds(self):
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    def summary(self):
+        """
+        Returns:
+            dict: Por etapa, itens processados, tempo ocupado, latência média
+            e vazão (itens por segundo de relógio do ciclo).
+        """
+        wall = self.wall_seconds or 1e-9
+        with self._lock:
+            stages = {name: dict(values) for name, values in self._stages.items()}
+        for values in stages.values():
+            items = values["items"]
+            values["avg_seconds"] = values["busy_seconds"] / items if items else 0.0
+            values["throughput_per_second"] = items / wall
+        return stages
+
+    def format_report(self):
+        lines = [f"Resumo do ciclo ({self.wall_seconds:.2f}s):"]
+        for name, values in self.summary().items():
+            lines.append(
+                f"  {name}: {values['items']} itens, "
+                f"média {values['avg_seconds']:.3f}s, "
+                f"{values['throughput_per_second']:.2f} itens/s"
+            )
+        return "\n".join(lines)
+
+
+class GenerationProgress:
+    """
+    Progresso de uma geração em streaming, publicado no banco (tabela
+    generation_progress) para a aplicação web: o Markdown dos cenários já
+    concluídos, atualizado a cada novo cenário.
+    """
+
+    def __init__(self, db_manager, story_id):
+        self.db_manager = db_manager
+        self.story_id = story_id
+        self.text = ""
+
+    def flush(self, status="streaming"):
+        # O progresso é informativo: uma falha ao gravá-lo não interrompe a geração
+        try:
+            self.db_manager.update_generation_progress(self.story_id, self.text, status)
+        except Exception as e:
+            logger.error("Erro ao gravar progresso da geração: %s", e)
+
+    def clear(self):
+        try:
+            self.db_manager.clear_generation_progress(self.story_id)
+        except Exception as e:
+            logger.error("Erro ao remover progresso da geração: %s", e)
@@ -0,0 +1,417 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from dotenv import load_dotenv
+
+from metrics import EXTERNAL_REQUEST_SECONDS, EXTERNAL_REQUESTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Status HTTP que indicam falha transitória e justificam nova tentativa
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# Exceções de rede (requests, httpx, openai) reconhecidas pelo nome da classe,
+# evitando depender de cada biblioteca aqui
+RETRYABLE_EXCEPTION_NAMES = {
+    "ConnectionError", "TimeoutError", "Timeout", "ConnectTimeout", "ReadTimeout",
+    "ConnectError", "ReadError", "RemoteProtocolError", "APIConnectionError", "APITimeoutError",
+}
+
+
+class CircuitOpenError(Exception):
+    """O endpoint falhou repetidamente e está temporariamente bloqueado."""
+
+    def __init__(self, endpoint, retry_in):
+        super().__init__(f"Circuito aberto para {endpoint}; nova tentativa em {retry_in:.1f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """
+    Token bucket com taxa adaptativa (AIMD): a taxa cai pela metade a cada 429 e
+    volta a subir aos poucos a cada sucesso, convergindo para a maior vazão que o
+    serviço aceita. Utilizável a partir de threads e de corrotinas.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=None, increase_step=None):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.min_rate = float(min_rate or max(0.1, rate / 20))
+        self.increase_step = float(increase_step or max(0.01, rate / 50))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Reserva um token e retorna quantos segundos esperar antes de usá-lo."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, retry_after=None):
+        """Reduz a taxa após um 429 e, se informado, pausa até o Retry-After."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def pause(self, seconds):
+        """Bloqueia novas requisições por `seconds` (cota esgotada segundo os cabeçalhos)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+
+class CircuitBreaker:
+    """
+    Abre após `failure_threshold` falhas seguidas; enquanto aberto as chamadas
+    falham imediatamente. Depois de `reset_timeout` segundos permite uma chamada
+    de teste (meio-aberto): sucesso fecha o circuito, falha o reabre.
+    """
+
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self.opened_at is None:
+            return "closed"
+        if now - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """
+        Returns:
+            bool: True se esta é a chamada de teste do circuito meio-aberto.
+        Raises:
+            CircuitOpenError: Se o circuito estiver aberto ou já houver um teste em andamento.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == "closed":
+                return False
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            retry_in = max(0.0, self.reset_timeout - (now - self.opened_at))
+        raise CircuitOpenError(self.endpoint, retry_in)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """Encerra uma chamada de teste interrompida sem resultado (ex.: cancelamento)."""
+        with self._lock:
+            self._probing = False
+
+
+def _response_of(exc):
+    return getattr(exc, "response", None)
+
+
+def status_of(exc):
+    """Status HTTP associado à exceção (python-jira, httpx ou openai), se houver."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = _response_of(exc)
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def headers_of(exc_or_response):
+    response = _response_of(exc_or_response) or exc_or_response
+    headers = getattr(response, "headers", None)
+    return headers if headers is not None and hasattr(headers, "get") else {}
+
+
+def _parse_duration(value):
+    """Converte durações como '1s', '6m0s', '250ms' ou '2.5' em segundos."""
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total, number = 0.0, ""
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char.isdigit() or char == ".":
+            number += char
+        elif value.startswith("ms", i):
+            total += float(number or 0) / 1000
+            number = ""
+            i += 1
+        elif char in "hms":
+            total += float(number or 0) * {"h": 3600, "m": 60, "s": 1}[char]
+            number = ""
+        else:
+            return None
+        i += 1
+    return total if not number else None
+
+
+def retry_after_seconds(exc_or_response):
+    """
+    Lê o tempo de espera sugerido pelos cabeçalhos de limite de taxa:
+    Retry-After (segundos ou data HTTP), retry-after-ms e os cabeçalhos
+    x-ratelimit-reset-* da OpenAI / X-RateLimit-Reset do Jira.
+    Returns:
+        float: Segundos a aguardar, ou None se não houver indicação.
+    """
+    headers = headers_of(exc_or_response)
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        seconds = _parse_duration(value)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name)
+        if value:
+            seconds = _parse_duration(value)
+            if seconds is not None:
+                return seconds
+    value = headers.get("x-ratelimit-reset")
+    if value:
+        try:
+            reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+        except ValueError:
+            return _parse_duration(value)
+    return None
+
+
+def is_retryable(exc):
+    status = status_of(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return any(cls.__name__ in RETRYABLE_EXCEPTION_NAMES for cls in type(exc).__mro__)
+
+
+class RateLimiter:
+    """
+    Limitador compartilhado por serviço (Jira ou OpenAI): token bucket adaptativo,
+    novas tentativas com backoff exponencial e jitter, e um circuit breaker por endpoint.
+    """
+
+    def __init__(self, name, rate, max_attempts=5, base_delay=0.5, max_delay=30.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.bucket = TokenBucket(rate)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(
+                    f"{self.name}:{endpoint}", self.failure_threshold, self.reset_timeout
+                )
+            return breaker
+
+    def backoff(self, attempt):
+        """Full jitter: espera aleatória entre 0 e base * 2^tentativa (limitada)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def observe(self, response):
+        """
+        Pausa preventivamente quando os cabeçalhos de uma resposta bem-sucedida
+        indicam que a cota acabou (x-ratelimit-remaining-* = 0).
+        """
+        headers = headers_of(response)
+        for name in ("x-ratelimit-remaining-requests", "x-ratelimit-remaining"):
+            remaining = headers.get(name)
+            if remaining is not None and str(remaining).strip() == "0":
+                wait = retry_after_seconds(response)
+                if wait:
+                    self.bucket.pause(min(wait, self.max_delay))
+                return
+
+    def _on_failure(self, breaker, exc, attempt):
+        """
+        Registra a falha e decide se haverá nova tentativa.
+        Returns:
+            float: Segundos a aguardar antes da próxima tentativa; a exceção é
+            relançada pelo chamador quando retorna None.
+        """
+        if not is_retryable(exc):
+            # Erros do cliente (400, 401, 404...) não indicam problema no serviço:
+            # ele respondeu, então contam como sucesso para o circuito
+            breaker.record_success()
+            return None
+        breaker.record_failure()
+        retry_after = retry_after_seconds(exc)
+        if status_of(exc) == 429:
+            # A pausa do serviço também respeita o limite: um reset de minutos não
+            # congela todas as chamadas do processo
+            self.bucket.penalize(min(retry_after, self.max_delay) if retry_after else None)
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if retry_after is None:
+            return self.backoff(attempt)
+        if retry_after > self.max_delay:
+            # Esperar menos que o pedido só gastaria as tentativas com novos 429:
+            # a falha vai para o chamador, que tenta de novo no próximo ciclo
+            logger.warning("%s pediu %.0f s de espera (limite RETRY_MAX_DELAY = %.0f s); desistindo.",
+                           self.name, retry_after, self.max_delay)
+            return None
+        return retry_after
+
+    def _record(self, endpoint, start, exc=None):
+        # Latência e resultado de cada tentativa (sem contar a espera pela taxa)
+        EXTERNAL_REQUEST_SECONDS.observe(time.perf_counter() - start, service=self.name, endpoint=endpoint)
+        outcome = "ok" if exc is None else str(status_of(exc) or type(exc).__name__)
+        EXTERNAL_REQUESTS.inc(service=self.name, endpoint=endpoint, outcome=outcome)
+
+    def call(self, endpoint, fn, *args, **kwargs):
+        """
+        Executa `fn(*args, **kwargs)` respeitando a taxa do serviço, com novas
+        tentativas para falhas transitórias.
+        Raises:
+            CircuitOpenError: Se o endpoint estiver com o circuito aberto.
+        """
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            probe = breaker.allow()
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as exc:
+                self._record(endpoint, start, exc)
+                wait = self._on_failure(breaker, exc, attempt)
+                if wait is None:
+                    raise
+                attempt += 1
+                time.sleep(wait)
+                continue
+            except BaseException:
+                # Cancelamento ou interrupção: a chamada de teste não pode deixar
+                # o circuito meio-aberto bloqueado para sempre
+                if probe:
+                    breaker.release()
+                raise
+            self._record(endpoint, start)
+            breaker.record_success()
+            self.bucket.reward()
+            return result
+
+    async def acall(self, endpoint, fn, *args, **kwargs):
+        """Equivalente assíncrono de `call`; `fn` deve retornar uma corrotina."""
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            probe = breaker.allow()
+            await self.bucket.acquire_async()
+            start = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as exc:
+                self._record(endpoint, start, exc)
+                wait = self._on_failure(breaker, exc, attempt)
+                if wait is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(wait)
+                continue
+            except BaseException:
+                # Cancelamento ou interrupção: a chamada de teste não pode deixar
+                # o circuito meio-aberto bloqueado para sempre
+                if probe:
+                    breaker.release()
+                raise
+            self._record(endpoint, start)
+            breaker.record_success()
+            self.bucket.reward()
+            return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(service):
+    """
+    Limitador compartilhado do serviço ("jira" ou "openai"), configurado pelo .env:
+    <SERVIÇO>_RATE_LIMIT_PER_SECOND, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY, CIRCUIT_FAILURE_THRESHOLD e CIRCUIT_RESET_SECONDS.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(service)
+        if limiter is None:
+            default_rate = {"jira": "10", "openai": "5"}.get(service, "5")
+            limiter = _limiters[service] = RateLimiter(
+                service,
+                rate=float(os.getenv(f"{service.upper()}_RATE_LIMIT_PER_SECOND", default_rate)),
+                max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "5")),
+                base_delay=float(os.getenv("RETRY_BASE_DELAY", "0.5")),
+                max_delay=float(os.getenv("RETRY_MAX_DELAY", "30")),
+                failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+                reset_timeout=float(os.getenv("CIRCUIT_RESET_SECONDS", "30")),
+            )
+        return limiter
@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import OrderedDict
+
+import bleach
+import markdown
+
+from metrics import CACHE_REQUESTS
+
+# Tags e atributos permitidos no HTML gerado a partir do Markdown dos casos de teste
+ALLOWED_TAGS = [
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'ul', 'ol', 'li',
+    'strong', 'em', 'a', 'code', 'pre', 'blockquote', 'table',
+    'thead', 'tbody', 'tr', 'th', 'td',
+]
+ALLOWED_ATTRIBUTES = {'a': ['href', 'title']}
+
+# Entradas mantidas no cache em memória de HTML renderizado
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "1024"))
+
+
+def render_test_case_html(content):
+    """
+    Converte o Markdown de um caso de teste em HTML sanitizado (evita XSS).
+    Args:
+        content (str): Conteúdo gerado pela OpenAI.
+    Returns:
+        str: HTML seguro para exibição.
+    """
+    return bleach.clean(
+        markdown.markdown(content or ''),
+        tags=ALLOWED_TAGS,
+        attributes=ALLOWED_ATTRIBUTES,
+    )
+
+
+class _LRUCache:
+    """Cache LRU limitado e seguro entre threads."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_html_cache = _LRUCache(RENDER_CACHE_SIZE)
+
+
+def html_for_test_case(test_case):
+    """
+    HTML de um caso de teste lido do banco: usa o pré-renderizado na gravação e,
+    para registros antigos sem ele, renderiza uma vez por hash de conteúdo.
+    Args:
+        test_case (dict): Registro com content, content_hash e content_html.
+    Returns:
+        str: HTML sanitizado.
+    """
+    html = test_case.get('content_html')
+    if html is not None:
+        return html
+    key = test_case.get('content_hash')
+    if key is None:
+        return render_test_case_html(test_case['content'])
+    html = _html_cache.get(key)
+    if html is None:
+        CACHE_REQUESTS.inc(cache="html", result="miss")
+        html = render_test_case_html(test_case['content'])
+        _html_cache.set(key, html)
+    else:
+        CACHE_REQUESTS.inc(cache="html", result="hit")
+    return html
@@ -0,0 +1,267 @@
+import json
+import re
+
+# Esquema JSON exigido da OpenAI (structured outputs) para os casos de teste
+SCENARIO_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "preconditions": {"type": "array", "items": {"type": "string"}},
+        "steps": {"type": "array", "items": {"type": "string"}},
+        "expected_result": {"type": "string"},
+    },
+    "required": ["title", "preconditions", "steps", "expected_result"],
+    "additionalProperties": False,
+}
+
+TEST_CASES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scenarios": {"type": "array", "items": SCENARIO_SCHEMA},
+    },
+    "required": ["scenarios"],
+    "additionalProperties": False,
+}
+
+# Palavras-chave do Gherkin usadas apenas para interpretar gerações antigas em texto livre
+_GHERKIN_SECTIONS = {
+    "dado": "preconditions",
+    "quando": "steps",
+    "então": "expected_result",
+    "entao": "expected_result",
+}
+_LINE_DECORATION = re.compile(r"^[\s>*#\-+\d.)]*")
+
+
+class Scenario:
+    """
+    Cenário de teste estruturado: título, pré-condições, passos e resultado esperado.
+    É a única representação usada para gravar no banco, criar subtarefas no Jira e
+    exibir na aplicação web.
+    """
+
+    __slots__ = ("title", "preconditions", "steps", "expected_result")
+
+    def __init__(self, title, preconditions=(), steps=(), expected_result=""):
+        self.title = title
+        self.preconditions = list(preconditions)
+        self.steps = list(steps)
+        self.expected_result = expected_result
+
+    @classmethod
+    def from_dict(cls, data):
+        """Cria o cenário a partir do JSON da OpenAI (ou de uma linha da tabela scenarios)."""
+        def items(value):
+            if isinstance(value, str):
+                value = [value]
+            return [str(item).strip() for item in value or () if str(item).strip()]
+
+        return cls(
+            title=str(data.get("title") or "").strip(),
+            preconditions=items(data.get("preconditions")),
+            steps=items(data.get("steps")),
+            expected_result=str(data.get("expected_result") or "").strip(),
+        )
+
+    @classmethod
+    def from_text(cls, block):
+        """
+        Interpreta um bloco "Cenário: ..." em texto livre (gerações anteriores ao
+        esquema JSON), classificando as linhas pelas palavras-chave do Gherkin.
+        """
+        lines = [_LINE_DECORATION.sub("", line).replace("**", "").strip() for line in block.splitlines()]
+        lines = [line for line in lines if line]
+        if not lines:
+            return cls("")
+        title = re.sub(r"^cen[aá]rio\s*\d*\s*:?", "", lines[0], flags=re.IGNORECASE).strip()
+        sections = {"preconditions": [], "steps": [], "expected_result": []}
+        current = "steps"
+        for line in lines[1:]:
+            # "E"/"Mas" e linhas sem palavra-chave continuam a seção atual
+            keyword = line.split(maxsplit=1)[0].lower().rstrip(":,")
+            current = _GHERKIN_SECTIONS.get(keyword, current)
+            sections[current].append(line)
+        return cls(title, sections["preconditions"], sections["steps"], "\n".join(sections["expected_result"]))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return isinstance(other, Scenario) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Scenario({self.title!r})"
+
+
+def parse_scenarios(content):
+    """
+    Converte a geração da OpenAI em cenários, com uma única leitura do texto.
+    Args:
+        content (str): JSON no formato TEST_CASES_SCHEMA ou, em gerações antigas,
+            texto livre com blocos "Cenário:".
+    Returns:
+        list: Objetos Scenario, na ordem gerada.
+    """
+    try:
+        data = json.loads(content or "")
+    except (TypeError, ValueError):
+        data = None
+    if isinstance(data, dict) and isinstance(data.get("scenarios"), list):
+        return [Scenario.from_dict(item) for item in data["scenarios"] if isinstance(item, dict)]
+    return [
+        Scenario.from_text(block)
+        for block in split_scenarios(content or "")
+        if is_scenario_header(block.split("\n", 1)[0])
+    ]
+
+
+class ScenarioStreamParser:
+    """
+    Extrai os cenários de uma resposta JSON recebida aos pedaços (streaming da
+    OpenAI): cada objeto do array "scenarios" é entregue assim que se fecha, sem
+    esperar o restante da geração.
+    """
+
+    # Profundidade dos objetos de cenário em {"scenarios": [{...}, ...]}
+    SCENARIO_DEPTH = 3
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._buffer = None
+
+    def feed(self, text):
+        """
+        Args:
+            text (str): Próximo trecho do JSON gerado.
+        Returns:
+            list: Cenários concluídos por este trecho.
+        """
+        completed = []
+        for char in text:
+            if self._buffer is not None:
+                self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if char == "{" and self._depth == self.SCENARIO_DEPTH:
+                    self._buffer = ["{"]
+            elif char in "}]":
+                if self._depth == self.SCENARIO_DEPTH and self._buffer is not None:
+                    scenario = self._parse("".join(self._buffer))
+                    if scenario is not None:
+                        completed.append(scenario)
+                    self._buffer = None
+                self._depth -= 1
+        return completed
+
+    @staticmethod
+    def _parse(text):
+        try:
+            return Scenario.from_dict(json.loads(text))
+        except (ValueError, AttributeError):
+            return None
+
+
+def render_markdown(scenarios):
+    """
+    Markdown dos cenários, gravado em test_cases.content (busca textual e página da história).
+    """
+    parts = []
+    for idx, scenario in enumerate(scenarios, 1):
+        lines = [f"### Cenário: {scenario.title or f'Cenário {idx}'}"]
+        if scenario.preconditions:
+            lines += ["", "**Pré-condições**", ""] + [f"- {item}" for item in scenario.preconditions]
+        if scenario.steps:
+            lines += ["", "**Passos**", ""] + [f"{n}. {step}" for n, step in enumerate(scenario.steps, 1)]
+        if scenario.expected_result:
+            lines += ["", "**Resultado esperado**", "", scenario.expected_result]
+        parts.append("\n".join(lines))
+    return "\n\n".join(parts)
+
+
+def render_jira_wiki(scenario):
+    """Descrição da subtarefa do cenário na notação wiki do Jira."""
+    lines = []
+    if scenario.preconditions:
+        lines += ["h3. Pré-condições"] + [f"* {item}" for item in scenario.preconditions]
+    if scenario.steps:
+        lines += ["h3. Passos"] + [f"# {step}" for step in scenario.steps]
+    if scenario.expected_result:
+        lines += ["h3. Resultado esperado", scenario.expected_result]
+    return "\n".join(lines)
+
+
+def is_scenario_header(line):
+    """Linhas que iniciam um novo cenário no texto gerado ("Cenário:" no padrão do prompt)."""
+    normalized = line.strip().lstrip("#*>- ").lower()
+    return normalized.startswith("cenário") or normalized.startswith("cenario")
+
+
+class ScenarioSplitter:
+    """
+    Divide em cenários um texto livre recebido aos pedaços. Um cenário é entregue
+    assim que a linha de cabeçalho do próximo chega; o último só é conhecido em
+    `finish()`. Produz os mesmos blocos que `split_scenarios` aplicado ao texto completo.
+    """
+
+    def __init__(self):
+        self._partial_line = ""
+        self._current = []
+
+    def feed(self, text):
+        """
+        Args:
+            text (str): Próximo trecho do texto gerado.
+        Returns:
+            list: Blocos de cenário concluídos por este trecho.
+        """
+        completed = []
+        lines = (self._partial_line + text).split("\n")
+        # A última parte pode ser uma linha ainda incompleta
+        self._partial_line = lines.pop()
+        for line in lines:
+            self._add_line(line, completed)
+        return completed
+
+    def finish(self):
+        """
+        Returns:
+            list: Blocos restantes ao fim da geração.
+        """
+        completed = []
+        if self._partial_line:
+            self._add_line(self._partial_line, completed)
+            self._partial_line = ""
+        if self._current:
+            completed.append("\n".join(self._current))
+            self._current = []
+        return completed
+
+    def _add_line(self, line, completed):
+        line = line.rstrip("\r")
+        if is_scenario_header(line) and self._current:
+            completed.append("\n".join(self._current))
+            self._current = []
+        self._current.append(line)
+
+
+def split_scenarios(text):
+    """
+    Divide um texto livre gerado em blocos, um por cenário.
+    Returns:
+        list: Texto de cada cenário, iniciando pela linha "Cenário".
+    """
+    splitter = ScenarioSplitter()
+    blocks = splitter.feed(text)
+    blocks.extend(splitter.finish())
+    return blocks
@@ -0,0 +1,147 @@
+"""
+Detecção de histórias quase idênticas por assinaturas MinHash, calculadas localmente
+a partir do título e da descrição (sem chamadas externas). Cada assinatura tem
+NUM_PERM valores de 32 bits e é gravada como BLOB na tabela story_signatures; a busca
+compara a assinatura da história nova com as de todas as histórias que já têm casos
+de teste, de uma só vez, em uma matriz NumPy.
+
+A fração de valores iguais entre duas assinaturas estima a similaridade de Jaccard
+entre os conjuntos de trechos de SHINGLE_SIZE palavras das duas histórias.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+SHINGLE_SIZE = 2
+# Trechos mínimos para calcular a assinatura: histórias vazias ou de poucas palavras
+# (só o título) teriam similaridade alta com qualquer outra igualmente curta
+MIN_SHINGLES = 5
+# Similaridade mínima para reutilizar os casos de teste de outra história
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.8"))
+# Intervalo para recarregar as assinaturas gravadas por outros processos
+SIMILARITY_REFRESH_SECONDS = float(os.getenv("SIMILARITY_REFRESH_SECONDS", "60"))
+# Assinaturas calculadas e gravadas por transação ao preencher as que faltam
+SIGNATURE_BATCH_SIZE = 1000
+
+# Permutações pela família "multiply-add-shift": h(x) = ((a * x + b) mod 2^64) >> 32,
+# com a (ímpar) e b aleatórios de 64 bits e x o crc32 do trecho; a multiplicação em
+# uint64 do NumPy já é módulo 2^64. A semente é fixa: as assinaturas gravadas só são
+# comparáveis entre si se as permutações forem as mesmas.
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(0, np.iinfo(np.uint64).max, NUM_PERM, dtype=np.uint64, endpoint=True) | np.uint64(1)
+_B = _rng.integers(0, np.iinfo(np.uint64).max, NUM_PERM, dtype=np.uint64, endpoint=True)
+_SHIFT = np.uint64(32)
+_COMBINING_MARKS = re.compile("[\u0300-\u036f]")
+_WORD = re.compile(r"\w+")
+
+
+def _words(text):
+    return _WORD.findall(_COMBINING_MARKS.sub("", unicodedata.normalize("NFKD", text.lower())))
+
+
+def story_signature(title, description):
+    """
+    Assinatura MinHash do título e da descrição, sem diferenciar maiúsculas,
+    acentos e pontuação.
+    Returns:
+        numpy.ndarray: NUM_PERM valores uint32, ou None se a história tiver menos de
+        MIN_SHINGLES trechos (não participa da reutilização).
+    """
+    words = _words(f"{title}\n{description}")
+    shingles = {" ".join(shingle) for shingle in zip(*(words[i:] for i in range(SHINGLE_SIZE)))}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    return ((hashes[:, None] * _A + _B) >> _SHIFT).min(axis=0).astype(np.uint32)
+
+
+def signature_to_bytes(signature):
+    # Assinatura vazia: a história foi avaliada, mas é curta demais para comparar
+    return b"" if signature is None else signature.astype("<u4").tobytes()
+
+
+def similarity(first, second):
+    """Similaridade de Jaccard estimada entre duas assinaturas (0 a 1)."""
+    return float(np.count_nonzero(first == second)) / NUM_PERM
+
+
+class SimilarityIndex:
+    """
+    Assinaturas das histórias com casos de teste atuais, em uma matriz (histórias x
+    NUM_PERM) mantida em memória. As assinaturas que faltam (histórias geradas desde
+    a última carga, inclusive por outros processos) são calculadas e gravadas ao
+    recarregar, a cada `refresh_seconds`.
+    """
+
+    def __init__(self, db_manager, threshold=None, refresh_seconds=None):
+        self.db_manager = db_manager
+        self.threshold = threshold if threshold is not None else SIMILARITY_THRESHOLD
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else SIMILARITY_REFRESH_SECONDS
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def refresh(self):
+        """Calcula as assinaturas que faltam e recarrega a matriz do banco."""
+        computed = 0
+        while True:
+            missing = self.db_manager.get_stories_missing_signatures(SIGNATURE_BATCH_SIZE)
+            if not missing:
+                break
+            self.db_manager.save_story_signatures(
+                (story["id"], story["content_hash"],
+                 signature_to_bytes(story_signature(story["title"], story["description"])))
+                for story in missing
+            )
+            computed += len(missing)
+        if computed:
+            logger.info("%s assinaturas de similaridade calculadas.", computed)
+
+        rows = self.db_manager.get_story_signatures()
+        ids = np.fromiter((story_id for story_id, _ in rows), dtype=np.int64, count=len(rows))
+        matrix = np.frombuffer(b"".join(blob for _, blob in rows), dtype="<u4").reshape(len(rows), NUM_PERM)
+        self._ids, self._matrix = ids, matrix
+        self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+                self.refresh()
+
+    def find(self, title, description, exclude=None):
+        """
+        História com casos de teste mais parecida com o título e a descrição.
+        Args:
+            exclude (int, opcional): ID a ignorar (a própria história).
+        Returns:
+            tuple: (story_id, similaridade) acima do limiar, ou None.
+        """
+        signature = story_signature(title, description)
+        if signature is None:
+            return None
+        self._ensure_fresh()
+        ids, matrix = self._ids, self._matrix
+        if not len(ids):
+            return None
+        matches = np.count_nonzero(matrix == signature, axis=1)
+        if exclude is not None:
+            matches[ids == exclude] = -1
+        best = int(np.argmax(matches))
+        score = matches[best] / NUM_PERM
+        if score < self.threshold:
+            return None
+        return int(ids[best]), float(score)
@@ -0,0 +1,183 @@
+"""
+Ponto de entrada de produção: executa a aplicação web e o agente em processos
+separados e os reinicia se caírem. A aplicação web roda no gunicorn com vários
+processos (ou, sem ele instalado, no servidor do Flask), sem o agente embutido;
+o agente roda em processo próprio, opcionalmente com os processos da fila
+(--agent-workers). O estado de cada processo fica na tabela process_heartbeats e
+aparece na aplicação web em /status.
+
+Uso:
+    python src/supervisor.py
+    python src/supervisor.py --web-workers 4 --agent-workers 2
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from db_manager import DBManager
+from health import STATUS_IDLE, Heartbeat
+from log_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "5003"))
+# Processos e threads por processo do gunicorn; as threads atendem as conexões
+# longas do streaming (SSE) sem ocupar um processo inteiro
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "4"))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))
+# Espera máxima entre reinícios de um processo que cai repetidamente
+SUPERVISOR_MAX_BACKOFF = float(os.getenv("SUPERVISOR_MAX_BACKOFF_SECONDS", "60"))
+# Um processo que ficou de pé por este tempo volta à espera inicial ao cair
+SUPERVISOR_STABLE_SECONDS = 60.0
+
+
+class ManagedProcess:
+    """Processo filho reiniciado com espera exponencial quando termina."""
+
+    def __init__(self, name, command, env=None):
+        self.name = name
+        self.command = command
+        self.env = env
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.failures = 0
+        self.next_start = 0.0
+        self.last_exit_code = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, env=self.env)
+        self.started_at = time.monotonic()
+        logger.info("Processo %s iniciado (pid %s): %s", self.name, self.process.pid, " ".join(self.command))
+
+    def check(self, now):
+        """
+        Inicia o processo se for a hora, ou agenda o reinício se ele terminou.
+        Returns:
+            bool: True se o processo está em execução.
+        """
+        if self.process is None:
+            if now >= self.next_start:
+                self.start()
+                return True
+            return False
+        exit_code = self.process.poll()
+        if exit_code is None:
+            return True
+
+        self.last_exit_code = exit_code
+        self.failures = 1 if now - self.started_at >= SUPERVISOR_STABLE_SECONDS else self.failures + 1
+        delay = min(SUPERVISOR_MAX_BACKOFF, 2 ** (self.failures - 1))
+        logger.error("Processo %s (pid %s) terminou com código %s; reinício em %.0fs.",
+                     self.name, self.process.pid, exit_code, delay)
+        self.process = None
+        self.restarts += 1
+        self.next_start = now + delay
+        return False
+
+    def stop(self, timeout=30.0):
+        if self.process is None or self.process.poll() is not None:
+            return
+        # SIGTERM: o agente e os processos da fila terminam o trabalho em andamento
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.error("Processo %s não terminou em %.0fs; encerrando à força.", self.name, timeout)
+            self.process.kill()
+            self.process.wait()
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "pid": self.process.pid if self.process is not None else None,
+            "restarts": self.restarts,
+            "last_exit_code": self.last_exit_code,
+        }
+
+
+def web_command(host=WEB_HOST, port=WEB_PORT, workers=WEB_WORKERS, threads=WEB_THREADS):
+    """Comando da aplicação web: gunicorn com vários processos, se instalado."""
+    if importlib.util.find_spec("gunicorn") is not None:
+        return [
+            sys.executable, "-m", "gunicorn", "--chdir", SRC_DIR,
+            "--config", os.path.join(SRC_DIR, "gunicorn_conf.py"),
+            "--workers", str(workers), "--worker-class", "gthread", "--threads", str(threads),
+            "--bind", f"{host}:{port}", "web_app:app",
+        ]
+    logger.warning("gunicorn não instalado; a aplicação web usará o servidor do Flask em um único processo.")
+    return [sys.executable, os.path.join(SRC_DIR, "web_app.py")]
+
+
+def agent_command(workers=0):
+    command = [sys.executable, os.path.join(SRC_DIR, "main.py")]
+    if workers:
+        command += ["--workers", str(workers)]
+    return command
+
+
+class Supervisor:
+    """Mantém os processos em execução e grava o próprio sinal de vida no banco."""
+
+    def __init__(self, processes, db_manager, poll_interval=1.0):
+        self.processes = processes
+        self.db_manager = db_manager
+        self.poll_interval = poll_interval
+
+    def run(self, stop_event):
+        with Heartbeat(self.db_manager, "supervisor") as heartbeat:
+            try:
+                while not stop_event.is_set():
+                    now = time.monotonic()
+                    running = sum(process.check(now) for process in self.processes)
+                    status = STATUS_IDLE if running == len(self.processes) else "reiniciando"
+                    heartbeat.progress(status, json.dumps([process.describe() for process in self.processes]))
+                    stop_event.wait(self.poll_interval)
+            finally:
+                logger.info("Encerrando os processos supervisionados...")
+                for process in self.processes:
+                    process.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="QA Agent - aplicação web e agente em processos supervisionados")
+    parser.add_argument("--web-workers", type=int, default=WEB_WORKERS,
+                        help="Processos do gunicorn para a aplicação web")
+    parser.add_argument("--agent-workers", type=int, default=int(os.getenv("AGENT_WORKERS", "0")),
+                        help="Processos da fila de trabalhos do agente (0 = ciclos no próprio processo do agente)")
+    parser.add_argument("--no-web", action="store_true", help="Executa apenas o agente")
+    parser.add_argument("--no-agent", action="store_true", help="Executa apenas a aplicação web")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    processes = []
+    if not args.no_web:
+        # O agente roda no próprio processo supervisionado, nunca dentro da aplicação web
+        env = dict(os.environ, WEB_START_AGENT="0")
+        processes.append(ManagedProcess("web", web_command(workers=args.web_workers), env))
+    if not args.no_agent:
+        processes.append(ManagedProcess("agent", agent_command(args.agent_workers)))
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    db_manager = DBManager()
+    try:
+        Supervisor(processes, db_manager).run(stop_event)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
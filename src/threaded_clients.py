@@ -0,0 +1,66 @@
+import asyncio
+
+_END = object()
+
+
+async def iterate_in_thread(iterable):
+    """
+    Percorre um iterável síncrono (paginação do Jira, streaming da OpenAI) sem
+    bloquear o event loop: cada item é obtido em uma thread do executor padrão.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            item = await asyncio.to_thread(next, iterator, _END)
+            if item is _END:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await asyncio.to_thread(close)
+
+
+class ThreadedJiraClient:
+    """
+    JiraClient síncrono com a interface do AsyncJiraClient: o pipeline do agente
+    é escrito uma única vez, em asyncio, e no modo com threads cada chamada roda
+    no executor padrão do event loop.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def iter_user_stories(self, **kwargs):
+        return iterate_in_thread(self.client.iter_user_stories(**kwargs))
+
+    async def create_subtasks(self, parent_issue_key, scenarios):
+        return await asyncio.to_thread(self.client.create_subtasks, parent_issue_key, scenarios)
+
+
+class ThreadedOpenAIClient:
+    """OpenAIClient síncrono com a interface do AsyncOpenAIClient (ver ThreadedJiraClient)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def generate_test_cases(self, user_story_description, force_refresh=False, usage=None):
+        return await asyncio.to_thread(
+            self.client.generate_test_cases, user_story_description, force_refresh=force_refresh, usage=usage
+        )
+
+    async def generate_test_cases_batch(self, stories, force_refresh=False, usages=None):
+        return await asyncio.to_thread(
+            self.client.generate_test_cases_batch, stories, force_refresh=force_refresh, usages=usages
+        )
+
+    def stream_test_cases(self, user_story_description, force_refresh=False, usage=None):
+        return iterate_in_thread(
+            self.client.stream_test_cases(user_story_description, force_refresh=force_refresh, usage=usage)
+        )
+
+    def plan_batches(self, stories):
+        return self.client.plan_batches(stories)
+
+    def cache_stats(self):
+        return self.client.cache_stats()
@@ -0,0 +1,181 @@
+"""
+Orçamento de tokens dos prompts de geração: contagem local com o tokenizador do
+modelo (tiktoken), limpeza da marcação wiki do Jira e de linhas sem conteúdo,
+divisão das histórias longas em partes enviadas em chamadas separadas e cálculo do
+`max_tokens` de cada chamada a partir do tamanho da história.
+
+O tiktoken baixa o arquivo de codificação na primeira utilização (defina
+TIKTOKEN_CACHE_DIR para reaproveitá-lo sem acesso à internet); sem ele, a contagem
+usa a estimativa de ~4 caracteres por token.
+"""
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Tokens da história por chamada; acima disso ela é dividida em partes
+PROMPT_MAX_TOKENS = int(os.getenv("OPENAI_PROMPT_MAX_TOKENS", "3000"))
+# max_tokens de uma chamada: mínimo mais uma proporção dos tokens da história,
+# limitado por OPENAI_MAX_TOKENS
+COMPLETION_MIN_TOKENS = int(os.getenv("OPENAI_MIN_COMPLETION_TOKENS", "600"))
+COMPLETION_TOKENS_RATIO = float(os.getenv("OPENAI_COMPLETION_TOKENS_RATIO", "2"))
+# Codificação usada para modelos que o tiktoken não conhece
+FALLBACK_ENCODING = "o200k_base"
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+# Marcação wiki do Jira, na ordem de aplicação: (expressão, substituição)
+_WIKI_MARKUP = [
+    (re.compile(r"\{(?:code|noformat)(?::[^}]*)?\}"), ""),
+    (re.compile(r"\{(?:color|panel|quote|anchor|section|column)(?::[^}]*)?\}"), ""),
+    (re.compile(r"![^!\s|][^!\n|]*(?:\|[^!\n]*)?!"), ""),        # imagens e anexos
+    (re.compile(r"\[~[^\]\n]*\]"), ""),                           # menções a usuários
+    (re.compile(r"\[([^|\]\n]+)\|[^\]\n]+\]"), r"\1"),            # links com texto
+    (re.compile(r"\{\{(.+?)\}\}"), r"\1"),                        # monoespaçado
+    (re.compile(r"^[ \t]*h[1-6]\.[ \t]*", re.MULTILINE), ""),     # títulos
+    (re.compile(r"^[ \t]*[*#-]+[ \t]+", re.MULTILINE), "- "),    # itens de lista
+    (re.compile(r"(?<!\w)\*([^*\n]+)\*(?!\w)"), r"\1"),           # negrito
+    (re.compile(r"(?<!\w)_([^_\n]+)_(?!\w)"), r"\1"),             # itálico
+    (re.compile(r"\|\|"), "|"),                                   # cabeçalho de tabela
+]
+# Linhas sem conteúdo: réguas, marcadores vazios e textos de preenchimento de modelos
+_EMPTY_LINE = re.compile(
+    r"^(?:-{2,}|[-|.:]*|n/?a|tbd|todo|a definir|sem descri[cç][aã]o\.?|none)$", re.IGNORECASE
+)
+_SPACES = re.compile(r"[ \t ]+")
+
+
+def estimate_tokens(text):
+    """Estimativa grosseira de tokens (~4 caracteres por token), usada sem o tiktoken."""
+    return len(text) // 4 + 1
+
+
+def _encoding(model):
+    """Codificação do tiktoken para o modelo, ou None se indisponível (carregada uma vez)."""
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        try:
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model or "")
+            except KeyError:
+                encoding = tiktoken.get_encoding(FALLBACK_ENCODING)
+        except Exception as e:
+            logger.warning("Tokenizador indisponível para %s (%s); usando estimativa de tokens.", model, e)
+            encoding = None
+        _encodings[model] = encoding
+        return encoding
+
+
+def count_tokens(text, model=None):
+    """Tokens do texto no tokenizador do modelo (ou estimados, sem o tiktoken)."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def clean_story_text(text):
+    """
+    Remove a marcação wiki do Jira (cores, painéis, imagens, menções, ênfase),
+    linhas sem conteúdo, linhas repetidas em sequência e a indentação, mantendo
+    as quebras de linha e os parágrafos.
+    """
+    for pattern, replacement in _WIKI_MARKUP:
+        text = pattern.sub(replacement, text)
+    lines, previous = [], None
+    for line in text.splitlines():
+        line = _SPACES.sub(" ", line).strip()
+        if line and _EMPTY_LINE.match(line):
+            continue
+        if line and line == previous:
+            continue
+        if line or (lines and lines[-1]):
+            lines.append(line)
+        previous = line
+    return "\n".join(lines).strip()
+
+
+def completion_budget(story_tokens, ceiling):
+    """max_tokens de uma chamada para uma história (ou parte) com `story_tokens` tokens."""
+    return min(ceiling, COMPLETION_MIN_TOKENS + int(COMPLETION_TOKENS_RATIO * story_tokens))
+
+
+def split_story(text, max_tokens, model=None):
+    """
+    Divide a história em partes de até `max_tokens` tokens, separando por
+    parágrafos, depois por linhas e, em último caso, por palavras. A primeira
+    linha (o título) é repetida no início de cada parte.
+    Returns:
+        list: Partes do texto; apenas o próprio texto se ele couber no limite.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return [text]
+    header, _, body = text.partition("\n")
+    header_tokens = count_tokens(header, model)
+    if header_tokens > max_tokens // 4:
+        header, body, header_tokens = "", text, 0
+    parts = _pack(body, max_tokens - header_tokens, model, ("\n\n", "\n", " "))
+    return [f"{header}\n{part}" if header else part for part in parts]
+
+
+def _pack(text, budget, model, separators):
+    separator, smaller = separators[0], separators[1:]
+    parts, current, used = [], [], 0
+    for piece in text.split(separator):
+        cost = count_tokens(piece, model)
+        if cost > budget and smaller:
+            if current:
+                parts.append(separator.join(current))
+                current, used = [], 0
+            parts.extend(_pack(piece, budget, model, smaller))
+            continue
+        if current and used + cost > budget:
+            parts.append(separator.join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += cost
+    if current:
+        parts.append(separator.join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+class TokenUsage:
+    """Tokens informados pela API nas chamadas de uma geração (todas as partes)."""
+
+    __slots__ = ("prompt_tokens", "completion_tokens", "calls")
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+
+    def add(self, prompt_tokens=0, completion_tokens=0):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def split(self, weights):
+        """
+        Divide os tokens de uma chamada compartilhada (prompt em lote) entre as
+        histórias, proporcionalmente aos pesos, preservando os totais.
+        Returns:
+            list: Um TokenUsage por peso, cada um com as chamadas deste.
+        """
+        if not sum(weights):
+            weights = [1] * len(weights)
+        total = sum(weights)
+        shares, cumulative, previous = [], 0, (0, 0)
+        for weight in weights:
+            cumulative += weight
+            current = (round(self.prompt_tokens * cumulative / total),
+                       round(self.completion_tokens * cumulative / total))
+            share = TokenUsage()
+            share.add(current[0] - previous[0], current[1] - previous[1])
+            share.calls = self.calls
+            shares.append(share)
+            previous = current
+        return shares
@@ -1,35 +1,179 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
 import sys
 import os
+import json
+import logging
 import time
 import threading
-from main import QAAgent
 
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from db_manager import DBManager
 import os 
-import markdown
-import bleach
-from datetime import datetime
+import hashlib
+import hmac
+from datetime import datetime, timezone
+from rendering import html_for_test_case
+from jira_client import story_from_webhook
+from job_queue import JOB_STORY
+from metrics import CONTENT_TYPE, JOBS, PROFILER, REGISTRY, WEB_REQUEST_SECONDS, handle_profile_request
+from health import health_summary
+from log_config import configure_logging
+from werkzeug.http import is_resource_modified
 
 app = Flask(__name__,
             template_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates'),
             static_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static'))
 
+logger = logging.getLogger(__name__)
+
 # chave secreta para sessões e flash messages
 app.secret_key = 'qa_agent_secret'
 
-# Inicializa o gerenciador de banco de dados
-db_manager = DBManager(db_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'qa_agent.db'))
+# Inicializa o gerenciador de banco de dados (data/qa_agent.db ou QA_AGENT_DB_PATH)
+db_manager = DBManager()
+
+# Consulta ao progresso das gerações em streaming (SSE): intervalo e duração máxima da conexão
+WEB_SSE_POLL_INTERVAL = float(os.getenv("WEB_SSE_POLL_INTERVAL", "0.5"))
+WEB_SSE_MAX_SECONDS = float(os.getenv("WEB_SSE_MAX_SECONDS", "300"))
+
+# Segredo compartilhado com o webhook do Jira; sem ele o endpoint fica desativado
+JIRA_WEBHOOK_SECRET = os.getenv("JIRA_WEBHOOK_SECRET", "")
+# Mesmos filtros da busca do agente
+JIRA_PROJECT_KEY = os.getenv("JIRA_PROJECT_KEY", "KCA")
+JIRA_STATUS = os.getenv("JIRA_STATUS", "To Do")
+
+# Histórias por página na listagem (o parâmetro per_page é limitado a WEB_MAX_PAGE_SIZE)
+WEB_PAGE_SIZE = int(os.getenv("WEB_PAGE_SIZE", "30"))
+WEB_MAX_PAGE_SIZE = 200
+
+# Trabalhos da fila por status, consultados a cada coleta de /metrics
+JOBS.set_function(lambda: {(status,): count for status, count in db_manager.get_job_counts().items()})
+
+
+@app.before_request
+def _start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.profile = PROFILER.start()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    # Rótulo pela regra da rota (/story/<int:story_id>), não pela URL, para limitar as séries
+    route = request.url_rule.rule if request.url_rule is not None else "<desconhecida>"
+    WEB_REQUEST_SECONDS.observe(
+        time.perf_counter() - g.request_started,
+        method=request.method, route=route, status=response.status_code,
+    )
+    return response
+
+
+@app.teardown_request
+def _stop_request_profile(exc):
+    PROFILER.stop(g.pop("profile", None))
+
+
+def _encode_cursor(cursor):
+    created_at, story_id = cursor
+    return f"{story_id}:{created_at}"
+
+
+def _decode_cursor(value):
+    """Converte o parâmetro `after` em (created_at, id); valores inválidos voltam à primeira página."""
+    if not value:
+        return None
+    story_id, _, created_at = value.partition(":")
+    if not story_id.isdigit() or not created_at:
+        return None
+    return created_at, int(story_id)
+
+
+def _story_filters():
+    """Filtros da listagem lidos da query string."""
+    per_page = request.args.get('per_page', WEB_PAGE_SIZE, type=int)
+    return {
+        'q': request.args.get('q', '').strip(),
+        'status': request.args.get('status', '').strip(),
+        'key': request.args.get('key', '').strip(),
+        'per_page': min(max(per_page, 1), WEB_MAX_PAGE_SIZE),
+    }
+
+
+def _fetch_story_page(filters):
+    """
+    Busca uma página de histórias: por relevância quando há termo de busca,
+    senão pela listagem paginada por chave.
+    Returns:
+        tuple: (histórias, parâmetros da próxima página ou None).
+    """
+    if filters['q']:
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        stories, next_offset = db_manager.search_user_stories(
+            filters['q'], limit=filters['per_page'], offset=offset,
+            status=filters['status'] or None, jira_key=filters['key'] or None,
+        )
+        return stories, ({'offset': next_offset} if next_offset is not None else None)
+
+    stories, next_cursor = db_manager.list_user_stories(
+        limit=filters['per_page'], after=_decode_cursor(request.args.get('after')),
+        status=filters['status'] or None, jira_key=filters['key'] or None,
+    )
+    return stories, ({'after': _encode_cursor(next_cursor)} if next_cursor else None)
+
+
+def _page_url(endpoint, filters, page_params):
+    params = {name: value for name, value in filters.items() if value and name != 'per_page'}
+    if filters['per_page'] != WEB_PAGE_SIZE:
+        params['per_page'] = filters['per_page']
+    return url_for(endpoint, **params, **page_params)
+
 
 @app.route('/')
 def index():
-    """Página inicial - lista todas as histórias de usuário."""
-    user_stories = db_manager.get_all_user_stories()
-    print(f"Histórias de usuário recuperadas: {user_stories}")
-    print(f"Histórias enviadas para o template: {user_stories}")
-    return render_template('index.html', user_stories=user_stories)
+    """Página inicial - lista as histórias de usuário, com filtros, busca e paginação."""
+    filters = _story_filters()
+    user_stories, next_page = _fetch_story_page(filters)
+    return render_template(
+        'index.html',
+        user_stories=user_stories,
+        filters=filters,
+        statuses=db_manager.get_story_statuses(),
+        next_url=_page_url('index', filters, next_page) if next_page else None,
+        is_first_page=not (request.args.get('after') or request.args.get('offset', 0, type=int)),
+    )
+
+
+@app.route('/api/stories')
+def api_stories():
+    """Mesma listagem/busca da página inicial, em JSON."""
+    filters = _story_filters()
+    user_stories, next_page = _fetch_story_page(filters)
+    return jsonify({
+        'stories': user_stories,
+        'next_url': _page_url('api_stories', filters, next_page) if next_page else None,
+    })
+
+def _story_validators(story, test_cases_version, generation_status=None):
+    """
+    ETag e Last-Modified da página da história, calculados sem ler o conteúdo
+    dos casos de teste nem renderizar o template.
+    """
+    count, last_id, last_generated_at = test_cases_version
+    fingerprint = repr((
+        story['id'], story['jira_key'], story['title'], story['description'],
+        story['status'], story['created_at'], count, last_id, last_generated_at, generation_status,
+    ))
+    etag = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+    timestamps = [value for value in (story['created_at'], last_generated_at) if value]
+    last_modified = None
+    if timestamps:
+        try:
+            # CURRENT_TIMESTAMP do SQLite é gravado em UTC
+            last_modified = datetime.strptime(max(timestamps), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return etag, last_modified
+
 
 @app.route('/story/<int:story_id>')
 def view_story(story_id):
@@ -39,29 +183,113 @@ def view_story(story_id):
         flash('História não encontrada', 'error')
         return redirect(url_for('index'))
 
-    start_time = time.time()
-    test_cases = db_manager.get_test_cases_for_story(story_id)
-    end_time = time.time()
-    print(f"Recuperação dos casos de teste executada em {end_time - start_time:.2f} segundos.")
-
-    # Converte o conteúdo Markdown dos casos de teste para HTML
-    for test_case in test_cases:
-        # Sanitiza o HTML para evitar XSS
-        test_case['content_html'] = bleach.clean(
-            markdown.markdown(test_case['content']),
-            tags=['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'ul', 'ol', 'li', 
-                  'strong', 'em', 'a', 'code', 'pre', 'blockquote', 'table', 
-                  'thead', 'tbody', 'tr', 'th', 'td'],
-            attributes={'a': ['href', 'title']}
-        )
+    # Visitas repetidas sem alterações recebem 304 antes de qualquer renderização
+    progress = db_manager.get_generation_progress(story_id)
+    etag, last_modified = _story_validators(
+        story, db_manager.get_test_cases_version(story_id), progress['status'] if progress else None
+    )
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = app.response_class(status=304)
+    else:
+        test_cases = db_manager.get_test_cases_for_story(story_id)
+        scenarios = db_manager.get_scenarios_for_story(story_id)
+        for test_case in test_cases:
+            # Cenários estruturados; casos de teste antigos, em texto livre, usam o HTML
+            # sanitizado gravado junto com eles (ou renderizado uma vez e mantido em cache)
+            test_case['scenarios'] = scenarios.get(test_case['id'])
+            if not test_case['scenarios']:
+                test_case['content_html'] = html_for_test_case(test_case)
+        response = app.make_response(render_template(
+            'story.html', story=story, test_cases=test_cases,
+            generating=progress is not None and progress['status'] == 'streaming',
+        ))
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # O navegador guarda a página, mas revalida a cada visita
+    response.cache_control.no_cache = True
+    return response
 
-    render_start_time = time.time()
-    response = render_template('story.html', story=story, test_cases=test_cases)
-    render_end_time = time.time()
-    print(f"Renderização do template executada em {render_end_time - render_start_time:.2f} segundos.")
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/story/<int:story_id>/stream')
+def stream_story(story_id):
+    """
+    Server-sent events com o texto parcial da geração em streaming da história.
+    Eventos: "snapshot" (texto até o momento, enviado ao conectar), "delta"
+    (trecho novo), "done" (geração concluída ou inexistente) e "failed".
+    """
+    def events():
+        sent = None
+        deadline = time.monotonic() + WEB_SSE_MAX_SECONDS
+        while time.monotonic() < deadline:
+            progress = db_manager.get_generation_progress(story_id)
+            if progress is None:
+                yield _sse('done', {})
+                return
+            content = progress['content']
+            if sent is None or len(content) < sent:
+                # Primeira leitura, ou a geração recomeçou
+                yield _sse('snapshot', content)
+            elif len(content) > sent:
+                yield _sse('delta', content[sent:])
+            sent = len(content)
+            if progress['status'] == 'failed':
+                yield _sse('failed', {})
+                return
+            time.sleep(WEB_SSE_POLL_INTERVAL)
+        # O navegador reconecta sozinho e recebe um novo snapshot
 
+    response = app.response_class(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
     return response
 
+
+def _webhook_authorized(body):
+    """
+    Confere o segredo do webhook: assinatura HMAC-SHA256 do corpo no cabeçalho
+    X-Hub-Signature (webhooks com segredo do Jira) ou, para instâncias que não
+    assinam as entregas, o parâmetro `token` da URL cadastrada.
+    """
+    signature = request.headers.get('X-Hub-Signature', '')
+    if signature:
+        expected = 'sha256=' + hmac.new(JIRA_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+    return hmac.compare_digest(request.args.get('token', ''), JIRA_WEBHOOK_SECRET)
+
+
+@app.route('/webhooks/jira', methods=['POST'])
+def jira_webhook():
+    """
+    Recebe os eventos de issue criada/atualizada do Jira e enfileira a história
+    para processamento imediato. Reenvios da mesma entrega
+    (X-Atlassian-Webhook-Identifier) são ignorados.
+    """
+    if not JIRA_WEBHOOK_SECRET:
+        return jsonify({'error': 'webhook desativado'}), 404
+    body = request.get_data()
+    if not _webhook_authorized(body):
+        return jsonify({'error': 'assinatura inválida'}), 401
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return jsonify({'error': 'JSON inválido'}), 400
+
+    story = story_from_webhook(payload, JIRA_PROJECT_KEY, JIRA_STATUS)
+    if story is None:
+        return jsonify({'status': 'ignored'}), 200
+    delivery_id = request.headers.get('X-Atlassian-Webhook-Identifier') or hashlib.sha256(body).hexdigest()
+    with db_manager.transaction():
+        if not db_manager.record_webhook_delivery(delivery_id):
+            return jsonify({'status': 'duplicate'}), 200
+        db_manager.enqueue_job(JOB_STORY, story, dedupe_key=f"story:{story['key']}:{story['updated']}")
+    return jsonify({'status': 'queued'}), 202
+
+
 @app.route('/delete_story/<int:story_id>', methods=['DELETE'])
 def delete_story(story_id):
     """
@@ -71,9 +299,38 @@ def delete_story(story_id):
         db_manager.delete_user_story(story_id)
         return '', 204  # Retorna sucesso sem conteúdo
     except Exception as e:
-        print(f"Erro ao excluir história: {e}")
+        logger.error("Erro ao excluir história: %s", e)
         return str(e), 500
 
+@app.route('/health')
+def health():
+    """Estado dos processos do agente (sinais de vida gravados no banco), em JSON."""
+    return jsonify(health_summary(db_manager))
+
+
+@app.route('/status')
+def status_page():
+    return render_template('status.html', health=health_summary(db_manager))
+
+
+@app.route('/metrics')
+def metrics():
+    """Métricas deste processo no formato de exposição do Prometheus."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/debug/profile', methods=['GET', 'POST'])
+def debug_profile():
+    """
+    GET: funções mais custosas nas requisições amostradas pelo perfilador.
+    POST ?rate=0.05: altera a fração de requisições perfiladas (0 desliga); ?reset=1 limpa o acumulado.
+    Exige o cabeçalho X-Profile-Token com o valor de PROFILE_ADMIN_TOKEN.
+    """
+    status, body = handle_profile_request(request.method, request.args.to_dict(),
+                                          request.headers.get('X-Profile-Token'))
+    return Response(body, status=status, content_type="text/plain; charset=utf-8")
+
+
 @app.template_filter('format_datetime')
 def format_datetime(value, format='%d/%m/%Y %H:%M'):
     """Filtro para formatar timestamps no template."""
@@ -87,16 +344,24 @@ def format_datetime(value, format='%d/%m/%Y %H:%M'):
     return ''
 
 if __name__ == '__main__':
+    configure_logging()
+
     # Cria as pastas de templates e static se não existirem
     os.makedirs(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates'), exist_ok=True)
     os.makedirs(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static'), exist_ok=True)
 
-    # Inicia o agente em uma thread daemon
+    # Inicia o agente em uma thread daemon. Desative (WEB_START_AGENT=0) quando o
+    # agente rodar em processo próprio, por exemplo `main.py --workers N`
     def start_agent_background():
+        # Importado só aqui: as páginas não dependem do agente nem dos clientes do Jira e da OpenAI
+        from main import QAAgent
+
         agent = QAAgent()
         agent.start_monitoring()
 
-    agent_thread = threading.Thread(target=start_agent_background, daemon=True)
-    agent_thread.start()
+    if os.getenv("WEB_START_AGENT", "1") == "1":
+        agent_thread = threading.Thread(target=start_agent_background, daemon=True)
+        agent_thread.start()
     
-    app.run(debug=False, host='0.0.0.0', port=5003)
+    app.run(debug=False, host=os.getenv("WEB_HOST", "0.0.0.0"), port=int(os.getenv("WEB_PORT", "5003")),
+            threaded=True)
@@ -0,0 +1,193 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import asyncio
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from db_manager import DBManager
+from jira_client import AsyncJiraClient
+from openai_client import AsyncOpenAIClient
+from threaded_clients import iterate_in_thread
+
+
+class FakeServices:
+    """Responde às rotas do Jira e da OpenAI usadas pelos clientes assíncronos."""
+
+    def __init__(self, total_issues=3, max_results=None):
+        self.total_issues = total_issues
+        # Limite do servidor para maxResults (o Jira pode devolver menos que o pedido)
+        self.max_results = max_results
+        self.bulk_payloads = []
+        self.completions = 0
+        # Cabeçalhos de cota devolvidos pela OpenAI
+        self.openai_headers = {}
+
+    def handler(self, request):
+        path = request.url.path
+        if path == "/rest/api/2/search":
+            start = int(request.url.params["startAt"])
+            size = min(int(request.url.params["maxResults"]), self.max_results or self.total_issues)
+            keys = range(start + 1, min(start + size, self.total_issues) + 1)
+            return httpx.Response(200, json={"total": self.total_issues, "issues": [
+                {"key": f"KCA-{n}", "fields": {"summary": f"US {n}", "description": None,
+                                                "status": {"name": "To Do"}}}
+                for n in keys
+            ]})
+        if path == "/rest/api/2/search/jql":
+            start = int(request.url.params.get("nextPageToken", "0"))
+            size = int(request.url.params["maxResults"])
+            end = min(start + size, self.total_issues)
+            page = {"isLast": end >= self.total_issues, "issues": [
+                {"key": f"KCA-{n}", "fields": {"summary": f"US {n}", "status": {"name": "To Do"}}}
+                for n in range(start + 1, end + 1)
+            ]}
+            if end < self.total_issues:
+                page["nextPageToken"] = str(end)
+            return httpx.Response(200, json=page)
+        if path.startswith("/rest/api/2/issue/KCA-"):
+            return httpx.Response(200, json={"fields": {"project": {"key": "KCA"}}})
+        if path == "/rest/api/2/project/KCA":
+            return httpx.Response(200, json={"issueTypes": [{"id": "10003", "name": "Sub-task"}]})
+        if path == "/rest/api/2/issue/bulk":
+            payload = json.loads(request.content)
+            self.bulk_payloads.append(payload)
+            return httpx.Response(201, json={"errors": [], "issues": [
+                {"id": str(i), "key": f"KCA-{100 + i}"} for i, _ in enumerate(payload["issueUpdates"])
+            ]})
+        if path.endswith("/chat/completions"):
+            self.completions += 1
+            return httpx.Response(200, headers=self.openai_headers, json={
+                "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                    "role": "assistant",
+                    "content": "Cenário: Sucesso\nDado que...\nCenário: Falha\nDado que...",
+                }}],
+            })
+        return httpx.Response(404)
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+
+
+class TestAsyncJiraClient(unittest.TestCase):
+
+    def setUp(self):
+        os.environ["JIRA_SERVER"] = "https://fake-jira-server.com"
+        self.services = FakeServices(total_issues=5)
+
+    def test_iter_user_stories_paginates(self):
+        async def scenario():
+            async with self.services.client() as http:
+                jira = AsyncJiraClient(http_client=http)
+                return [story["key"] async for story in jira.iter_user_stories("KCA", page_size=2)]
+        self.assertEqual(asyncio.run(scenario()), [f"KCA-{n}" for n in range(1, 6)])
+
+    def test_short_pages_do_not_end_pagination(self):
+        self.services.max_results = 2
+
+        async def scenario():
+            async with self.services.client() as http:
+                jira = AsyncJiraClient(http_client=http)
+                return [story["key"] async for story in jira.iter_user_stories("KCA", page_size=4)]
+        self.assertEqual(asyncio.run(scenario()), [f"KCA-{n}" for n in range(1, 6)])
+
+    def test_iter_user_stories_uses_page_token_on_cloud(self):
+        os.environ["JIRA_SERVER"] = "https://empresa.atlassian.net"
+        self.addCleanup(os.environ.__setitem__, "JIRA_SERVER", "https://fake-jira-server.com")
+
+        async def scenario():
+            async with self.services.client() as http:
+                jira = AsyncJiraClient(http_client=http)
+                return [story["key"] async for story in jira.iter_user_stories("KCA", page_size=2)]
+        self.assertEqual(asyncio.run(scenario()), [f"KCA-{n}" for n in range(1, 6)])
+
+    def test_create_subtasks_uses_bulk_endpoint(self):
+        async def scenario():
+            async with self.services.client() as http:
+                jira = AsyncJiraClient(http_client=http)
+                return await jira.create_subtasks("KCA-1", [("A", "a"), ("B", "b")])
+        created = asyncio.run(scenario())
+        self.assertEqual([issue["key"] for issue in created], ["KCA-100", "KCA-101"])
+        self.assertEqual(len(self.services.bulk_payloads), 1)
+
+
+class TestAsyncOpenAIClient(unittest.TestCase):
+
+    def test_quota_headers_pause_the_limiter(self):
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        services = FakeServices()
+        services.openai_headers = {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "10ms"}
+
+        async def scenario():
+            async with services.client() as http:
+                openai_client = AsyncOpenAIClient(http_client=http)
+                before = openai_client.limiter.bucket._blocked_until
+                await openai_client.generate_test_cases("Título: Login")
+                return openai_client.limiter.bucket._blocked_until > before
+
+        self.assertTrue(asyncio.run(scenario()))
+
+
+class TestThreadedClients(unittest.TestCase):
+
+    def test_iterate_in_thread_closes_generator(self):
+        closed = []
+
+        def paginas():
+            try:
+                yield from range(10)
+            finally:
+                closed.append(True)
+
+        async def consumir():
+            itens = []
+            iterator = iterate_in_thread(paginas())
+            async for item in iterator:
+                itens.append(item)
+                if len(itens) == 3:
+                    break
+            await iterator.aclose()
+            return itens
+
+        self.assertEqual(asyncio.run(consumir()), [0, 1, 2])
+        self.assertEqual(closed, [True])
+
+
+class TestAsyncAgentCycle(unittest.TestCase):
+
+    def setUp(self):
+        os.environ["JIRA_SERVER"] = "https://fake-jira-server.com"
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp_dir.name, 'qa_agent.db')
+        patchers = [
+            patch('main.JiraClient'),
+            patch('main.DBManager', lambda: DBManager(db_path=db_path)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        from main import QAAgent
+        self.agent = QAAgent(use_async=True)
+        self.services = FakeServices(total_issues=4)
+
+    def tearDown(self):
+        self.agent.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_async_cycle_processes_all_stories(self):
+        with patch('main.create_async_http_client', self.services.client):
+            self.agent.run_cycle()
+        self.assertEqual(self.services.completions, 4)
+        self.assertEqual(len(self.services.bulk_payloads), 4)
+        self.assertEqual(len(self.agent.db_manager.get_all_user_stories()), 4)
+        self.assertIsNotNone(self.agent.db_manager.get_last_watermark(self.agent.project_key))
+
+
+if __name__ == "__main__":
+    unittest.main()
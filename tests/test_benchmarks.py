@@ -0,0 +1,48 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../benchmarks')))
+import json
+import tempfile
+import unittest
+
+import run_benchmarks
+from fake_services import FakeJiraServer, FakeOpenAIServer, ServiceProfile
+
+
+class TestFakeServices(unittest.TestCase):
+
+    def test_agent_runs_against_fake_services(self):
+        args = run_benchmarks.parse_args([
+            "--stories", "5", "--repeat", "1", "--jira-latency", "0", "--openai-latency", "0",
+        ])
+        for use_async in (False, True):
+            result = run_benchmarks.bench_agent(args, use_async)
+            # Três cenários por história, criados pelo endpoint de criação em lote
+            self.assertEqual(result["subtasks_created"], 15)
+            self.assertEqual(result["openai_requests"]["chat.completions"], 5)
+
+    def test_injected_errors_carry_retry_after(self):
+        import httpx
+        profile = ServiceProfile(error_rate=1.0, retry_after=0.5)
+        with FakeOpenAIServer(profile=profile) as openai, FakeJiraServer(3) as jira:
+            response = httpx.post(f"{openai.url}/v1/chat/completions", json={"model": "gpt-4o-mini"})
+            self.assertIn(response.status_code, (429, 503))
+            self.assertEqual(response.headers["Retry-After"], "0.5")
+            # O handshake do cliente do Jira nunca falha
+            self.assertEqual(httpx.get(f"{jira.url}/rest/api/2/serverInfo").status_code, 200)
+
+    def test_compare_flags_regressions(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for name, seconds in (("base", 1.0), ("atual", 1.5)):
+                path = os.path.join(tmp_dir, f"{name}.json")
+                with open(path, "w") as f:
+                    json.dump({"revision": name, "results": {"db.1000.get_user_story": {"seconds": seconds}}}, f)
+                paths.append(path)
+            self.assertEqual(run_benchmarks.compare(*paths, threshold=0.1), ["db.1000.get_user_story"])
+            self.assertEqual(run_benchmarks.compare(*paths, threshold=0.6), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,12 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 from db_manager import DBManager
+from scenarios import Scenario
+import sqlite3
+import tempfile
+import threading
 import unittest
+from unittest.mock import patch
 
 class TestDBManager(unittest.TestCase):
 
@@ -43,5 +48,276 @@ class TestDBManager(unittest.TestCase):
         test_case_id_2 = self.db_manager.save_test_cases(user_story_id, content_2)
         self.assertNotEqual(test_case_id_1, test_case_id_2)
 
+
+class TestDBManagerConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_wal_mode_enabled(self):
+        mode = self.db_manager.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_transaction_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.db_manager.transaction() as cursor:
+                cursor.execute(
+                    "INSERT INTO user_stories (jira_key, title, description, status) VALUES (?, ?, ?, ?)",
+                    ("KCA-1", "T", "D", "To Do")
+                )
+                raise RuntimeError("falha")
+        self.assertEqual(self.db_manager.get_all_user_stories(), [])
+
+    def test_concurrent_reads_and_writes(self):
+        errors = []
+
+        def writer(worker):
+            try:
+                for i in range(50):
+                    story_id = self.db_manager.save_user_story(f"KCA-{worker}-{i}", "T", "D", "To Do")
+                    self.db_manager.save_test_cases(story_id, f"conteudo {i}")
+            except Exception as e:
+                errors.append(e)
+
+        def reader():
+            try:
+                for _ in range(50):
+                    self.db_manager.get_all_user_stories()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+        threads += [threading.Thread(target=reader) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.db_manager.get_all_user_stories()), 200)
+    def test_bulk_upsert_user_stories(self):
+        stories = [
+            {"jira_key": f"KCA-{i}", "title": f"T{i}", "description": "D", "status": "To Do"}
+            for i in range(1200)
+        ]
+        story_ids = self.db_manager.bulk_upsert_user_stories(stories)
+        self.assertEqual(len(story_ids), 1200)
+
+        stories[0]["title"] = "Atualizada"
+        again = self.db_manager.bulk_upsert_user_stories(stories[:2])
+        self.assertEqual(again, {"KCA-0": story_ids["KCA-0"], "KCA-1": story_ids["KCA-1"]})
+        self.assertEqual(self.db_manager.get_user_story(story_ids["KCA-0"])["title"], "Atualizada")
+        self.assertEqual(self.db_manager.save_user_story("KCA-5", "T", "D", "Done"), story_ids["KCA-5"])
+
+    def test_bulk_save_test_cases(self):
+        story_ids = self.db_manager.bulk_upsert_user_stories(
+            {"jira_key": f"KCA-{i}", "title": "T", "description": "D", "status": "To Do"} for i in range(3)
+        )
+        first = self.db_manager.save_test_cases(story_ids["KCA-0"], "Cenário A")
+        ids = self.db_manager.bulk_save_test_cases([
+            (story_ids["KCA-0"], "Cenário A"),
+            (story_ids["KCA-1"], "Cenário A"),
+            (story_ids["KCA-1"], "Cenário A"),
+        ])
+        self.assertEqual(ids[0], first)
+        self.assertEqual(ids[1], ids[2])
+        self.assertNotEqual(ids[0], ids[1])
+        self.assertEqual(
+            self.db_manager.get_story_ids_with_test_cases(story_ids.values()),
+            {story_ids["KCA-0"], story_ids["KCA-1"]}
+        )
+
+
+class TestDBManagerListing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        self.ids = self.db_manager.bulk_upsert_user_stories(
+            {
+                "jira_key": f"KCA-{i}",
+                "title": f"Login {i}" if i % 2 else f"Cadastro {i}",
+                "description": "Descrição da operação",
+                "status": "Done" if i % 3 == 0 else "To Do",
+            }
+            for i in range(1, 26)
+        )
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_keyset_pagination_walks_all_stories(self):
+        keys, cursor = [], None
+        while True:
+            page, cursor = self.db_manager.list_user_stories(limit=10, after=cursor)
+            keys.extend(story["jira_key"] for story in page)
+            if cursor is None:
+                break
+        self.assertEqual(keys, [f"KCA-{i}" for i in range(25, 0, -1)])
+        self.assertNotIn("description", page[0])
+
+    def test_status_and_key_filters(self):
+        page, _ = self.db_manager.list_user_stories(status="Done", jira_key="kca-1")
+        self.assertEqual([story["jira_key"] for story in page], ["KCA-18", "KCA-15", "KCA-12"])
+        self.assertEqual(self.db_manager.get_story_statuses(), ["Done", "To Do"])
+
+    def test_search_covers_titles_descriptions_and_test_cases(self):
+        self.db_manager.save_test_cases(self.ids["KCA-4"], "Cenário: Autenticação biométrica")
+        found, _ = self.db_manager.search_user_stories("biometrica")
+        self.assertEqual([story["jira_key"] for story in found], ["KCA-4"])
+        found, next_offset = self.db_manager.search_user_stories("operação", limit=20)
+        self.assertEqual((len(found), next_offset), (20, 20))
+        # Sintaxe do FTS5 digitada pelo usuário não gera erro
+        self.assertEqual(self.db_manager.search_user_stories('login" (')[0][0]["title"][:5], "Login")
+
+    def test_search_index_follows_updates_and_deletes(self):
+        self.db_manager.save_user_story("KCA-2", "Recuperar senha", "Descrição", "To Do")
+        self.assertEqual([s["jira_key"] for s in self.db_manager.search_user_stories("senha")[0]], ["KCA-2"])
+        self.assertNotIn("KCA-2", [s["jira_key"] for s in self.db_manager.search_user_stories("cadastro 2")[0]])
+        self.db_manager.delete_user_story(self.ids["KCA-2"])
+        self.assertEqual(self.db_manager.search_user_stories("senha")[0], [])
+
+    def test_test_case_html_is_rendered_on_save(self):
+        story_id = self.ids["KCA-1"]
+        self.db_manager.save_test_cases(story_id, "**Cenário**: <img src=x onerror=alert(1)>")
+        self.db_manager.bulk_save_test_cases([(story_id, "# Cenário B")])
+        html = {tc["content"]: tc["content_html"] for tc in self.db_manager.get_test_cases_for_story(story_id)}
+        self.assertIn("<strong>Cenário</strong>", html["**Cenário**: <img src=x onerror=alert(1)>"])
+        self.assertNotIn("<img", html["**Cenário**: <img src=x onerror=alert(1)>"])
+        self.assertEqual(html["# Cenário B"], "<h1>Cenário B</h1>")
+
+    def test_scenarios_are_stored_per_test_case(self):
+        story_id = self.ids["KCA-1"]
+        scenarios = [Scenario("Login", ["Conta ativa"], ["Informar senha"], "Acesso"), Scenario("Bloqueio")]
+        first = self.db_manager.save_test_cases(story_id, "### Cenário: Login", scenarios)
+        # Conteúdo duplicado não grava os cenários novamente
+        self.assertEqual(self.db_manager.save_test_cases(story_id, "### Cenário: Login", scenarios), first)
+        second, legacy = self.db_manager.bulk_save_test_cases([
+            (story_id, "### Cenário: Outro", [Scenario("Outro")]),
+            (story_id, "Cenário: texto livre"),
+        ])
+        self.assertEqual(self.db_manager.get_scenarios_for_story(story_id), {
+            first: scenarios, second: [Scenario("Outro")],
+        })
+        self.assertNotIn(legacy, self.db_manager.get_scenarios_for_story(story_id))
+
+    def test_stories_pending_generation(self):
+        self.db_manager.save_test_cases(self.ids["KCA-1"], "Cenário: A")
+        pending = self.db_manager.get_stories_without_test_cases(limit=2)
+        self.assertEqual([story["jira_key"] for story in pending], ["KCA-2", "KCA-3"])
+        found = self.db_manager.get_user_stories_by_keys(["KCA-3", "KCA-99"])
+        self.assertEqual(list(found), ["KCA-3"])
+        self.assertEqual(found["KCA-3"]["id"], self.ids["KCA-3"])
+
+    def test_story_changes_are_tracked(self):
+        story = {"jira_key": "KCA-1", "title": "Login 1", "description": "Descrição da operação",
+                 "status": "To Do", "jira_updated": "2024-01-02T10:00:00.000+0000"}
+        self.db_manager.bulk_upsert_user_stories([story])
+        self.assertEqual(self.db_manager.get_story_ids_with_test_cases([self.ids["KCA-1"]]), set())
+        self.db_manager.save_test_cases(self.ids["KCA-1"], "Cenário: A")
+        self.assertEqual(self.db_manager.get_story_ids_with_test_cases([self.ids["KCA-1"]]), {self.ids["KCA-1"]})
+
+        state = self.db_manager.get_story_sync_states(["KCA-1", "KCA-99"])
+        self.assertEqual(list(state), ["KCA-1"])
+        self.assertEqual(state["KCA-1"]["jira_updated"], story["jira_updated"])
+        self.assertEqual(state["KCA-1"]["generated_hash"], state["KCA-1"]["content_hash"])
+
+        # Nova descrição: os casos de teste existentes deixam de ser atuais
+        self.db_manager.bulk_upsert_user_stories([dict(story, description="Nova descrição")])
+        self.assertEqual(self.db_manager.get_story_ids_with_test_cases([self.ids["KCA-1"]]), set())
+        self.assertIn("KCA-1", [s["jira_key"] for s in self.db_manager.get_stories_without_test_cases()])
+        # Mudança apenas de status mantém os casos de teste atuais
+        self.db_manager.save_test_cases(self.ids["KCA-1"], "Cenário: B")
+        self.db_manager.bulk_upsert_user_stories([dict(story, description="Nova descrição", status="Done")])
+        self.assertEqual(self.db_manager.get_story_ids_with_test_cases([self.ids["KCA-1"]]), {self.ids["KCA-1"]})
+
+    def test_like_fallback_without_fts5(self):
+        self.db_manager.full_text_search = False
+        found, _ = self.db_manager.search_user_stories("Login 2", status="To Do")
+        self.assertEqual([story["jira_key"] for story in found], ["KCA-25", "KCA-23"])
+
+    def test_subtask_claims_are_idempotent(self):
+        claims = self.db_manager.claim_subtasks("KCA-1", ["a", "b", "a"], lease_seconds=300)
+        self.assertEqual(claims, {"a": None, "b": None})
+        # Reservadas por outro processo: ficam de fora até a reserva expirar
+        self.assertEqual(self.db_manager.claim_subtasks("KCA-1", ["a", "b"], lease_seconds=300), {})
+
+        self.db_manager.finish_subtasks("KCA-1", {"a": "KCA-100", "b": None})
+        self.assertEqual(self.db_manager.get_keys_with_unpublished_subtasks(["KCA-1", "KCA-2"]), {"KCA-1"})
+        claims = self.db_manager.claim_subtasks("KCA-1", ["a", "b"], lease_seconds=300)
+        self.assertEqual(claims, {"a": "KCA-100", "b": None})
+        self.assertEqual(self.db_manager.claim_subtasks("KCA-1", ["b"], lease_seconds=0), {"a": "KCA-100", "b": None})
+
+        self.assertEqual(self.db_manager.discard_unpublished_subtasks("KCA-1", ["c"]), 1)
+        self.assertEqual(self.db_manager.get_keys_with_unpublished_subtasks(["KCA-1"]), set())
+
+
+class TestDBManagerMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'qa_agent.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_legacy_database_is_upgraded_in_place(self):
+        # Esquema original, sem controle de versão e com casos de teste duplicados
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(
+            """
+            CREATE TABLE user_stories (id INTEGER PRIMARY KEY AUTOINCREMENT, jira_key TEXT NOT NULL,
+                title TEXT NOT NULL, description TEXT NOT NULL, status TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(jira_key));
+            CREATE TABLE test_cases (id INTEGER PRIMARY KEY AUTOINCREMENT, user_story_id INTEGER NOT NULL,
+                content TEXT NOT NULL, generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE sync_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, sync_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+            INSERT INTO user_stories (jira_key, title, description, status) VALUES ('KCA-1', 'T', 'D', 'To Do');
+            INSERT INTO test_cases (user_story_id, content) VALUES (1, 'Cenário A');
+            INSERT INTO test_cases (user_story_id, content) VALUES (1, 'Cenário A');
+            INSERT INTO test_cases (user_story_id, content) VALUES (1, 'Cenário B');
+            """
+        )
+        conn.commit()
+        conn.close()
+
+        db_manager = DBManager(db_path=self.db_path)
+        try:
+            version = db_manager.conn.execute("PRAGMA user_version").fetchone()[0]
+            self.assertEqual(version, len(DBManager.MIGRATIONS))
+            test_cases = db_manager.get_test_cases_for_story(1)
+            self.assertEqual(len(test_cases), 2)
+            self.assertTrue(all(test_case["content_hash"] for test_case in test_cases))
+            self.assertEqual(db_manager.save_test_cases(1, 'Cenário B'), min(tc["id"] for tc in test_cases if tc["content"] == 'Cenário B'))
+            plan = db_manager.conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM test_cases WHERE user_story_id = ? ORDER BY generated_at DESC",
+                (1,)
+            ).fetchall()
+            self.assertIn("idx_test_cases_story_generated", " ".join(row["detail"] for row in plan))
+            # Registros antigos não têm HTML gravado; ele é gerado na exibição
+            self.assertTrue(all(test_case["content_html"] is None for test_case in test_cases))
+            # O índice de busca é preenchido com o conteúdo já existente
+            self.assertEqual([s["jira_key"] for s in db_manager.search_user_stories("cenario b")[0]], ["KCA-1"])
+            # Histórias com casos de teste existentes são consideradas atuais
+            self.assertEqual(db_manager.get_story_ids_with_test_cases([1]), {1})
+        finally:
+            db_manager.close()
+
+        # Reabrir não reaplica migrações
+        DBManager(db_path=self.db_path).close()
+
+    def test_current_schema_skips_initialization(self):
+        DBManager(db_path=self.db_path).close()
+        with patch.object(DBManager, 'transaction') as transaction:
+            db_manager = DBManager(db_path=self.db_path)
+            db_manager.close()
+        transaction.assert_not_called()
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,110 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from db_manager import DBManager
+from health import HEARTBEAT_STALL_SECONDS, HEARTBEAT_TIMEOUT, STATUS_IDLE, Heartbeat, health_summary
+from supervisor import ManagedProcess, Supervisor
+import web_app
+
+
+class TestHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def record(self, process_id, role, last_seen, progress_at, status):
+        self.db_manager.record_heartbeat(process_id, role, 1, last_seen, progress_at, status)
+        self.db_manager.conn.execute(
+            "UPDATE process_heartbeats SET last_seen = ? WHERE process_id = ?", (last_seen, process_id))
+
+    def test_heartbeat_records_progress_and_stop(self):
+        with Heartbeat(self.db_manager, "agent", interval=0.01) as heartbeat:
+            heartbeat.progress("ciclo", "KCA-1")
+            time.sleep(0.05)
+            row, = self.db_manager.get_heartbeats()
+            self.assertEqual(row["status"], "ciclo")
+            self.assertEqual(row["detail"], "KCA-1")
+            self.assertEqual(health_summary(self.db_manager)["status"], "ok")
+        row, = self.db_manager.get_heartbeats()
+        self.assertEqual(row["status"], "encerrado")
+        self.assertEqual(health_summary(self.db_manager)["status"], "desconhecido")
+
+    def test_summary_detects_dead_and_stalled_processes(self):
+        now = time.time()
+        self.record("agent@a:1", "agent", now, now - HEARTBEAT_STALL_SECONDS - 1, "ciclo")
+        self.record("worker@a:2", "worker", now, now - HEARTBEAT_STALL_SECONDS - 1, STATUS_IDLE)
+        summary = health_summary(self.db_manager, now)
+        states = {process["process_id"]: process["state"] for process in summary["processes"]}
+        self.assertEqual(states, {"agent@a:1": "travado", "worker@a:2": "ok"})
+        self.assertEqual(summary["status"], "degradado")
+
+        # Um processo reiniciado deixa o registro antigo sem sinal; o papel segue saudável
+        self.record("agent@a:3", "agent", now, now, STATUS_IDLE)
+        self.record("agent@a:1", "agent", now - HEARTBEAT_TIMEOUT - 1, now, "ciclo")
+        self.assertEqual(health_summary(self.db_manager, now)["status"], "ok")
+
+        self.record("agent@a:3", "agent", now - HEARTBEAT_TIMEOUT - 1, now, STATUS_IDLE)
+        self.assertEqual(health_summary(self.db_manager, now)["status"], "parado")
+
+    def test_health_routes(self):
+        now = time.time()
+        self.record("agent@a:1", "agent", now, now, STATUS_IDLE)
+        with patch.object(web_app, 'db_manager', self.db_manager):
+            client = web_app.app.test_client()
+            response = client.get('/health')
+            self.assertEqual(response.get_json()["status"], "ok")
+            page = client.get('/status').get_data(as_text=True)
+        self.assertIn("agent@a:1", page)
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def test_process_restarts_with_backoff(self):
+        process = ManagedProcess("falha", [sys.executable, "-c", "import sys; sys.exit(3)"])
+        self.assertTrue(process.check(0.0))
+        process.process.wait()
+        now = process.started_at
+        self.assertFalse(process.check(now))
+        self.assertEqual(process.last_exit_code, 3)
+        self.assertEqual(process.next_start, now + 1)
+
+        self.assertFalse(process.check(now + 0.5))
+        self.assertTrue(process.check(now + 1))
+        process.process.wait()
+        process.check(process.started_at)
+        self.assertEqual(process.restarts, 2)
+        self.assertEqual(process.next_start - process.started_at, 2)
+
+    def test_supervisor_stops_processes(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_manager = DBManager(db_path=os.path.join(tmp_dir.name, 'qa_agent.db'))
+        self.addCleanup(db_manager.close)
+        process = ManagedProcess("dorme", [sys.executable, "-c", "import time; time.sleep(60)"])
+        stop_event = threading.Event()
+        thread = threading.Thread(target=Supervisor([process], db_manager, poll_interval=0.01).run,
+                                  args=(stop_event,))
+        thread.start()
+        while process.process is None:
+            time.sleep(0.01)
+        stop_event.set()
+        thread.join(10)
+        self.assertIsNotNone(process.process.poll())
+        row, = db_manager.get_heartbeats()
+        self.assertEqual(row["role"], "supervisor")
+        self.assertEqual(row["status"], "encerrado")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 import unittest
 from unittest.mock import patch, MagicMock
 from jira_client import JiraClient
-import os
+
+
+class ResultPage(list):
+    """Página de resultados da busca, como a ResultList do python-jira (com `total`)."""
+
 
 class TestJiraClientAPI(unittest.TestCase):
     def setUp(self):
@@ -9,33 +16,85 @@ class TestJiraClientAPI(unittest.TestCase):
         os.environ["JIRA_SERVER"] = "https://fake-jira-server.com"
         os.environ["JIRA_USERNAME"] = "fakeuser"
         os.environ["JIRA_API_TOKEN"] = "faketoken"
+        # O construtor do JIRA autentica no servidor; os testes não acessam a rede
+        patcher = patch("jira.JIRA")
+        self.mock_jira_class = patcher.start()
+        self.addCleanup(patcher.stop)
         self.jira_client = JiraClient()
+        self.mock_jira = self.jira_client.jira
 
-    @patch("jira.JIRA")
-    def test_conexao_jira(self, mock_jira):
+    def test_conexao_jira(self):
         # Testa se a conexão é estabelecida sem erro
-        mock_jira.return_value = MagicMock()
         try:
             client = JiraClient()
             self.assertIsNotNone(client.jira)
         except Exception as e:
             self.fail(f"Falha ao conectar: {e}")
 
-    @patch.object(JiraClient, 'jira')
-    def test_get_user_stories(self, mock_jira):
+    def test_conexao_aberta_no_primeiro_uso(self):
+        self.mock_jira_class.reset_mock()
+        client = JiraClient()
+        self.mock_jira_class.assert_not_called()
+        self.assertIs(client.jira, client.jira)
+        self.mock_jira_class.assert_called_once()
+
+    def test_quota_headers_pause_the_limiter(self):
+        import requests
+        hook = self.mock_jira._session.hooks["response"].append.call_args.args[0]
+        response = requests.Response()
+        response.headers.update({"X-RateLimit-Remaining": "0", "Retry-After": "0.01"})
+        before = self.jira_client.limiter.bucket._blocked_until
+        hook(response)
+        self.assertGreater(self.jira_client.limiter.bucket._blocked_until, before)
+
+    def test_get_user_stories(self):
+        mock_jira = self.mock_jira
         # Testa busca de user stories
         mock_issue = MagicMock()
         mock_issue.key = 'KCA-1'
         mock_issue.fields.summary = 'Teste'
         mock_issue.fields.description = 'Descrição'
         mock_issue.fields.status.name = 'To Do'
-        mock_jira.search_issues.return_value = [mock_issue]
+        mock_jira.search_issues.side_effect = [ResultPage([mock_issue]), ResultPage()]
         stories = self.jira_client.get_user_stories('KCA')
         self.assertEqual(len(stories), 1)
         self.assertEqual(stories[0]['key'], 'KCA-1')
 
-    @patch.object(JiraClient, 'jira')
-    def test_create_subtask(self, mock_jira):
+    def test_iter_user_stories_paginates(self):
+        mock_jira = self.mock_jira
+        # Testa a paginação da busca incremental
+        def make_issue(n):
+            issue = MagicMock()
+            issue.key = f'KCA-{n}'
+            issue.fields.description = None
+            return issue
+        def make_page(*numbers):
+            page = ResultPage(make_issue(n) for n in numbers)
+            page.total = 3
+            return page
+        # O servidor limita maxResults a 2: a página curta não encerra a busca
+        mock_jira.search_issues.side_effect = [make_page(1, 2), make_page(3)]
+        stories = list(self.jira_client.iter_user_stories('KCA', page_size=5))
+        self.assertEqual([s['key'] for s in stories], ['KCA-1', 'KCA-2', 'KCA-3'])
+        self.assertEqual(mock_jira.search_issues.call_args.kwargs['startAt'], 2)
+        self.assertIn('ORDER BY updated', mock_jira.search_issues.call_args.args[0])
+
+    def test_iter_user_stories_uses_page_token_on_cloud(self):
+        mock_jira = self.mock_jira
+        # No Jira Cloud a paginação segue o nextPageToken de cada página
+        mock_jira._is_cloud = True
+        issue = lambda n: {'key': f'KCA-{n}', 'fields': {'summary': 'US', 'status': {'name': 'To Do'}}}
+        mock_jira.enhanced_search_issues.side_effect = [
+            {'issues': [issue(1), issue(2)], 'nextPageToken': 'abc'},
+            {'issues': [issue(3)], 'isLast': True},
+        ]
+        stories = list(self.jira_client.iter_user_stories('KCA', page_size=2))
+        self.assertEqual([s['key'] for s in stories], ['KCA-1', 'KCA-2', 'KCA-3'])
+        self.assertEqual(mock_jira.enhanced_search_issues.call_args.kwargs['nextPageToken'], 'abc')
+        mock_jira.search_issues.assert_not_called()
+
+    def test_create_subtask(self):
+        mock_jira = self.mock_jira
         # Testa criação de subtarefa
         mock_parent = MagicMock()
         mock_parent.fields.project.key = 'KCA'
@@ -48,5 +107,31 @@ class TestJiraClientAPI(unittest.TestCase):
         result = self.jira_client.create_subtask('KCA-1', 'Cenário Teste', 'Descrição do cenário')
         self.assertIsNotNone(result)
 
+    def test_create_subtasks_bulk_uses_cached_metadata(self):
+        mock_jira = self.mock_jira
+        # Testa criação em lote reaproveitando projeto e tipo de issue em cache
+        mock_parent = MagicMock()
+        mock_parent.fields.project.key = 'KCA'
+        mock_issue_type = MagicMock()
+        mock_issue_type.name = 'Sub-task'
+        mock_issue_type.id = '10000'
+        mock_jira.issue.return_value = mock_parent
+        mock_jira.project.return_value.issueTypes = [mock_issue_type]
+        mock_jira.create_issues.side_effect = lambda field_list, prefetch: [
+            {'status': 'Success', 'issue': MagicMock(), 'error': None} for _ in field_list
+        ]
+        scenarios = [(f'Cenário {i}', 'Descrição') for i in range(3)]
+        for _ in range(2):
+            result = self.jira_client.create_subtasks('KCA-1', scenarios)
+            self.assertEqual(len(result), 3)
+        self.assertEqual(mock_jira.issue.call_count, 1)
+        self.assertEqual(mock_jira.project.call_count, 1)
+        self.assertEqual(mock_jira.create_issues.call_count, 2)
+        field_list = mock_jira.create_issues.call_args.kwargs['field_list']
+        self.assertEqual([fields['parent'] for fields in field_list], [{'key': 'KCA-1'}] * 3)
+        self.assertEqual(field_list[0]['issuetype'], {'id': '10000'})
+        self.assertFalse(mock_jira.create_issues.call_args.kwargs['prefetch'])
+        mock_jira.create_issue.assert_not_called()
+
 if __name__ == "__main__":
     unittest.main()
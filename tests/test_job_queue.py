@@ -0,0 +1,230 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from db_manager import DBManager
+from job_queue import JOB_FETCH, JOB_GENERATE, JOB_PUBLISH, JOB_STORY, JobWorker
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+import json
+import tempfile
+import threading
+import time
+import unittest
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_active_jobs_are_deduplicated(self):
+        self.assertTrue(self.db_manager.enqueue_job(JOB_GENERATE, {"story_id": 1}, dedupe_key="generate:KCA-1"))
+        self.assertFalse(self.db_manager.enqueue_job(JOB_GENERATE, {"story_id": 1}, dedupe_key="generate:KCA-1"))
+
+        job = self.db_manager.claim_job("w1", 60)
+        self.assertFalse(self.db_manager.enqueue_job(JOB_GENERATE, {"story_id": 1}, dedupe_key="generate:KCA-1"))
+        self.assertTrue(self.db_manager.complete_job(job["id"], "w1"))
+        # Após a conclusão a mesma chave pode ser enfileirada novamente
+        self.assertTrue(self.db_manager.enqueue_job(JOB_GENERATE, {"story_id": 1}, dedupe_key="generate:KCA-1"))
+
+    def test_each_job_is_claimed_by_one_worker(self):
+        self.db_manager.enqueue_jobs((JOB_GENERATE, {"n": n}, None) for n in range(50))
+        claimed = []
+        lock = threading.Lock()
+
+        def worker(name):
+            while True:
+                job = self.db_manager.claim_job(name, 60)
+                if job is None:
+                    return
+                with lock:
+                    claimed.append(job["payload"]["n"])
+
+        threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), list(range(50)))
+
+    def test_expired_lease_is_reclaimed_and_fenced(self):
+        self.db_manager.enqueue_job(JOB_PUBLISH, {"test_case_id": 1})
+        job = self.db_manager.claim_job("w1", 0.05)
+        self.assertIsNone(self.db_manager.claim_job("w2", 60))
+
+        time.sleep(0.1)
+        reclaimed = self.db_manager.claim_job("w2", 60)
+        self.assertEqual(reclaimed["id"], job["id"])
+        self.assertEqual(reclaimed["attempts"], 2)
+        # O primeiro processo perdeu a reserva e não altera mais o trabalho
+        self.assertFalse(self.db_manager.complete_job(job["id"], "w1"))
+        self.assertFalse(self.db_manager.extend_job_lease(job["id"], "w1", 60))
+        self.assertTrue(self.db_manager.complete_job(job["id"], "w2"))
+        self.assertEqual(self.db_manager.get_job_counts(), {"done": 1})
+
+    def test_expired_lease_after_last_attempt_fails_the_job(self):
+        self.db_manager.enqueue_job(JOB_PUBLISH, {"test_case_id": 1})
+        self.db_manager.claim_job("w1", 0.05, max_attempts=2)
+        time.sleep(0.1)
+        self.db_manager.claim_job("w2", 0.05, max_attempts=2)
+        time.sleep(0.1)
+        # Esgotadas as tentativas, o trabalho não volta a ser entregue
+        self.assertIsNone(self.db_manager.claim_job("w3", 60, max_attempts=2))
+        self.assertEqual(self.db_manager.get_job_counts(), {"failed": 1})
+
+    def test_failed_job_is_retried_until_max_attempts(self):
+        self.db_manager.enqueue_job(JOB_GENERATE, {"story_id": 1})
+        for attempt in range(1, 3):
+            job = self.db_manager.claim_job("w1", 60)
+            self.assertEqual(job["attempts"], attempt)
+            self.assertTrue(self.db_manager.fail_job(job["id"], "w1", RuntimeError("falhou"), 0, 2))
+        self.assertIsNone(self.db_manager.claim_job("w1", 60))
+        self.assertEqual(self.db_manager.get_job_counts(), {"failed": 1})
+
+    def test_retry_waits_for_delay(self):
+        self.db_manager.enqueue_job(JOB_GENERATE, {"story_id": 1})
+        job = self.db_manager.claim_job("w1", 60)
+        self.db_manager.fail_job(job["id"], "w1", RuntimeError("falhou"), 60, 5)
+        self.assertIsNone(self.db_manager.claim_job("w1", 60))
+        self.assertEqual(self.db_manager.get_job_counts(), {"pending": 1})
+
+    def test_worker_drains_queue(self):
+        handled = []
+        agent = SimpleNamespace(
+            db_manager=self.db_manager,
+            handle_fetch_job=lambda payload: self.db_manager.enqueue_job(JOB_GENERATE, {"n": 1}),
+            handle_generate_job=lambda payload: handled.append(payload["n"]),
+            handle_publish_job=MagicMock(side_effect=RuntimeError("Jira indisponível")),
+            handle_story_job=MagicMock(),
+        )
+        self.db_manager.enqueue_job(JOB_FETCH, {})
+        self.db_manager.enqueue_job(JOB_PUBLISH, {})
+
+        JobWorker(agent, worker_id="w1", poll_interval=0.01, max_attempts=2, retry_delay=0).run(drain=True)
+
+        self.assertEqual(handled, [1])
+        self.assertEqual(agent.handle_publish_job.call_count, 2)
+        self.assertEqual(self.db_manager.get_job_counts(), {"done": 2, "failed": 1})
+
+
+class TestQueueHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.environ["QA_AGENT_DB_PATH"] = os.path.join(self.tmp_dir.name, 'qa_agent.db')
+        self.addCleanup(os.environ.pop, "QA_AGENT_DB_PATH", None)
+        patchers = [patch('main.JiraClient'), patch('main.OpenAIClient')]
+        mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        from main import QAAgent
+        self.agent = QAAgent(workers=0)
+        self.mock_jira, self.mock_openai = (m.return_value for m in mocks)
+        self.mock_jira.iter_user_stories.return_value = iter([
+            {'key': f'KCA-{i}', 'title': 'US', 'description': 'Desc', 'status': 'To Do'}
+            for i in range(3)
+        ])
+        self.mock_openai.generate_test_cases.return_value = json.dumps({"scenarios": [
+            {"title": "Login", "preconditions": ["Usuário cadastrado"], "steps": ["Entrar"],
+             "expected_result": "Acesso liberado"},
+        ]})
+        self.mock_jira.create_subtasks.side_effect = lambda key, scenarios: [MagicMock(key=f"{key}-{i}") for i, _ in enumerate(scenarios)]
+
+    def tearDown(self):
+        self.agent.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_fetch_generate_publish(self):
+        self.agent.enqueue_fetch()
+        JobWorker(self.agent, worker_id="w1", poll_interval=0.01).run(drain=True)
+
+        db = self.agent.db_manager
+        self.assertEqual(db.get_job_counts(), {"done": 7})
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 3)
+        self.assertEqual(self.mock_jira.create_subtasks.call_count, 3)
+        subtasks = self.mock_jira.create_subtasks.call_args[0][1]
+        self.assertEqual(subtasks[0][0], "Login")
+        self.assertIsNotNone(db.get_last_watermark(self.agent.project_key))
+
+    def test_partial_publish_is_resumed_without_duplicates(self):
+        self.mock_openai.generate_test_cases.return_value = json.dumps({"scenarios": [
+            {"title": title, "preconditions": [], "steps": [], "expected_result": "ok"}
+            for title in ("Login", "Logout")
+        ]})
+        created = []
+
+        def create_subtasks(key, scenarios):
+            # Na primeira chamada, "Logout" falha no Jira
+            results = [None if title == "Logout" and not created else MagicMock(key=f"{key}-{title}")
+                       for title, _ in scenarios]
+            created.append([title for title, _ in scenarios])
+            return results
+
+        self.mock_jira.create_subtasks.side_effect = create_subtasks
+        story = {'key': 'KCA-1', 'title': 'US', 'description': 'Desc', 'status': 'To Do',
+                 'updated': '2024-01-01T10:00:00.000+0000'}
+        stats = self.agent.process_stories([story])
+        self.assertEqual(stats.summary()["failed"]["items"], 1)
+
+        # A história não mudou, mas volta ao processamento para publicar o que faltou
+        stats = self.agent.process_stories([story])
+        self.assertNotIn("failed", stats.summary())
+        self.agent.process_stories([story])
+        self.assertEqual(created, [["Login", "Logout"], ["Logout"]])
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 1)
+
+        # Nova geração com os mesmos cenários não duplica as subtarefas
+        self.agent.force_regenerate = True
+        self.agent.enqueue_fetch()
+        self.mock_jira.iter_user_stories.return_value = iter([story])
+        JobWorker(self.agent, worker_id="w1", poll_interval=0.01).run(drain=True)
+        self.assertEqual(len(created), 2)
+
+    def test_webhook_story_skips_unchanged_content(self):
+        story = {'key': 'KCA-9', 'title': 'US', 'description': 'Desc', 'status': 'To Do',
+                 'updated': '2024-01-01T10:00:00.000+0000'}
+        db = self.agent.db_manager
+        db.enqueue_job(JOB_STORY, story)
+        JobWorker(self.agent, worker_id="w1", poll_interval=0.01).run(drain=True)
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 1)
+
+        # Nova entrega com outro "updated", mas o mesmo título e descrição
+        db.enqueue_job(JOB_STORY, dict(story, updated='2024-01-02T10:00:00.000+0000'))
+        JobWorker(self.agent, worker_id="w1", poll_interval=0.01).run(drain=True)
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 1)
+
+        db.enqueue_job(JOB_STORY, dict(story, description='Nova descrição', updated='2024-01-03T10:00:00.000+0000'))
+        JobWorker(self.agent, worker_id="w1", poll_interval=0.01).run(drain=True)
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 2)
+        story_id = db.get_user_stories_by_keys(['KCA-9'])['KCA-9']['id']
+        self.assertEqual(db.get_story_ids_with_test_cases([story_id]), {story_id})
+
+    def test_reconciliation_with_webhooks_only_enqueues(self):
+        import schedule
+        self.addCleanup(schedule.clear)
+        self.agent.webhooks_enabled = True
+        with patch('main.JobWorker') as worker, patch('main.time.sleep', side_effect=KeyboardInterrupt), \
+                patch.object(self.agent, 'check_for_new_stories') as direct_cycle:
+            self.agent._monitor()
+        # A geração fica com a thread da fila; nenhum ciclo direto concorre com ela
+        direct_cycle.assert_not_called()
+        worker.assert_called_once_with(self.agent)
+        self.assertEqual(self.agent.db_manager.get_job_counts(), {"pending": 1})
+
+    def test_empty_generation_is_retried(self):
+        self.mock_openai.generate_test_cases.return_value = None
+        self.agent.enqueue_fetch()
+        JobWorker(self.agent, worker_id="w1", poll_interval=0.01, max_attempts=2, retry_delay=0).run(drain=True)
+
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 6)
+        self.assertEqual(self.agent.db_manager.get_job_counts(), {"done": 1, "failed": 3})
+        self.mock_jira.create_subtasks.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import io
+import json
+import logging
+import unittest
+from unittest.mock import patch
+
+from log_config import configure_logging, shutdown_logging
+
+
+class TestLogConfig(unittest.TestCase):
+
+    def setUp(self):
+        root = logging.getLogger()
+        self.addCleanup(setattr, root, "handlers", list(root.handlers))
+        self.addCleanup(root.setLevel, root.level)
+        self.addCleanup(shutdown_logging)
+        self.stream = io.StringIO()
+        self.logger = logging.getLogger("qa_agent.teste")
+
+    def records(self):
+        shutdown_logging()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_lines_with_extra_fields_and_exception(self):
+        configure_logging(level="INFO", fmt="json", stream=self.stream)
+        self.logger.info("História %s processada", "KCA-1", extra={"jira_key": "KCA-1"})
+        try:
+            raise ValueError("falhou")
+        except ValueError:
+            self.logger.exception("Falha ao processar %s", "KCA-2")
+
+        first, second = self.records()
+        self.assertEqual(first["message"], "História KCA-1 processada")
+        self.assertEqual(first["level"], "INFO")
+        self.assertEqual(first["jira_key"], "KCA-1")
+        self.assertEqual(second["level"], "ERROR")
+        self.assertIn("ValueError: falhou", second["exception"])
+
+    def test_debug_payloads_are_not_formatted_below_level(self):
+        configure_logging(level="INFO", fmt="json", stream=self.stream)
+
+        class Payload:
+            formatted = False
+
+            def __str__(self):
+                Payload.formatted = True
+                return "texto gerado"
+
+        self.logger.debug("Casos de teste gerados:\n%s", Payload())
+        self.assertEqual(self.records(), [])
+        self.assertFalse(Payload.formatted)
+
+    def test_text_format(self):
+        configure_logging(level="DEBUG", fmt="text", stream=self.stream)
+        self.logger.debug("Trabalho %s concluído", 7)
+        shutdown_logging()
+        self.assertIn("[DEBUG] qa_agent.teste: Trabalho 7 concluído", self.stream.getvalue())
+
+    def test_gunicorn_workers_configure_logging_after_fork(self):
+        import gunicorn_conf
+        from supervisor import web_command
+        with patch("log_config.configure_logging") as configure:
+            gunicorn_conf.post_fork(server=None, worker=None)
+        configure.assert_called_once_with()
+        with patch("importlib.util.find_spec", return_value=object()):
+            self.assertIn(os.path.abspath(gunicorn_conf.__file__), web_command())
+
+
+if __name__ == '__main__':
+    unittest.main()
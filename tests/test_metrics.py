@@ -0,0 +1,124 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from db_manager import DBManager
+from metrics import EXTERNAL_REQUESTS, Counter, Gauge, Histogram, Registry, SampledProfiler
+from rate_limiter import RateLimiter
+import web_app
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge_exposition(self):
+        counter = Counter("jobs_total", "Trabalhos.", ("kind",), registry=self.registry)
+        counter.inc(kind="fetch")
+        counter.inc(2, kind='a"b')
+        gauge = Gauge("queue", "Fila.", ("status",), registry=self.registry)
+        gauge.set_function(lambda: {("pending",): 3})
+
+        text = self.registry.render()
+        self.assertIn("# TYPE jobs_total counter", text)
+        self.assertIn('jobs_total{kind="fetch"} 1.0', text)
+        self.assertIn('jobs_total{kind="a\\"b"} 2.0', text)
+        self.assertIn('queue{status="pending"} 3.0', text)
+        with self.assertRaises(ValueError):
+            counter.inc(other="x")
+        with self.assertRaises(ValueError):
+            Counter("jobs_total", "Duplicada.", registry=self.registry)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("latency", "Latência.", ("op",), buckets=(0.1, 1.0), registry=self.registry)
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, op="get")
+        with histogram.time(op="get"):
+            pass
+
+        text = self.registry.render()
+        self.assertIn('latency_bucket{op="get",le="0.1"} 2', text)
+        self.assertIn('latency_bucket{op="get",le="1.0"} 3', text)
+        self.assertIn('latency_bucket{op="get",le="+Inf"} 4', text)
+        self.assertIn('latency_count{op="get"} 4', text)
+        self.assertEqual(histogram.count(op="get"), 4)
+
+    def test_rate_limiter_records_each_attempt(self):
+        limiter = RateLimiter("metrics-test", rate=1000, max_attempts=2, base_delay=0)
+        error = Exception("indisponível")
+        error.status_code = 503
+        limiter.call("search", MagicMock(side_effect=[error, "ok"]))
+        labels = {"service": "metrics-test", "endpoint": "search"}
+        self.assertEqual(EXTERNAL_REQUESTS.value(outcome="503", **labels), 1)
+        self.assertEqual(EXTERNAL_REQUESTS.value(outcome="ok", **labels), 1)
+
+    def test_profiler_samples_at_rate(self):
+        profiler = SampledProfiler(rate=0)
+        with profiler.sample():
+            sum(range(100))
+        self.assertEqual(profiler.samples, 0)
+
+        profiler.set_rate(5)
+        self.assertEqual(profiler.rate, 1.0)
+        profiled = profiler.profiled(lambda: sorted(range(100)))
+        profiled()
+        profiled()
+        self.assertEqual(profiler.samples, 2)
+        self.assertIn("2 execuções amostradas", profiler.report())
+        profiler.reset()
+        self.assertEqual(profiler.samples, 0)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        self.db_manager.bulk_upsert_user_stories([
+            {"jira_key": "KCA-1", "title": "Login", "description": "Descrição", "status": "To Do"},
+        ])
+        self.db_manager.enqueue_job("fetch", {})
+        patcher = patch.object(web_app, 'db_manager', self.db_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = web_app.app.test_client()
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_metrics_include_routes_queries_and_jobs(self):
+        story_id = self.db_manager.get_user_stories_by_keys(['KCA-1'])['KCA-1']['id']
+        self.client.get(f'/story/{story_id}')
+        self.client.get('/story/999999')
+
+        response = self.client.get('/metrics')
+        text = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('route="/story/<int:story_id>"', text)
+        self.assertIn('qa_agent_db_query_seconds_count{operation="get_test_cases_for_story"}', text)
+        self.assertIn('qa_agent_jobs{status="pending"} 1.0', text)
+
+    def test_profile_rate_can_be_changed(self):
+        self.addCleanup(web_app.PROFILER.set_rate, web_app.PROFILER.rate)
+        self.addCleanup(web_app.PROFILER.reset)
+        headers = {'X-Profile-Token': 'segredo'}
+        with patch('metrics.PROFILE_ADMIN_TOKEN', 'segredo'):
+            response = self.client.post('/debug/profile?rate=1&reset=1', headers=headers)
+            self.assertIn('Taxa de amostragem: 1', response.get_data(as_text=True))
+            self.client.get('/')
+            self.assertIn('amostradas', self.client.get('/debug/profile').get_data(as_text=True))
+            self.assertEqual(self.client.post('/debug/profile?rate=abc', headers=headers).status_code, 400)
+            self.assertEqual(self.client.post('/debug/profile?rate=0').status_code, 401)
+        # Sem PROFILE_ADMIN_TOKEN a alteração fica desativada
+        self.assertEqual(self.client.post('/debug/profile?rate=0', headers=headers).status_code, 403)
+        self.assertEqual(web_app.PROFILER.rate, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import sys
+import os
+import json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from db_manager import DBManager
+from openai_client import BATCH_PROMPT_TEMPLATE, OpenAIClient, parse_batch_response
+
+
+def make_completion(content):
+    completion = MagicMock()
+    completion.choices[0].message.content = content
+    return completion
+
+
+class TestGenerationCache(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        self.openai_client = OpenAIClient(cache=self.db_manager)
+        self.openai_client.client = MagicMock()
+        self.create = self.openai_client.client.chat.completions.create
+        self.create.return_value = make_completion("Cenário: Sucesso")
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_identical_story_hits_cache(self):
+        first = self.openai_client.generate_test_cases("Título: Login\n  Descrição: entrar")
+        # Mesmo texto com espaçamento diferente gera a mesma chave
+        second = self.openai_client.generate_test_cases("Título: Login Descrição:   entrar")
+        self.assertEqual(first, second)
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(self.openai_client.cache_stats()["hits"], 1)
+        self.assertEqual(self.openai_client.cache_stats()["misses"], 1)
+
+    def test_force_refresh_bypasses_cache(self):
+        self.openai_client.generate_test_cases("Título: Login")
+        self.create.return_value = make_completion("Cenário: Novo")
+        result = self.openai_client.generate_test_cases("Título: Login", force_refresh=True)
+        self.assertEqual(result, "Cenário: Novo")
+        self.assertEqual(self.create.call_count, 2)
+        self.assertEqual(self.openai_client.generate_test_cases("Título: Login"), "Cenário: Novo")
+
+    def test_key_depends_on_model_settings(self):
+        key = self.openai_client.cache_key("Título: Login")
+        self.openai_client.temperature = 0.2
+        self.assertNotEqual(key, self.openai_client.cache_key("Título: Login"))
+
+    def test_errors_are_not_cached(self):
+        self.create.side_effect = RuntimeError("timeout")
+        self.openai_client.generate_test_cases("Título: Login")
+        self.assertIsNone(self.db_manager.get_cached_generation(self.openai_client.cache_key("Título: Login")))
+
+    def test_eviction_keeps_most_recent_entries(self):
+        for i in range(5):
+            self.db_manager.save_cached_generation(f"chave-{i}", "gpt-4o-mini", f"conteudo {i}")
+        removed = self.db_manager.evict_generation_cache(max_entries=2)
+        self.assertEqual(removed, 3)
+        remaining = self.db_manager.conn.execute("SELECT COUNT(*) FROM generation_cache").fetchone()[0]
+        self.assertEqual(remaining, 2)
+
+    def test_stream_yields_deltas_and_fills_cache(self):
+        def chunk(text):
+            event = MagicMock()
+            event.choices[0].delta.content = text
+            return event
+
+        self.create.return_value = iter([chunk("Cenário: A\n"), chunk(None), chunk("Dado que...")])
+        parts = list(self.openai_client.stream_test_cases("Título: Login"))
+        self.assertEqual(parts, ["Cenário: A\n", "Dado que..."])
+        self.assertTrue(self.create.call_args.kwargs["stream"])
+        # A geração completa é entregue de uma só vez a partir do cache
+        self.assertEqual(list(self.openai_client.stream_test_cases("Título: Login")), ["Cenário: A\nDado que..."])
+        self.assertEqual(self.create.call_count, 1)
+
+
+class TestBatchPrompts(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        self.openai_client = OpenAIClient(cache=self.db_manager)
+        self.openai_client.client = MagicMock()
+        self.create = self.openai_client.client.chat.completions.create
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_batches_respect_token_budget(self):
+        self.openai_client.max_tokens = 100
+        self.openai_client.batch_token_budget = 600
+        self.openai_client.batch_max_stories = 3
+        stories = [(f"KCA-{i}", "curta") for i in range(5)] + [("KCA-9", "x" * 4000)]
+        self.assertEqual(
+            self.openai_client.plan_batches(stories),
+            [["KCA-0", "KCA-1", "KCA-2"], ["KCA-3", "KCA-4"], ["KCA-9"]],
+        )
+
+    def test_batch_response_is_split_by_key_with_fallback(self):
+        scenario = {"title": "A", "preconditions": [], "steps": ["Entrar"], "expected_result": "Ok"}
+        self.create.side_effect = [
+            make_completion(json.dumps({"stories": [
+                {"jira_key": "KCA-1", "scenarios": [scenario]},
+                {"jira_key": "KCA-X", "scenarios": [scenario]},
+            ]})),
+            make_completion('{"scenarios": []}'),
+        ]
+        results = self.openai_client.generate_test_cases_batch({"KCA-1": "História 1", "KCA-2": "História 2"})
+        self.assertEqual(json.loads(results["KCA-1"]), {"scenarios": [scenario]})
+        self.assertEqual(results["KCA-2"], '{"scenarios": []}')
+        batch_call, single_call = self.create.call_args_list
+        self.assertEqual(batch_call.kwargs["response_format"]["json_schema"]["name"], "test_cases_batch")
+        self.assertIn("### KCA-2", batch_call.kwargs["messages"][0]["content"])
+        self.assertEqual(single_call.kwargs["response_format"]["json_schema"]["name"], "test_cases")
+        # Cada história fica no cache do prompt que a gerou: o lote reaproveita as
+        # gerações em lote e a individual, as gerações com o prompt individual
+        self.assertEqual(
+            self.openai_client.generate_test_cases_batch({"KCA-1": "História 1", "KCA-2": "História 2"}),
+            results,
+        )
+        self.assertEqual(self.openai_client.generate_test_cases("História 2"), results["KCA-2"])
+        self.assertEqual(self.create.call_count, 2)
+        self.assertNotEqual(
+            self.openai_client.cache_key("História 1"),
+            self.openai_client.cache_key("História 1", BATCH_PROMPT_TEMPLATE),
+        )
+
+    def test_invalid_json_falls_back_to_single_calls(self):
+        self.assertEqual(parse_batch_response('{"stories": [', ["KCA-1"]), {})
+        self.create.side_effect = [make_completion("texto livre"), make_completion("Cenário: A"),
+                                   make_completion("Cenário: B")]
+        results = self.openai_client.generate_test_cases_batch({"KCA-1": "História 1", "KCA-2": "História 2"})
+        self.assertEqual(results, {"KCA-1": "Cenário: A", "KCA-2": "Cenário: B"})
+        # Uma consulta ao cache por história, mesmo com a geração individual
+        self.assertEqual(self.openai_client.cache_stats()["misses"], 2)
+        self.assertEqual(
+            self.openai_client.generate_test_cases_batch({"KCA-1": "História 1", "KCA-2": "História 2"}), results
+        )
+        self.assertEqual(self.openai_client.cache_stats()["hits"], 2)
+        self.assertEqual(self.create.call_count, 3)
+
+    def test_batch_api_file_round_trip(self):
+        path = os.path.join(self.tmp_dir.name, "lote.jsonl")
+        self.assertEqual(self.openai_client.write_batch_file({"KCA-1": "História 1"}, path), 1)
+        with open(path, encoding="utf-8") as f:
+            line = json.loads(f.readline())
+        self.assertEqual(line["custom_id"], "KCA-1")
+        self.assertEqual(line["url"], "/v1/chat/completions")
+        self.assertIn("História 1", line["body"]["messages"][0]["content"])
+
+        output = os.path.join(self.tmp_dir.name, "saida.jsonl")
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"custom_id": "KCA-1", "error": None, "response": {
+                "status_code": 200, "body": {"choices": [{"message": {"content": "Cenário: A"}}]}}}) + "\n")
+            f.write(json.dumps({"custom_id": "KCA-2", "error": {"message": "falhou"}, "response": None}) + "\n")
+        self.assertEqual(OpenAIClient.read_batch_results(output), {"KCA-1": "Cenário: A", "KCA-2": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,289 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from pipeline import PipelineStats
+from scenarios import Scenario, ScenarioSplitter, ScenarioStreamParser, parse_scenarios, split_scenarios
+
+
+class TestPipelineStats(unittest.TestCase):
+
+    def test_stage_records_items_and_time(self):
+        stats = PipelineStats()
+        with stats.stage("openai"):
+            time.sleep(0.01)
+        stats.record("openai", 0.01)
+        stats.finish()
+        summary = stats.summary()
+        self.assertEqual(summary["openai"]["items"], 2)
+        self.assertGreater(summary["openai"]["busy_seconds"], 0.01)
+        self.assertGreater(summary["openai"]["throughput_per_second"], 0)
+        self.assertIn("openai", stats.format_report())
+
+
+class TestScenarioSplitter(unittest.TestCase):
+
+    TEXT = "Casos de teste:\r\nCenário: A\nDado que...\n\ncenario: B\nEntão...\nCenário: C"
+
+    def test_incremental_split_matches_full_text(self):
+        splitter = ScenarioSplitter()
+        blocks = []
+        for char in self.TEXT:
+            blocks.extend(splitter.feed(char))
+        # A linha final "Cenário: C" não terminou: B só é entregue no finish()
+        self.assertEqual(len(blocks), 2)
+        blocks.extend(splitter.finish())
+        self.assertEqual(blocks, split_scenarios(self.TEXT))
+        self.assertEqual(blocks[1], "Cenário: A\nDado que...\n")
+        self.assertEqual(blocks[-1], "Cenário: C")
+
+
+class TestScenarioModel(unittest.TestCase):
+
+    def test_json_stream_yields_each_scenario_once(self):
+        content = (
+            '{"scenarios": [{"title": "Login {válido}", "preconditions": ["Conta \\"ativa\\""],'
+            ' "steps": ["Informar [senha]", "Confirmar"], "expected_result": "Acesso"},'
+            ' {"title": "Senha errada", "preconditions": [], "steps": [], "expected_result": "Erro"}]}'
+        )
+        parser = ScenarioStreamParser()
+        scenarios = []
+        for char in content:
+            scenarios.extend(parser.feed(char))
+        self.assertEqual(scenarios, parse_scenarios(content))
+        self.assertEqual(scenarios[0].title, "Login {válido}")
+        self.assertEqual(scenarios[0].preconditions, ['Conta "ativa"'])
+        self.assertEqual(scenarios[0].steps, ["Informar [senha]", "Confirmar"])
+
+    def test_free_text_is_parsed_by_gherkin_keywords(self):
+        scenarios = parse_scenarios(
+            "Casos de teste:\n## Cenário: Login\nDado que o usuário existe\nE está ativo\n"
+            "Quando ele envia a senha\nEnviar formulário\nEntão o acesso é liberado\n"
+            "Cenário 2: Bloqueio\nEntão a conta é bloqueada"
+        )
+        self.assertEqual(scenarios[0], Scenario(
+            "Login", ["Dado que o usuário existe", "E está ativo"],
+            ["Quando ele envia a senha", "Enviar formulário"], "Então o acesso é liberado",
+        ))
+        self.assertEqual((scenarios[1].title, scenarios[1].expected_result), ("Bloqueio", "Então a conta é bloqueada"))
+
+    def test_subtasks_are_rendered_from_scenarios(self):
+        from main import QAAgent
+        scenario = Scenario("Login", ["Conta ativa"], ["Informar senha"], "Acesso liberado")
+        agent = QAAgent.__new__(QAAgent)
+        self.assertEqual(agent._build_subtasks([scenario, Scenario("")]), [
+            ("Login", "h3. Pré-condições\n* Conta ativa\nh3. Passos\n# Informar senha\n"
+                      "h3. Resultado esperado\nAcesso liberado"),
+            ("Cenário 2", ""),
+        ])
+
+
+class TestConcurrentProcessing(unittest.TestCase):
+
+    def setUp(self):
+        patchers = [patch('main.JiraClient'), patch('main.OpenAIClient'), patch('main.DBManager')]
+        mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        from main import QAAgent
+        os.environ["OPENAI_CONCURRENCY"] = "2"
+        self.addCleanup(os.environ.pop, "OPENAI_CONCURRENCY", None)
+        self.agent = QAAgent()
+        self.mock_jira, self.mock_openai, self.mock_db = (m.return_value for m in mocks)
+        self.upserted = []
+
+        def bulk_upsert(stories):
+            stories = list(stories)
+            self.upserted.append([story["title"] for story in stories])
+            return {story["jira_key"]: int(story["jira_key"].split("-")[1]) for story in stories}
+
+        self.mock_db.bulk_upsert_user_stories.side_effect = bulk_upsert
+        self.mock_db.get_story_ids_with_test_cases.return_value = set()
+        self.mock_db.get_story_sync_states.return_value = {}
+        self.mock_db.get_keys_with_unpublished_subtasks.return_value = set()
+        self.mock_db.claim_subtasks.side_effect = lambda key, hashes, lease: dict.fromkeys(hashes)
+        self.mock_openai.cache_stats.return_value = {"hits": 0, "misses": 0, "hit_rate": 0.0}
+        self.mock_jira.create_subtasks.side_effect = lambda key, scenarios: [MagicMock(key=f"{key}-{i}") for i, _ in enumerate(scenarios)]
+
+    def test_openai_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        state = {"current": 0, "peak": 0}
+
+        def generate(story_text, **kwargs):
+            with lock:
+                state["current"] += 1
+                state["peak"] = max(state["peak"], state["current"])
+            time.sleep(0.05)
+            with lock:
+                state["current"] -= 1
+            return "Cenário: Sucesso\nDado que...\nEntão..."
+
+        self.mock_openai.generate_test_cases.side_effect = generate
+        stories = [
+            {'key': f'KCA-{i}', 'title': 'US', 'description': 'Desc', 'status': 'To Do'}
+            for i in range(6)
+        ]
+        stats = self.agent.process_stories(stories)
+
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 6)
+        self.assertEqual(state["peak"], 2)
+        self.assertEqual(stats.summary()["stories"]["items"], 6)
+        self.assertEqual(self.mock_jira.create_subtasks.call_count, 6)
+
+    def test_duplicate_keys_processed_in_order(self):
+        self.mock_openai.generate_test_cases.return_value = "Cenário: A\nDado que..."
+        stories = [
+            {'key': 'KCA-1', 'title': 'Antigo', 'description': 'Desc', 'status': 'To Do'},
+            {'key': 'KCA-1', 'title': 'Novo', 'description': 'Desc', 'status': 'To Do'},
+        ]
+        # No mesmo lote vale a última ocorrência
+        self.agent.process_stories(iter(stories))
+        self.assertEqual(self.upserted, [["Novo"]])
+
+        # Em lotes diferentes, a segunda gravação espera a primeira terminar
+        self.upserted.clear()
+        self.agent.db_batch_size = 1
+        self.agent.process_stories(iter(stories))
+        self.assertEqual(self.upserted, [["Antigo"], ["Novo"]])
+
+    def test_stories_are_saved_in_batches(self):
+        self.mock_openai.generate_test_cases.return_value = "Cenário: A\nDado que..."
+        self.mock_db.get_story_ids_with_test_cases.side_effect = lambda ids: {i for i in ids if i % 2}
+        self.agent.db_batch_size = 4
+        stories = [
+            {'key': f'KCA-{i}', 'title': f'US {i}', 'description': 'Desc', 'status': 'To Do'}
+            for i in range(10)
+        ]
+        self.agent.process_stories(iter(stories))
+        self.assertEqual([len(batch) for batch in self.upserted], [4, 4, 2])
+        # Histórias com casos de teste (ids ímpares) não são geradas novamente
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 5)
+        self.mock_db.save_user_story.assert_not_called()
+
+    def test_unchanged_stories_are_skipped(self):
+        self.mock_openai.generate_test_cases.return_value = "Cenário: A\nDado que..."
+        current = {"jira_updated": "2024-01-01T00:00:00.000+0000", "content_hash": "h1", "generated_hash": "h1"}
+        self.mock_db.get_story_sync_states.return_value = {
+            "KCA-1": dict(current, id=1),
+            "KCA-2": dict(current, id=2),
+            "KCA-3": dict(current, id=3, generated_hash="h0"),
+        }
+        stories = [
+            {'key': f'KCA-{i}', 'title': f'US {i}', 'description': 'Desc', 'status': 'To Do',
+             'updated': current["jira_updated"] if i != 2 else "2024-02-01T00:00:00.000+0000"}
+            for i in range(1, 5)
+        ]
+        stats = self.agent.process_stories(iter(stories))
+
+        # KCA-1 é descartada sem gravação; KCA-2 (atualizada no Jira), KCA-3 (geração
+        # anterior de outro conteúdo) e KCA-4 (nova) seguem para o processamento
+        self.assertEqual(self.upserted, [["US 2", "US 3", "US 4"]])
+        self.assertEqual(stats.summary()["unchanged"]["items"], 1)
+        self.mock_db.get_story_sync_states.assert_called_once()
+
+    def test_watermark_advances_only_on_success(self):
+        self.mock_db.get_last_watermark.return_value = None
+        self.mock_openai.generate_test_cases.return_value = "Cenário: A\nDado que..."
+        self.mock_jira.iter_user_stories.return_value = iter([
+            {'key': 'KCA-1', 'title': 'US', 'description': 'Desc', 'status': 'To Do'},
+        ])
+        self.agent.check_for_new_stories()
+        self.assertIsNotNone(self.mock_db.log_sync_time.call_args.kwargs["watermark"])
+
+        self.mock_jira.create_subtasks.side_effect = RuntimeError("Jira indisponível")
+        self.mock_jira.iter_user_stories.return_value = iter([
+            {'key': 'KCA-2', 'title': 'US', 'description': 'Desc', 'status': 'To Do'},
+        ])
+        self.agent.check_for_new_stories()
+        self.assertIsNone(self.mock_db.log_sync_time.call_args.kwargs["watermark"])
+
+    def test_fetch_job_uses_watermark_of_payload_project(self):
+        self.mock_db.get_last_watermark.return_value = None
+        self.mock_jira.iter_user_stories.return_value = iter([])
+        self.agent.handle_fetch_job({"project_key": "OUTRO"})
+        self.mock_db.get_last_watermark.assert_called_once_with("OUTRO")
+        self.assertEqual(self.mock_db.log_sync_time.call_args.kwargs["project_key"], "OUTRO")
+
+    def test_small_stories_share_one_prompt(self):
+        self.agent.batch_prompts = True
+        self.mock_openai.plan_batches.side_effect = lambda stories: [[key for key, _ in stories]]
+        self.mock_openai.generate_test_cases_batch.side_effect = lambda stories, **kwargs: {
+            key: "Cenário: A\nDado que..." for key in stories if key != "KCA-2"
+        }
+        stats = self.agent.process_stories([
+            {'key': f'KCA-{i}', 'title': 'US', 'description': 'Desc', 'status': 'To Do'}
+            for i in range(1, 4)
+        ])
+        self.mock_openai.generate_test_cases_batch.assert_called_once()
+        self.mock_openai.generate_test_cases.assert_not_called()
+        self.assertEqual(self.mock_db.save_test_cases.call_count, 2)
+        self.assertEqual(self.mock_jira.create_subtasks.call_count, 2)
+        self.assertEqual(stats.summary()["failed"]["items"], 1)
+        self.assertEqual(stats.summary()["stories"]["items"], 3)
+
+    def test_failed_generation_is_not_saved(self):
+        self.mock_openai.generate_test_cases.return_value = None
+        stats = self.agent.process_stories([
+            {'key': 'KCA-1', 'title': 'US', 'description': 'Desc', 'status': 'To Do'},
+        ])
+        self.mock_db.save_test_cases.assert_not_called()
+        self.mock_jira.create_subtasks.assert_not_called()
+        self.assertEqual(stats.summary()["failed"]["items"], 1)
+
+
+class TestStreamingProcessing(unittest.TestCase):
+
+    def setUp(self):
+        TestConcurrentProcessing.setUp(self)
+        self.agent.streaming = True
+
+    def test_scenarios_are_published_while_streaming(self):
+        created = []
+        self.mock_jira.create_subtasks.side_effect = lambda key, scenarios: created.extend(scenarios) or [
+            MagicMock(key=f"{key}-{i}") for i, _ in enumerate(scenarios)
+        ]
+
+        def stream(story_text, **kwargs):
+            yield '{"scenarios": [{"title": "A", "preconditions": [], "steps": ["{x}"], '
+            yield '"expected_result": "ok"}, {"title": "B", "pre'
+            # O cenário A é publicado antes do fim da geração
+            for _ in range(100):
+                if created:
+                    break
+                time.sleep(0.01)
+            self.assertEqual([title for title, _ in created], ["A"])
+            yield 'conditions": [], "steps": [], "expected_result": "\\"]"}, {"title": "C", '
+            yield '"preconditions": [], "steps": [], "expected_result": ""}]}'
+
+        self.mock_openai.stream_test_cases.side_effect = stream
+        stats = self.agent.process_stories([
+            {'key': 'KCA-1', 'title': 'US', 'description': 'Desc', 'status': 'To Do'},
+        ])
+        self.assertEqual(sorted(title for title, _ in created), ["A", "B", "C"])
+        story_id, markdown, scenarios = self.mock_db.save_test_cases.call_args.args
+        self.assertEqual((story_id, [s.title for s in scenarios]), (1, ["A", "B", "C"]))
+        self.assertEqual(scenarios[1].expected_result, '"]')
+        self.assertEqual(self.mock_db.update_generation_progress.call_args.args[1], markdown)
+        self.mock_db.clear_generation_progress.assert_called_once_with(1)
+        self.assertNotIn("failed", stats.summary())
+
+    def test_stream_failure_marks_progress_as_failed(self):
+        def stream(story_text, **kwargs):
+            yield '{"scenarios": [{"title": "A", "preconditions": [], "steps": [], "expected_result": ""}'
+            raise RuntimeError("conexão perdida")
+
+        self.mock_openai.stream_test_cases.side_effect = stream
+        stats = self.agent.process_stories([
+            {'key': 'KCA-1', 'title': 'US', 'description': 'Desc', 'status': 'To Do'},
+        ])
+        self.mock_db.save_test_cases.assert_not_called()
+        self.assertEqual(self.mock_db.update_generation_progress.call_args.args[2], "failed")
+        self.assertEqual(stats.summary()["failed"]["items"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
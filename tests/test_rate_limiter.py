@@ -0,0 +1,134 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from rate_limiter import (CircuitBreaker, CircuitOpenError, RateLimiter, TokenBucket,
+                          retry_after_seconds)
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = MagicMock(status_code=status_code, headers=headers or {})
+
+
+class TestRetryAfter(unittest.TestCase):
+
+    def test_parses_known_headers(self):
+        self.assertEqual(retry_after_seconds(HTTPError(429, {"retry-after": "2"})), 2.0)
+        self.assertEqual(retry_after_seconds(HTTPError(429, {"retry-after-ms": "250"})), 0.25)
+        self.assertEqual(retry_after_seconds(HTTPError(429, {"x-ratelimit-reset-requests": "6m0s"})), 360.0)
+        self.assertEqual(retry_after_seconds(HTTPError(429, {"x-ratelimit-reset-tokens": "20ms"})), 0.02)
+        self.assertIsNone(retry_after_seconds(HTTPError(500)))
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_rate_is_enforced_and_adapts(self):
+        bucket = TokenBucket(rate=20, capacity=1)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+        bucket.penalize()
+        self.assertEqual(bucket.rate, 10)
+        bucket.reward()
+        self.assertGreater(bucket.rate, 10)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_and_half_opens(self):
+        breaker = CircuitBreaker("jira:search", failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        breaker.allow()
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow()
+        time.sleep(0.06)
+        breaker.allow()  # chamada de teste no estado meio-aberto
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter("test", rate=1000, max_attempts=3, base_delay=0.001,
+                                   failure_threshold=10)
+
+    def test_retries_transient_errors(self):
+        fn = MagicMock(side_effect=[HTTPError(429, {"retry-after-ms": "1"}), HTTPError(503), "ok"])
+        self.assertEqual(self.limiter.call("search", fn), "ok")
+        self.assertEqual(fn.call_count, 3)
+        self.assertLess(self.limiter.bucket.rate, 1000)
+
+    def test_client_errors_are_not_retried(self):
+        fn = MagicMock(side_effect=HTTPError(404))
+        with self.assertRaises(HTTPError):
+            self.limiter.call("issue", fn)
+        self.assertEqual(fn.call_count, 1)
+        self.assertEqual(self.limiter.breaker("issue").state, "closed")
+
+    def test_gives_up_after_max_attempts(self):
+        fn = MagicMock(side_effect=HTTPError(500))
+        with self.assertRaises(HTTPError):
+            self.limiter.call("issue", fn)
+        self.assertEqual(fn.call_count, 3)
+
+    def test_retry_after_longer_than_max_delay_is_not_awaited(self):
+        limiter = RateLimiter("test", rate=1000, max_attempts=3, max_delay=0.05, failure_threshold=10)
+        fn = MagicMock(side_effect=[HTTPError(429, {"x-ratelimit-reset-requests": "6m0s"}), "ok"])
+        start = time.monotonic()
+        with self.assertRaises(HTTPError):
+            limiter.call("chat", fn)
+        self.assertEqual(fn.call_count, 1)
+        # A pausa do bucket também fica limitada a max_delay
+        self.assertEqual(limiter.call("chat", fn), "ok")
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_async_call(self):
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                raise HTTPError(502)
+            return "ok"
+
+        self.assertEqual(asyncio.run(self.limiter.acall("chat", fn)), "ok")
+        self.assertEqual(len(calls), 2)
+
+    def test_half_open_probe_is_always_settled(self):
+        limiter = RateLimiter("test", rate=1000, max_attempts=1, failure_threshold=1, reset_timeout=0.01)
+        breaker = limiter.breaker("issue")
+        breaker.record_failure()
+        time.sleep(0.02)
+        # Erro do cliente na chamada de teste: o serviço respondeu e o circuito fecha
+        with self.assertRaises(HTTPError):
+            limiter.call("issue", MagicMock(side_effect=HTTPError(404)))
+        self.assertEqual(breaker.state, "closed")
+
+        breaker.record_failure()
+        time.sleep(0.02)
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(limiter.acall("issue", cancelled))
+        # A chamada de teste cancelada não bloqueia as seguintes
+        self.assertEqual(limiter.call("issue", MagicMock(return_value="ok")), "ok")
+        self.assertEqual(breaker.state, "closed")
+
+
+if __name__ == "__main__":
+    unittest.main()
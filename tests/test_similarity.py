@@ -0,0 +1,121 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import json
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from db_manager import DBManager
+from pipeline import PipelineStats
+from scenarios import Scenario
+from similarity import NUM_PERM, SimilarityIndex, similarity, story_signature
+
+LOGIN = ("Login com senha", "Como usuário quero entrar no sistema com e-mail e senha para acessar minha conta.")
+
+
+class TestSignatures(unittest.TestCase):
+
+    def test_near_duplicates_are_similar(self):
+        signature = story_signature(*LOGIN)
+        self.assertEqual(signature.shape, (NUM_PERM,))
+        self.assertEqual(signature.nbytes, 512)
+        # Maiúsculas, acentos e pontuação não mudam a assinatura
+        self.assertEqual(similarity(signature, story_signature("LOGIN com senha!", LOGIN[1].replace("á", "a"))), 1.0)
+        edited = story_signature(LOGIN[0], LOGIN[1].replace("minha conta", "a minha conta"))
+        other = story_signature("Exportar relatório", "Como gestor quero exportar o relatório mensal em PDF.")
+        self.assertGreater(similarity(signature, edited), 0.8)
+        self.assertLess(similarity(signature, other), 0.2)
+
+    def test_short_stories_have_no_signature(self):
+        self.assertIsNone(story_signature("", ""))
+        self.assertIsNone(story_signature("Login", ""))
+        self.assertIsNone(story_signature("Exportar relatório", "Em PDF."))
+
+
+class TestSimilarityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        stories = [
+            {"jira_key": "KCA-1", "title": LOGIN[0], "description": LOGIN[1], "status": "To Do"},
+            {"jira_key": "KCA-2", "title": "Exportar relatório",
+             "description": "Como gestor quero exportar o relatório mensal em PDF.", "status": "To Do"},
+            {"jira_key": "KCA-3", "title": LOGIN[0], "description": LOGIN[1], "status": "To Do"},
+        ]
+        self.ids = self.db_manager.bulk_upsert_user_stories(stories)
+        for key in ("KCA-1", "KCA-2"):
+            self.db_manager.save_test_cases(self.ids[key], "### Cenário: Login", [Scenario(f"Cenário {key}")])
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_finds_stories_with_current_test_cases(self):
+        index = SimilarityIndex(self.db_manager, threshold=0.85, refresh_seconds=0)
+        self.assertEqual(index.find(*LOGIN), (self.ids["KCA-1"], 1.0))
+        # KCA-3 não tem casos de teste; a própria história é ignorada
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.find(*LOGIN, exclude=self.ids["KCA-1"]))
+        self.assertIsNone(index.find("Cadastro", "Como visitante quero criar uma conta."))
+
+        # Nova descrição: a assinatura antiga deixa de valer até uma nova geração
+        self.db_manager.bulk_upsert_user_stories([
+            {"jira_key": "KCA-1", "title": "Outro assunto", "description": "Sem relação.", "status": "To Do"},
+        ])
+        self.assertIsNone(index.find(*LOGIN))
+        self.db_manager.save_test_cases(self.ids["KCA-1"], "### Cenário: Outro", [Scenario("Outro")])
+        self.assertIsNone(index.find(*LOGIN))
+        # A nova versão é curta demais para ter assinatura e fica fora do índice
+        self.assertEqual(len(index), 1)
+        self.assertIsNone(index.find("Outro assunto", "Sem relação."))
+        self.assertEqual(self.db_manager.get_stories_missing_signatures(10), [])
+
+
+class TestSimilarStoryReuse(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.environ["QA_AGENT_DB_PATH"] = os.path.join(self.tmp_dir.name, 'qa_agent.db')
+        self.addCleanup(os.environ.pop, "QA_AGENT_DB_PATH", None)
+        patchers = [patch('main.JiraClient'), patch('main.OpenAIClient')]
+        mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        from main import QAAgent
+        self.agent = QAAgent(workers=0, reuse_similar=True)
+        self.agent.similar_index.refresh_seconds = 0
+        self.mock_jira, self.mock_openai = (m.return_value for m in mocks)
+        self.mock_openai.generate_test_cases.return_value = json.dumps({"scenarios": [
+            {"title": "Login válido", "preconditions": [], "steps": ["Entrar"], "expected_result": "Acesso"},
+        ]})
+        self.mock_jira.create_subtasks.side_effect = lambda key, scenarios: [
+            MagicMock(key=f"{key}-{i}") for i, _ in enumerate(scenarios)
+        ]
+
+    def tearDown(self):
+        self.agent.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_near_duplicate_story_reuses_scenarios(self):
+        self.agent.process_stories([{'key': 'KCA-1', 'title': LOGIN[0], 'description': LOGIN[1], 'status': 'To Do'}])
+        stats = self.agent.process_stories([
+            {'key': 'KCA-2', 'title': LOGIN[0], 'description': LOGIN[1] + " ", 'status': 'To Do'},
+        ])
+
+        self.assertEqual(self.mock_openai.generate_test_cases.call_count, 1)
+        self.assertEqual(stats.summary()["reused"]["items"], 1)
+        db = self.agent.db_manager
+        story_id = db.get_user_stories_by_keys(['KCA-2'])['KCA-2']['id']
+        self.assertEqual([s.title for s in db.get_scenarios_for_story(story_id).popitem()[1]], ["Login válido"])
+        self.assertEqual(self.mock_jira.create_subtasks.call_args[0], ("KCA-2", [("Login válido", unittest.mock.ANY)]))
+
+        # Com --force-regenerate a história é sempre gerada
+        self.agent.force_regenerate = True
+        self.assertIsNone(self.agent._reused_test_cases(
+            {"jira_key": "KCA-2", "title": LOGIN[0], "description": LOGIN[1]}, story_id, PipelineStats()))
+
+
+if __name__ == '__main__':
+    unittest.main()
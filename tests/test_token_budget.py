@@ -0,0 +1,172 @@
+import sys
+import os
+import json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from db_manager import DBManager
+from openai_client import OpenAIClient
+from scenarios import parse_scenarios
+from token_budget import TokenUsage, clean_story_text, completion_budget, count_tokens, split_story
+
+
+def make_completion(scenarios, prompt_tokens=100, completion_tokens=50):
+    completion = MagicMock()
+    completion.choices[0].message.content = json.dumps({"scenarios": scenarios})
+    completion.choices[0].finish_reason = "stop"
+    completion.usage.prompt_tokens = prompt_tokens
+    completion.usage.completion_tokens = completion_tokens
+    return completion
+
+
+def scenario(title):
+    return {"title": title, "preconditions": [], "steps": ["Entrar"], "expected_result": "Ok"}
+
+
+class TestTokenBudget(unittest.TestCase):
+
+    def setUp(self):
+        # Contagem determinística (estimativa por caracteres), com ou sem o tiktoken
+        patcher = patch("token_budget._encoding", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_clean_story_text_strips_jira_markup(self):
+        text = (
+            "h2. *Critérios de aceitação*\n"
+            "{color:#172b4d}* O link expira em {{24h}}{color}\n"
+            "* Ver [documentação|https://wiki/x] e !tela.png|thumbnail! [~joao]\n"
+            "* \n"
+            "----\n"
+            "N/A\n"
+            "\n\n\n"
+            "|| Campo || Regra ||\n"
+            "    Senha com 8 caracteres\n"
+            "    Senha com 8 caracteres\n"
+        )
+        self.assertEqual(clean_story_text(text), (
+            "Critérios de aceitação\n"
+            "- O link expira em 24h\n"
+            "- Ver documentação e\n"
+            "\n"
+            "| Campo | Regra |\n"
+            "Senha com 8 caracteres"
+        ))
+
+    def test_split_story_repeats_title_in_each_part(self):
+        paragraphs = [f"Parágrafo {i} " + "palavra " * 60 for i in range(6)]
+        text = "Título: Cadastro\n" + "\n\n".join(paragraphs)
+        parts = split_story(text, 300)
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            self.assertTrue(part.startswith("Título: Cadastro\n"))
+            self.assertLessEqual(count_tokens(part), 300 + len(paragraphs))
+        self.assertEqual(sum(part.count("Parágrafo") for part in parts), 6)
+        self.assertEqual(split_story("Título: curta", 300), ["Título: curta"])
+
+    def test_completion_budget_grows_with_story_up_to_ceiling(self):
+        small, large = completion_budget(50, 4000), completion_budget(1000, 4000)
+        self.assertLess(small, large)
+        self.assertEqual(completion_budget(100000, 4000), 4000)
+
+
+class TestChunkedGeneration(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        patcher = patch("token_budget._encoding", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        self.openai_client = OpenAIClient(cache=self.db_manager)
+        self.openai_client.client = MagicMock()
+        self.openai_client.prompt_max_tokens = 200
+        self.create = self.openai_client.client.chat.completions.create
+        self.long_story = "Título: Checkout\n" + "\n\n".join(f"Regra {i}: " + "texto " * 100 for i in range(3))
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_long_story_is_generated_in_parts_and_merged(self):
+        self.create.side_effect = [
+            make_completion([scenario("Pagamento aprovado"), scenario("Cartão recusado")]),
+            make_completion([scenario("pagamento  APROVADO"), scenario("Cupom expirado")]),
+            make_completion([scenario("Frete grátis")]),
+        ]
+        usage = TokenUsage()
+        result = self.openai_client.generate_test_cases(self.long_story, usage=usage)
+
+        titles = [item.title for item in parse_scenarios(result)]
+        self.assertEqual(titles, ["Pagamento aprovado", "Cartão recusado", "Cupom expirado", "Frete grátis"])
+        self.assertEqual(self.create.call_count, 3)
+        first_call = self.create.call_args_list[0].kwargs
+        self.assertIn("parte 1 de 3", first_call["messages"][0]["content"])
+        self.assertLessEqual(first_call["max_tokens"], self.openai_client.max_tokens)
+        self.assertEqual((usage.prompt_tokens, usage.completion_tokens, usage.calls), (300, 150, 3))
+
+        # A história inteira fica no cache como uma única geração
+        self.assertEqual(self.openai_client.generate_test_cases(self.long_story), result)
+        self.assertEqual(self.create.call_count, 3)
+
+    def test_batch_usage_is_split_across_stories(self):
+        batch = make_completion([], prompt_tokens=300, completion_tokens=90)
+        batch.choices[0].message.content = json.dumps(
+            {"stories": [{"jira_key": "KCA-1", "scenarios": [scenario("A")]}]}
+        )
+        self.create.side_effect = [batch, make_completion([scenario("B")])]
+        usages = {}
+        results = self.openai_client.generate_test_cases_batch({"KCA-1": "a" * 40, "KCA-2": "b" * 80},
+                                                               usages=usages)
+
+        self.assertEqual(set(results), {"KCA-1", "KCA-2"})
+        # Tokens do lote proporcionais ao texto (11 e 21 tokens estimados); KCA-2,
+        # ausente da resposta, soma a chamada individual
+        self.assertEqual((usages["KCA-1"].prompt_tokens, usages["KCA-1"].completion_tokens,
+                          usages["KCA-1"].calls), (103, 31, 1))
+        self.assertEqual((usages["KCA-2"].prompt_tokens, usages["KCA-2"].completion_tokens,
+                          usages["KCA-2"].calls), (297, 109, 2))
+
+    def test_failed_part_fails_the_whole_story(self):
+        self.create.side_effect = [make_completion([scenario("A")]), RuntimeError("timeout"),
+                                   make_completion([scenario("C")])]
+        self.assertIsNone(self.openai_client.generate_test_cases(self.long_story))
+        self.assertIsNone(self.db_manager.get_cached_generation(self.openai_client.cache_key(self.long_story)))
+
+    def test_batch_api_file_splits_long_story(self):
+        path = os.path.join(self.tmp_dir.name, "lote.jsonl")
+        self.assertEqual(self.openai_client.write_batch_file({"KCA-1": self.long_story}, path), 1)
+        with open(path, encoding="utf-8") as f:
+            ids = [json.loads(line)["custom_id"] for line in f]
+        self.assertEqual(ids, ["KCA-1#1", "KCA-1#2", "KCA-1#3"])
+
+        output = os.path.join(self.tmp_dir.name, "saida.jsonl")
+        with open(output, "w", encoding="utf-8") as f:
+            for number, title in enumerate(["A", "B", "A"], 1):
+                body = {"choices": [{"message": {"content": json.dumps({"scenarios": [scenario(title)]})}}]}
+                f.write(json.dumps({"custom_id": f"KCA-1#{number}",
+                                    "response": {"status_code": 200, "body": body}}) + "\n")
+        merged = OpenAIClient.read_batch_results(output)["KCA-1"]
+        self.assertEqual([item.title for item in parse_scenarios(merged)], ["A", "B"])
+
+    def test_token_usage_is_saved_with_test_cases(self):
+        story_id = self.db_manager.save_user_story("KCA-1", "Checkout", "Descrição", "To Do")
+        usage = TokenUsage()
+        usage.add(prompt_tokens=120, completion_tokens=80)
+        usage.calls = 1
+        self.db_manager.save_test_cases(story_id, "Cenário: A", usage=usage)
+        self.db_manager.save_test_cases(story_id, "Cenário: B")
+        rows = {row["content"]: row for row in self.db_manager.get_test_cases_for_story(story_id)}
+        self.assertEqual(
+            (rows["Cenário: A"]["prompt_tokens"], rows["Cenário: A"]["completion_tokens"],
+             rows["Cenário: A"]["generation_calls"]),
+            (120, 80, 1),
+        )
+        self.assertIsNone(rows["Cenário: B"]["prompt_tokens"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import hashlib
+import hmac
+import json
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from db_manager import DBManager
+from scenarios import Scenario
+import web_app
+
+
+class TestStoryListing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        self.db_manager.bulk_upsert_user_stories(
+            {"jira_key": f"KCA-{i}", "title": f"Login {i}", "description": "Descrição completa", "status": "To Do"}
+            for i in range(1, 6)
+        )
+        patcher = patch.object(web_app, 'db_manager', self.db_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = web_app.app.test_client()
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_index_is_paginated_without_json_blob(self):
+        response = self.client.get('/?per_page=2')
+        html = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('KCA-5', html)
+        self.assertNotIn('KCA-3', html)
+        self.assertNotIn('tojson', html)
+        self.assertNotIn('Descrição completa', html)
+        self.assertIn('Próxima página', html)
+
+    def test_api_follows_next_url(self):
+        keys, url = [], '/api/stories?per_page=2'
+        while url:
+            data = self.client.get(url).get_json()
+            keys.extend(story['jira_key'] for story in data['stories'])
+            url = data['next_url']
+        self.assertEqual(keys, ['KCA-5', 'KCA-4', 'KCA-3', 'KCA-2', 'KCA-1'])
+
+    def test_search_and_invalid_cursor(self):
+        data = self.client.get('/api/stories?q=login 3').get_json()
+        self.assertEqual([story['jira_key'] for story in data['stories']], ['KCA-3'])
+        self.assertEqual(self.client.get('/?after=lixo').status_code, 200)
+
+
+
+class TestStoryPage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        self.story_id = self.db_manager.save_user_story("KCA-1", "Login", "Descrição", "To Do")
+        self.db_manager.save_test_cases(self.story_id, "## Cenário: Sucesso\n<script>alert(1)</script>")
+        patcher = patch.object(web_app, 'db_manager', self.db_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = web_app.app.test_client()
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_test_cases_are_rendered_and_sanitized(self):
+        html = self.client.get(f'/story/{self.story_id}').get_data(as_text=True)
+        self.assertIn('<h2>Cenário: Sucesso</h2>', html)
+        self.assertNotIn('<script>alert(1)</script>', html)
+
+    def test_structured_scenarios_are_rendered(self):
+        scenario = Scenario("Bloqueio <b>", ["Conta ativa"], ["Errar a senha 3 vezes"], "Conta bloqueada")
+        self.db_manager.save_test_cases(self.story_id, "### Cenário: Bloqueio", [scenario])
+        html = self.client.get(f'/story/{self.story_id}').get_data(as_text=True)
+        self.assertIn('<h5>Cenário: Bloqueio &lt;b&gt;</h5>', html)
+        self.assertIn('<li>Errar a senha 3 vezes</li>', html)
+        self.assertIn('<p>Conta bloqueada</p>', html)
+        # Casos de teste antigos continuam exibidos a partir do HTML
+        self.assertIn('<h2>Cenário: Sucesso</h2>', html)
+
+    def test_repeat_views_are_not_modified(self):
+        first = self.client.get(f'/story/{self.story_id}')
+        etag = first.headers['ETag']
+        self.assertIsNotNone(first.headers.get('Last-Modified'))
+        with patch.object(web_app, 'render_template') as render:
+            second = self.client.get(f'/story/{self.story_id}', headers={'If-None-Match': etag})
+            render.assert_not_called()
+        self.assertEqual(second.status_code, 304)
+
+        # Um novo caso de teste muda o ETag
+        self.db_manager.save_test_cases(self.story_id, "Cenário: Falha")
+        third = self.client.get(f'/story/{self.story_id}', headers={'If-None-Match': etag})
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third.headers['ETag'], etag)
+
+    def test_generation_progress_is_streamed(self):
+        self.db_manager.update_generation_progress(self.story_id, "Cenário: Parcial\n")
+        page = self.client.get(f'/story/{self.story_id}').get_data(as_text=True)
+        self.assertIn('generation-output', page)
+
+        # Sem nova escrita, a conexão termina pelo limite de tempo
+        with patch.object(web_app, 'WEB_SSE_POLL_INTERVAL', 0.01), \
+                patch.object(web_app, 'WEB_SSE_MAX_SECONDS', 0.05):
+            body = self.client.get(f'/story/{self.story_id}/stream').get_data(as_text=True)
+        self.assertIn('event: snapshot\ndata: "Cenário: Parcial\\n"', body)
+
+        self.db_manager.update_generation_progress(self.story_id, "Cenário: Parcial\n", status="failed")
+        body = self.client.get(f'/story/{self.story_id}/stream').get_data(as_text=True)
+        self.assertIn('event: failed', body)
+
+        self.db_manager.clear_generation_progress(self.story_id)
+        body = self.client.get(f'/story/{self.story_id}/stream').get_data(as_text=True)
+        self.assertEqual(body, 'event: done\ndata: {}\n\n')
+
+
+class TestJiraWebhook(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DBManager(db_path=os.path.join(self.tmp_dir.name, 'qa_agent.db'))
+        for name, value in (('db_manager', self.db_manager), ('JIRA_WEBHOOK_SECRET', 'segredo'),
+                            ('JIRA_PROJECT_KEY', 'KCA'), ('JIRA_STATUS', 'To Do')):
+            patcher = patch.object(web_app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = web_app.app.test_client()
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def _event(self, key='KCA-7', issue_type='Story', updated='2024-01-01T10:00:00.000+0000'):
+        return json.dumps({
+            'webhookEvent': 'jira:issue_updated',
+            'issue': {'key': key, 'fields': {
+                'summary': 'Login', 'description': 'Descrição', 'status': {'name': 'To Do'},
+                'updated': updated, 'project': {'key': 'KCA'}, 'issuetype': {'name': issue_type},
+            }},
+        }).encode()
+
+    def _post(self, body, secret='segredo', delivery='entrega-1'):
+        signature = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post('/webhooks/jira', data=body, content_type='application/json', headers={
+            'X-Hub-Signature': signature, 'X-Atlassian-Webhook-Identifier': delivery,
+        })
+
+    def test_story_is_queued_once_per_delivery(self):
+        body = self._event()
+        self.assertEqual(self._post(body).status_code, 202)
+        # Reenvio da mesma entrega
+        self.assertEqual(self._post(body).get_json()['status'], 'duplicate')
+        job = self.db_manager.claim_job('w1', 60)
+        self.assertEqual(job['kind'], 'story')
+        self.assertEqual(job['payload']['key'], 'KCA-7')
+        self.assertIsNone(self.db_manager.claim_job('w1', 60))
+
+    def test_invalid_secret_and_other_issues(self):
+        self.assertEqual(self._post(self._event(), secret='errado').status_code, 401)
+        response = self.client.post('/webhooks/jira?token=segredo', data=self._event(issue_type='Bug'))
+        self.assertEqual(response.get_json()['status'], 'ignored')
+        self.assertEqual(self.db_manager.get_job_counts(), {})
+        with patch.object(web_app, 'JIRA_WEBHOOK_SECRET', ''):
+            self.assertEqual(self._post(self._event()).status_code, 404)
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_web_app_does_not_import_service_clients(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            env = dict(os.environ, QA_AGENT_DB_PATH=os.path.join(tmp_dir, 'qa_agent.db'))
+            code = "import sys, web_app; print(sorted({'main', 'openai', 'jira'} & set(sys.modules)))"
+            output = subprocess.run(
+                [sys.executable, '-c', code], cwd=os.path.join(os.path.dirname(__file__), '../src'),
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+        self.assertEqual(output.strip(), '[]')
+
+
+if __name__ == "__main__":
+    unittest.main()